@@ -55,8 +55,12 @@ def parse_arguments():
 
 def main(config):
     from libs.Cosecha.Harvest import Harvest
+    from libs.Cosecha.Shard import ShardedHarvest
 
-    cosecha = Harvest(config=config)
+    if config.harvestWorkers or config.shardRun:
+        cosecha = ShardedHarvest(config=config)
+    else:
+        cosecha = Harvest(config=config)
 
     cosecha.go()
 
@@ -0,0 +1,198 @@
+import logging
+from abc import ABCMeta, abstractmethod
+from glob import escape, glob
+from os import path
+from threading import RLock
+from typing import Dict, Optional, Set
+
+from .Config import ARCHIVEVALIDLAYOUTS, globalConfig
+from ..Utils.Files import deserializeMetadata, serializeMetadata, shaData
+from ..Utils.PackFile import INDEXEXTENSION, PackFile
+from ..Utils.Payload import MediaPayload
+
+
+class ArchiveStore(metaclass=ABCMeta):
+    """
+    Storage for media & metadata files. The default layout ('tree': one image and one metadata file per comic) is
+    handled by ComicPage itself, so there is no object for it.
+    """
+    layout: Optional[str] = None
+
+    def __init__(self, globalCFG: globalConfig):
+        self.globalCFG: globalConfig = globalCFG
+        self.imagesFolder: str = globalCFG.imagesD()
+
+    def __str__(self):
+        result = f"Archive: layout: '{self.layout}' location: '{self.imagesFolder}'"
+        return result
+
+    __repr__ = __str__
+
+    @abstractmethod
+    def saveItem(self, page, storeMetadata: bool = True) -> str:
+        """Stores media (and metadata if requested) of a downloaded ComicPage. Returns the location of the data"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def itemExists(self, page) -> bool:
+        """Checks if media for ComicPage is stored and matches its hash"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def mediaPayload(self, page) -> Optional[MediaPayload]:
+        """Returns a handle to the stored media of ComicPage (or None if not there)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def itemIds(self, key: str) -> Set[str]:
+        """Returns the ids of the comics stored for a key"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def loadMetadata(self, key: str, comicId: str) -> Optional[dict]:
+        """Returns stored metadata for a comic (or None if not there)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def loadMedia(self, key: str, comicId: str) -> Optional[bytes]:
+        """Returns stored media for a comic (or None if not there)"""
+        raise NotImplementedError
+
+
+class PackArchive(ArchiveStore):
+    """
+    Media and metadata of comics appended to pack files. There is a pack for each directory of the 'tree' layout
+    (see ComicPage.dataPath), so a comic stored in images/xkcd/00500/xkcd.00510-xxx.png goes to images/xkcd/00500.pack
+    """
+    layout = 'pack'
+
+    def __init__(self, globalCFG: globalConfig):
+        super().__init__(globalCFG)
+        self.packs: Dict[str, PackFile] = dict()
+        self.catalogs: Dict[str, Dict[str, PackFile]] = dict()
+        self.lock: RLock = RLock()  # Items may be saved by a thread while others check what is in archive
+
+    def packBasename(self, page) -> str:
+        return path.join(self.imagesFolder, *(page.dataPath()))
+
+    def getPack(self, basename: str) -> PackFile:
+        with self.lock:
+            if basename not in self.packs:
+                self.packs[basename] = PackFile(basename).load()
+
+            return self.packs[basename]
+
+    def catalog(self, key: str) -> Dict[str, PackFile]:
+        """
+        Index of comicId -> PackFile for all the packs of a key. Built on first use.
+        :param key: key of comic
+        :return: dict
+        """
+        with self.lock:
+            if key in self.catalogs:
+                return self.catalogs[key]
+
+            result: Dict[str, PackFile] = dict()
+            indexFiles = glob(path.join(escape(self.imagesFolder), escape(key), '**', f"*.{INDEXEXTENSION}"),
+                              recursive=True)
+            keyIndex = path.join(self.imagesFolder, f"{key}.{INDEXEXTENSION}")
+            if path.exists(keyIndex):
+                indexFiles.append(keyIndex)
+
+            for indexFile in sorted(indexFiles):
+                pack = self.getPack(indexFile.removesuffix(f".{INDEXEXTENSION}"))
+                for itemId in pack.index:
+                    result[itemId] = pack
+            logging.debug(f"{self}: catalog for '{key}': {len(result)} items in {len(indexFiles)} packs")
+            self.catalogs[key] = result
+
+            return result
+
+    def lookup(self, key: str, comicId: str) -> Optional[PackFile]:
+        return self.catalog(key).get(comicId)
+
+    def saveItem(self, page, storeMetadata: bool = True) -> str:
+        with self.lock, page.payload.view() as media:
+            pack = self.getPack(self.packBasename(page))
+
+            blobs = {'media': media}
+            extra = {'fname': page.info['fname'], 'mediaHash': page.mediaHash, 'mimeType': page.mimeType,
+                     'mediaURL': page.mediaURL, 'mediaSize': page.size()}
+            if page.info.get('mediaETag'):
+                extra['mediaETag'] = page.info['mediaETag']
+            if storeMetadata:
+                blobs['metadata'] = serializeMetadata(page.info, self.globalCFG.metadataFormat)
+                extra['metadataFormat'] = self.globalCFG.metadataFormat
+            pack.append(page.comicId, blobs=blobs, extra=extra)
+            del blobs
+
+            if page.key in self.catalogs:
+                self.catalogs[page.key][page.comicId] = pack
+
+            return pack.packFilename
+
+    def itemExists(self, page) -> bool:
+        with self.lock:
+            pack = self.getPack(self.packBasename(page))
+            entry = pack.entry(page.comicId)
+            if entry is None:
+                return False
+
+            try:
+                hashData = shaData(pack.read(page.comicId, 'media'))
+            except (KeyError, ValueError) as exc:
+                logging.warning(f"{self}: problems reading '{page.key}' {page.comicId}: {exc}")
+                return False
+
+            return hashData == entry.get('mediaHash')
+
+    def mediaPayload(self, page) -> Optional[MediaPayload]:
+        with self.lock:
+            pack = self.getPack(self.packBasename(page))
+            entry = pack.entry(page.comicId)
+            if entry is None or 'media' not in entry['blobs']:
+                return None
+            offset, size = entry['blobs']['media']
+
+            return MediaPayload.fromFile(pack.packFilename, size=size, offset=offset)
+
+    def itemIds(self, key: str) -> Set[str]:
+        return set(self.catalog(key).keys())
+
+    def loadMetadata(self, key: str, comicId: str) -> Optional[dict]:
+        with self.lock:
+            pack = self.lookup(key, comicId)
+            if pack is None:
+                return None
+            entry = pack.entry(comicId)
+            if 'metadata' not in entry['blobs']:
+                return None
+
+            return deserializeMetadata(pack.read(comicId, 'metadata'), entry.get('metadataFormat', 'yaml'))
+
+    def loadMedia(self, key: str, comicId: str) -> Optional[bytes]:
+        with self.lock:
+            pack = self.lookup(key, comicId)
+            if pack is None:
+                return None
+
+            return pack.read(comicId, 'media')
+
+
+ARCHIVECLASSES = {'pack': PackArchive}
+
+
+def createArchive(globalCFG: globalConfig) -> Optional[ArchiveStore]:
+    """
+    Builds the archive object for the configured layout
+    :param globalCFG: global configuration
+    :return: an ArchiveStore or None for the default ('tree') layout
+    """
+    layout = globalCFG.archiveLayout.lower()
+    if layout not in ARCHIVEVALIDLAYOUTS:
+        raise ValueError(f"Archive layout '{globalCFG.archiveLayout}' unknown. Known ones are {ARCHIVEVALIDLAYOUTS}")
+
+    if layout not in ARCHIVECLASSES:
+        return None
+
+    return ARCHIVECLASSES[layout](globalCFG)
@@ -1,27 +1,37 @@
 import logging
 from abc import ABCMeta, abstractmethod
-from datetime import datetime
+from datetime import date, datetime
+from base64 import encodebytes
+from email.message import Message
 from email.mime.image import MIMEImage
 from email.utils import make_msgid
 from os import makedirs, path
 from typing import Callable, Dict, List, Optional
 from urllib.parse import urlsplit
 
-import magic
 import validators
 
+from libs.Cosecha.Archive import ArchiveStore
 from libs.Cosecha.Config import DAYSOFWEEK, TIMESTAMPFORMAT
 from libs.Cosecha.StoreManager import DBStorage
-from libs.Utils.Files import extensionFromType, loadYAML, saveYAML, shaData, shaFile
+from libs.Utils.Files import (DEFAULTMETADATAFORMAT, extensionFromType, findMetadataFile, loadMetadata,
+                              mimeTypeFromData, saveMetadata, shaData, shaFile)
 from libs.Utils.Misc import getUTC, prepareBuilderPayloadObj
-from libs.Utils.Web import DownloadRawPage
+from libs.Utils.Payload import MediaPayload
+from libs.Utils.Web import DownloadMedia, DownloadRawPage, ProbeMedia
 
 commit: Optional[Callable] = None
 
+MAILENCODEBLOCK = 57 * 1024  # Bytes of media encoded at once for mail (base64 lines are made of 57 bytes)
+
 logger = logging.getLogger()
 
 
 class ComicPage(metaclass=ABCMeta):
+    # What a downloaded page is made of for reports and mail (see resultState)
+    resultElements = {'URL', 'key', 'timestamp', 'comicDate', 'comicId', 'mediaURL', 'payload', 'mediaHash',
+                      'mediaAttId', 'mimeType', 'info', 'otherInfo', 'saveFilePath', 'saveMetadataPath', 'linkNext',
+                      'linkPrev', 'linkFirst', 'linkLast'}
 
     def __init__(self, **kwargs):
         auxKey = kwargs.get('key', None)
@@ -37,7 +47,7 @@ class ComicPage(metaclass=ABCMeta):
         self.comicDate: Optional[str] = None  # Date from page (if nay)
         self.comicId: Optional[str] = kwargs.get('comicId', None)  # Any identifier related to page (if any)
         self.mediaURL: Optional[str] = kwargs.get('mediaURL', None)
-        self.data: Optional[bytes] = None  # Actual image
+        self.payload: Optional[MediaPayload] = None  # Actual image (in memory or, once saved, in its file)
         self.mediaHash: Optional[str] = None
         self.mediaAttId: Optional[str] = None
         self.mimeType: Optional[str] = None
@@ -54,7 +64,7 @@ class ComicPage(metaclass=ABCMeta):
         self.linkLast: Optional[str] = None
 
     def __str__(self):
-        dataStr = f"[{self.size()}b]" if self.data else "No data"
+        dataStr = f"[{self.size()}b]" if self.payload is not None else "No data"
         idStr = f"{self.comicId}"
         dateStr = f" ({self.dayWeek()})" if self.datePub() else ""
 
@@ -64,10 +74,20 @@ class ComicPage(metaclass=ABCMeta):
 
     __repr__ = __str__
 
+    @property
+    def data(self) -> Optional[bytes]:
+        if self.payload is None:
+            return None
+        return self.payload.read()
+
+    @data.setter
+    def data(self, content: Optional[bytes]):
+        self.payload = None if content is None else MediaPayload(content=content)
+
     def size(self):
-        if self.data is None:
+        if self.payload is None:
             return None
-        return len(self.data)
+        return self.payload.size
 
     def datePub(self) -> Optional[datetime]:
         if not self.comicDate:
@@ -81,12 +101,45 @@ class ComicPage(metaclass=ABCMeta):
 
         return DAYSOFWEEK[self.otherInfo['datetimePub'].isocalendar().weekday]
 
+    @classmethod
+    def feedPages(cls, **kwargs) -> Optional[List['ComicPage']]:
+        """
+        Plugins that can learn about several recent comics with a single request (i.e. a feed) return them, oldest
+        first. Pages whose comicId is None couldn't be filled from the feed and need downloadPage to be called.
+        :param kwargs: parameters from the runner configuration (key...)
+        :return: list of pages or None if plugin does not support it
+        """
+        return None
+
+    @classmethod
+    def dateURL(cls, key: str, day: date) -> Optional[str]:
+        """
+        Plugins whose comics can be addressed by date return the URL of the comic published that day
+        :param key: key of comic
+        :param day: date of comic
+        :return: URL or None if plugin does not support it
+        """
+        return None
+
+    @classmethod
+    def idURL(cls, key: str, comicId: str) -> Optional[str]:
+        """
+        Plugins whose comics can be addressed by id return the URL of the comic (used to seed frontiers of runners)
+        :param key: key of comic
+        :param comicId: id of comic
+        :return: URL or None if plugin does not support it
+        """
+        return None
+
     @abstractmethod
     def downloadPage(self):
         """Downloads the page of the object and fills in fields"""
         raise NotImplementedError
 
     def downloadMedia(self):
+        """
+        Downloads the media of the page (see remoteMediaChanged to check it against a stored copy first)
+        """
         # If there is no URL for media, tries to download the page (again)
         if self.mediaURL is None:
             self.downloadPage()
@@ -94,14 +147,35 @@ class ComicPage(metaclass=ABCMeta):
         if self.mediaURL is None:
             raise ValueError(f"Unable to find media {self.URL}")
 
-        img = DownloadRawPage(self.mediaURL, here=self.URL, allow_redirects=True)
+        img = DownloadMedia(self.mediaURL, here=self.URL)
         self.timestamp = img.timestamp
         self.info['timestamp'] = img.timestamp.strftime(TIMESTAMPFORMAT)
-        self.data = img.data
+        self.payload = MediaPayload(content=img.data)
+        with self.payload.view() as media:
+            self.info['mediaHash'] = self.mediaHash = shaData(media)
+            self.info['mimeType'] = self.mimeType = mimeTypeFromData(media)
         self.info['mediaURL'] = self.mediaURL = img.source
-        self.info['mediaHash'] = self.mediaHash = shaData(img.data)
+        self.info['mediaSize'] = self.payload.size
+        if img.extra.get('ETag'):
+            self.info['mediaETag'] = img.extra['ETag']
         self.mediaAttId = make_msgid(domain=self.key)[1:-1]
-        self.info['mimeType'] = self.mimeType = magic.detect_from_content(self.data).mime_type
+
+    def remoteMediaChanged(self, known: dict) -> Optional[bool]:
+        """
+        Compares the media at mediaURL with the one stored (without downloading it)
+        :param known: metadata of stored copy (mediaURL, mediaSize, mediaETag)
+        :return: True if it changed, False if it is the same one, None if it can't be told
+        """
+        if known.get('mediaURL') != self.mediaURL or not (known.get('mediaSize') or known.get('mediaETag')):
+            return None
+        probe = ProbeMedia(self.mediaURL, here=self.URL)
+        if probe is None:
+            return None
+        if known.get('mediaETag') and probe.etag:
+            return known['mediaETag'] != probe.etag
+        if known.get('mediaSize') and probe.size is not None:
+            return int(known['mediaSize']) != probe.size
+        return None
 
     def getRaw(self, sanitizer: Optional[Callable[[bytes], bytes]] = None):
         """ Commodity function for development. Returns the page as-is (without parsing nor preprocessing)"""
@@ -162,30 +236,35 @@ class ComicPage(metaclass=ABCMeta):
 
         return pathList
 
-    def saveFiles(self, imgFolder: str, metadataFolder: str, dbStore: Optional[DBStorage] = None, storeJSON: bool = True
+    def saveFiles(self, imgFolder: str, metadataFolder: str, dbStore: Optional[DBStorage] = None, storeJSON: bool = True,
+                  archive: Optional[ArchiveStore] = None, metadataFormat: str = DEFAULTMETADATAFORMAT
                   ):
-        if self.data is None:
+        if self.payload is None:
             raise ValueError("saveFile: empty file")
 
-        dataFullPath = path.join(imgFolder, *(self.dataPath()))
-        makedirs(dataFullPath, mode=0o755, exist_ok=True)
-        dataFilename = path.join(dataFullPath, self.dataFilename())
         self.info['fname'] = self.dataFilename()
+        if archive is None:
+            dataFullPath = path.join(imgFolder, *(self.dataPath()))
+            makedirs(dataFullPath, mode=0o755, exist_ok=True)
+            dataFilename = path.join(dataFullPath, self.dataFilename())
 
-        with open(dataFilename, "wb") as bin_file:
-            bin_file.write(self.data)
-        self.saveFilePath = dataFilename
+            with open(dataFilename, "wb") as bin_file, self.payload.view() as media:
+                bin_file.write(media)
+            self.saveFilePath = dataFilename
 
         self.updateInfoLinks()
         self.updateOtherInfo()
 
-        if storeJSON:
+        if archive is not None:
+            self.saveFilePath = archive.saveItem(self, storeMetadata=storeJSON)
+            if storeJSON:
+                self.saveMetadataPath = self.saveFilePath
+        elif storeJSON:
             metaFullPath = path.join(metadataFolder, *(self.metadataPath()))
             makedirs(metaFullPath, mode=0o755, exist_ok=True)
             metadataFilename = path.join(metaFullPath, self.metadataFilename())
-            self.saveMetadataPath = metadataFilename
 
-            saveYAML(self.info, metadataFilename)
+            self.saveMetadataPath = saveMetadata(self.info, metadataFilename, fmt=metadataFormat)
 
         if dbStore is not None:
             global commit
@@ -193,12 +272,44 @@ class ComicPage(metaclass=ABCMeta):
             if commit is None:
                 commit = dbStore.module.commit
 
-        self.updateDBmetadataRecord(dbStore=dbStore)
+            self.updateDBmetadataRecord(dbStore=dbStore)
 
-    def exists(self, imgFolder: str, metadataFolder: str, dbStore: Optional[DBStorage] = None, storeJSON: bool = True
+    def releasePayload(self, archive: Optional[ArchiveStore] = None):
+        """
+        Once saved, media is read from its stored copy when needed (mail) instead of being kept in memory
+        """
+        if self.payload is None or not self.payload.inMemory():
+            return
+        if archive is not None:
+            stored = archive.mediaPayload(self)
+        elif self.saveFilePath:
+            stored = MediaPayload.fromFile(self.saveFilePath, size=self.payload.size)
+        else:
+            stored = None
+        if stored is not None and stored.size == self.payload.size:
+            self.payload = stored
+
+    def resultState(self) -> dict:
+        """
+        Data of a downloaded page (media as a handle, see releasePayload) so it can be rebuilt in another process
+        """
+        result = {k: getattr(self, k) for k in self.resultElements}
+        return result
+
+    def restoreResultState(self, state: dict):
+        for k in self.resultElements.intersection(state):
+            setattr(self, k, state[k])
+
+        return self
+
+    def exists(self, imgFolder: str, metadataFolder: str, dbStore: Optional[DBStorage] = None, storeJSON: bool = True,
+               archive: Optional[ArchiveStore] = None
                ) -> bool:
         global commit
 
+        if archive is not None:
+            return archive.itemExists(self)
+
         metadataFilename = path.join(metadataFolder, *(self.metadataPath()), self.metadataFilename())
         dataPath = path.join(imgFolder, *(self.dataPath()))
 
@@ -214,9 +325,10 @@ class ComicPage(metaclass=ABCMeta):
                 pass
         if (not metadata):
             if storeJSON:
-                if not path.exists(metadataFilename):
+                realMetadataFilename = findMetadataFile(metadataFilename)
+                if realMetadataFilename is None:
                     return False
-                metadata = loadYAML(metadataFilename)
+                metadata = loadMetadata(realMetadataFilename)
             else:
                 return False
         if not metadata:
@@ -253,7 +365,7 @@ class ComicPage(metaclass=ABCMeta):
         return True
 
     def fileExtension(self):
-        if self.data is None:  # Not downloaded, get the info from URL
+        if self.payload is None:  # Not downloaded, get the info from URL
             if not self.mediaURL:
                 raise ValueError(f"Called function with mediaURL set")
             urlpath = urlsplit(self.mediaURL).path
@@ -271,11 +383,14 @@ class ComicPage(metaclass=ABCMeta):
         return text
 
     def prepareAttachment(self):
-        if self.data is None:
+        if self.payload is None:
             raise ValueError("Trying to attach non existent data")
 
         filename = self.dataFilename()
-        part = MIMEImage(self.data, name=filename)
+        subtype = (self.mimeType or 'application/octet-stream').split('/')[-1]
+        with self.payload.view() as media:
+            # Media is encoded (copied) when part is created. Mapping of stored file is not needed after that
+            part = MIMEImage(media, _subtype=subtype, _encoder=encodeViewBase64, name=filename)
         part.add_header("Content-Disposition", f"inline; filename=\"{filename}\"")
         part.add_header("X-Attachment-Id", self.mediaAttId)
         part.add_header("Content-ID", f"<{self.mediaAttId}>")
@@ -315,3 +430,16 @@ class ComicPage(metaclass=ABCMeta):
         except dbStore.obj.RowNotFound as exc:
             newRecord = self.createDBmetadataRecord(dbStore=dbStore)
             return newRecord
+
+
+def encodeViewBase64(msg: Message):
+    """
+    Same as email.encoders.encode_base64 but payload may be any bytes-like object (i.e. a memoryview of the stored
+    file), which is encoded as it is instead of being copied to bytes first. It is encoded by blocks (of whole lines)
+    so intermediate results are small
+    """
+    data = msg.get_payload()
+    pieces = [encodebytes(data[start:start + MAILENCODEBLOCK]).decode('ascii') for start in
+              range(0, len(data), MAILENCODEBLOCK)]
+    msg.set_payload(''.join(pieces))
+    msg['Content-Transfer-Encoding'] = 'base64'
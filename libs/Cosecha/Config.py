@@ -11,24 +11,32 @@ from typing import Dict, List, Optional
 import validators
 from configargparse import ArgParser
 
+from ..Utils.Files import DEFAULTMETADATAFORMAT, METADATAFORMATS, msgpack
+from ..Utils.Web import DEFAULTCONNECTTIMEOUT, DEFAULTHOSTCONCURRENCY, DEFAULTREADTIMEOUT, DEFAULTRETRIES
+
 RUNNERFILEEXTENSION = "conf"
 
-RUNNERVALIDMODES = {'poll', 'crawler'}
+RUNNERVALIDMODES = {'poll', 'crawler', 'dates'}
 RUNNERVALIDINITIALS = {'*first', '*last'}
-RUNNERBATCHMODES = {'crawler'}
-RUNNERVALIDPOLLINTERVALS = {'none', 'daily', 'weekly', 'biweekly', 'monthly', 'bimonthly', 'quarterly'}
+RUNNERBATCHMODES = {'crawler', 'dates'}
+RUNNERVALIDPOLLINTERVALS = {'none', 'daily', 'weekly', 'biweekly', 'monthly', 'bimonthly', 'quarterly',
+                            'adaptive'}
 
 DEFAULTRUNNERMODE = "poll"
 DEFAULTRUNNERBATCHSIZE = 7
 DEFAULTPOLLINTERVAL = 'daily'
 
 STOREVALIDBACKENDS = {'Pony', 'None'}
+ARCHIVEVALIDLAYOUTS = {'tree', 'pack'}
+DEFAULTARCHIVELAYOUT = 'tree'
 
 GMTIMEFORMATFORMAIL = "%Y/%m/%d-%H:%M %z"
 TIMESTAMPFORMAT = "%Y%m%d-%H%M%S %z"
 TIMESTAMPFORMATORM = "%Y-%m-%d %H:%M:%S%z"  # 2024-04-04 06:31:07+00:00
 GOCOMICSDATE = "%Y-%m-%d"
+RUNNERSTARTDATE = "%Y-%m-%d"
 SMBCDATE = '%Y-%m-%dT%H:%M:%S%z'
+FEEDDATE = '%Y-%m-%dT%H:%M:%S%z'
 DAYSOFWEEK = {1: "Lun", 2: "Mar", 3: "Mie", 4: "Jue", 5: "Vie", 6: "Sab", 7: "Dom"}
 IDPATHDIVIDER: int = 500
 
@@ -130,6 +138,9 @@ class runnerConfig:
     initial: Optional[str] = '*last'
     batchSize: int = DEFAULTRUNNERBATCHSIZE
     pollInterval: Optional[str] = DEFAULTPOLLINTERVAL
+    startDate: Optional[str] = None
+    catchUp: bool = False
+    frontier: bool = False
 
     def __post_init__(self):
         if not isinstance(self.batchSize, int):
@@ -159,6 +170,12 @@ class runnerConfig:
         if not ((self.pollInterval is None) or (self.pollInterval.lower() in RUNNERVALIDPOLLINTERVALS)):
             problems.append(f"Provided mode '{self.pollInterval}'not valid. Valid modes are None or any of "
                             f"{RUNNERVALIDPOLLINTERVALS}")
+        if self.startDate is not None:
+            try:
+                datetime.strptime(self.startDate, RUNNERSTARTDATE)
+            except ValueError:
+                problems.append(f"{self.__class__}:{self.filename} 'startDate' value '{self.startDate}' doesn't match "
+                                f"format '{RUNNERSTARTDATE}'")
 
         # TOTHINK: Check module exists?
         for msg in problems:
@@ -204,6 +221,9 @@ class globalConfig:
     dontSendEmails: bool = False
     dontSave: bool = False
     ignorePollInterval: bool = False
+    catchUp: bool = False
+    ignoreNegativeCache: bool = False
+    ignoreRedirectCache: bool = False
     mailCFG: Optional[mailConfig] = None
     runnersData: List[runnerConfig] = field(default_factory=list)
     requiredRunners: List[str] = field(default_factory=list)
@@ -211,12 +231,43 @@ class globalConfig:
     defaultPollInterval: Optional[str] = DEFAULTPOLLINTERVAL
     storeCFG: Optional[storeConfig] = None
     storeJSON: bool = True
+    archiveLayout: str = DEFAULTARCHIVELAYOUT
+    metadataFormat: str = DEFAULTMETADATAFORMAT
+    hostConcurrency: int = DEFAULTHOSTCONCURRENCY
+    parseWorkers: int = 0
+    harvestWorkers: int = 0
+    shardRun: Optional[str] = None
+    hostInterval: Optional[float] = None  # Seconds. None: no minimum time between requests to a site
+    connectTimeout: int = DEFAULTCONNECTTIMEOUT
+    readTimeout: int = DEFAULTREADTIMEOUT
+    retries: int = DEFAULTRETRIES
+    hedgeRequests: bool = False
+    dontMemoRequests: bool = False
+    runDeadline: int = 0
     initializeStoreDB: bool = False
     verbose: bool = False
     printReport: bool = True
     printReportAlways: bool = False
     printDetailedReport: bool = False
 
+    def __post_init__(self):
+        if not self.check():
+            raise ValueError(f"globalConfig: '{self.filename}' not valid")
+
+    def check(self):
+        problems = list()
+
+        if self.metadataFormat not in METADATAFORMATS:
+            problems.append(f"{self.filename}: 'metadataFormat' has not a valid value '{self.metadataFormat}'. Valid "
+                            f"values are {set(METADATAFORMATS.keys())}")
+        elif self.metadataFormat == 'msgpack' and msgpack is None:
+            problems.append(f"{self.filename}: 'metadataFormat' is 'msgpack' but module msgpack is not installed")
+
+        for msg in problems:
+            logging.error(msg)
+
+        return len(problems) == 0
+
     @classmethod
     def createFromArgs(cls, args: Namespace):
         fielsAddedLater = {'runnersData'}
@@ -290,6 +341,50 @@ class globalConfig:
         parser.add_argument('-b', '--stateDatabase', dest='databaseDirectory', type=str, env_var='CS_DESTDIRDB',
                             help='Location to store database files (supersedes ${CS_DATADIR}/db', required=False)
 
+        parser.add_argument('--archive-layout', dest='archiveLayout', type=str, env_var='CS_ARCHIVELAYOUT',
+                            help=f"How images & metadata are stored. Valid values: {ARCHIVEVALIDLAYOUTS}",
+                            required=False)
+
+        parser.add_argument('--metadata-format', dest='metadataFormat', type=str, env_var='CS_METADATAFORMAT',
+                            help=f"Format of new metadata files. Valid values: {set(METADATAFORMATS.keys())}",
+                            required=False)
+
+        parser.add_argument('--host-concurrency', dest='hostConcurrency', type=int, env_var='CS_HOSTCONCURRENCY',
+                            help=f"Maximum number of simultaneous requests to a site (default: "
+                                 f"{DEFAULTHOSTCONCURRENCY})", required=False)
+        parser.add_argument('--host-interval', dest='hostInterval', type=float, env_var='CS_HOSTINTERVAL',
+                            help="Minimum time (in seconds) between requests to a site", required=False)
+
+        parser.add_argument('--parse-workers', dest='parseWorkers', type=int, env_var='CS_PARSEWORKERS',
+                            help="Processes for parsing pages and composing mails (default: 0, done by download "
+                                 "threads)", required=False)
+        parser.add_argument('--workers', dest='harvestWorkers', type=int, env_var='CS_WORKERS',
+                            help="Processes that share the runners to execute (default: 0, all of them in this one). "
+                                 "Results are merged for report and mail", required=False)
+        parser.add_argument('--shard-run', dest='shardRun', type=str, env_var='CS_SHARDRUN',
+                            help="Name of a sharded execution shared with other hosts (same state directory). Each "
+                                 "runner is executed once by any of them. Use a new one for every execution",
+                            required=False)
+
+        parser.add_argument('--connect-timeout', dest='connectTimeout', type=int, env_var='CS_CONNECTTIMEOUT',
+                            help=f"Seconds to wait for a connection (default: {DEFAULTCONNECTTIMEOUT})", required=False)
+        parser.add_argument('--read-timeout', dest='readTimeout', type=int, env_var='CS_READTIMEOUT',
+                            help=f"Seconds to wait for data from a site (default: {DEFAULTREADTIMEOUT})", required=False)
+        parser.add_argument('--retries', dest='retries', type=int, env_var='CS_RETRIES',
+                            help=f"Retries of a request after a timeout or a temporary error (default: "
+                                 f"{DEFAULTRETRIES})", required=False)
+        parser.add_argument('--hedge-requests', dest='hedgeRequests', action="store_true",
+                            env_var='CS_HEDGEREQUESTS',
+                            help="Repeat requests slower than usual for the site (95th percentile). First answer wins",
+                            required=False)
+        parser.add_argument('--no-request-memo', dest='dontMemoRequests', action="store_true",
+                            env_var='CS_NOREQUESTMEMO',
+                            help="Don't keep answers during execution (the same URL may be requested several times)",
+                            required=False)
+        parser.add_argument('--deadline', dest='runDeadline', type=int, env_var='CS_DEADLINE',
+                            help="Maximum time (seconds) for downloads. Once it is over, whatever was downloaded is "
+                                 "saved and sent", required=False)
+
         parser.add_argument('--initialize-db', dest='initializeStoreDB', action="store_true", help="Create DB objects",
                             required=False)
         parser.add_argument('-n', '--dry-run', dest='dryRun', action="store_true", env_var='CS_DRYRUN',
@@ -301,6 +396,16 @@ class globalConfig:
 
         parser.add_argument('--ignore-poll-interval', dest='ignorePollInterval', action="store_true",
                             env_var='CS_NOSAVE', help="Don't check poll intervals", required=False)
+        parser.add_argument('--ignore-negative-cache', dest='ignoreNegativeCache', action="store_true",
+                            env_var='CS_IGNORENEGATIVECACHE', help="Request URLs even if they failed recently",
+                            required=False)
+        parser.add_argument('--ignore-redirect-cache', dest='ignoreRedirectCache', action="store_true",
+                            env_var='CS_IGNOREREDIRECTCACHE',
+                            help="Request URLs as they are even if they were permanently redirected before",
+                            required=False)
+        parser.add_argument('--catch-up', dest='catchUp', action="store_true", env_var='CS_CATCHUP',
+                            help="Poll runners get all the comics published since the last one downloaded",
+                            required=False)
         parser.add_argument('-x', '--maxBatchSize', dest='maxBatchSize', type=int,
                             help='Maximum number of images to download for a crawler', required=False)
 
@@ -353,7 +458,7 @@ def mergeConfFileIntoDataClass(cls, parser: ConfigParser, sectionN: str) -> dict
                 value2add = parser[sectionN].getint(field)
             elif targetField.type == bool:
                 value2add = parser[sectionN].getboolean(field)
-            elif targetField.type == float:
+            elif targetField.type in (float, Optional[float]):
                 value2add = parser[sectionN].getfloat(field)
             else:
                 value2add = parser[sectionN].get(field).strip('"').strip("'")
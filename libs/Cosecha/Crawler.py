@@ -1,40 +1,67 @@
 import logging
-from datetime import datetime, timezone
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
 from io import UnsupportedOperation
-from os import makedirs
+from os import makedirs, path
 from time import struct_time
-from typing import Callable, Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Set
 
 import validators
 from requests import HTTPError
 
-from libs.Utils.Files import loadYAML, saveYAML
+from libs.Utils.Files import loadYAML, METADATAEXTENSIONS, saveYAML
 from libs.Utils.Misc import createPath, getUTC, UTC2local
+from .Archive import ArchiveStore
 from .ComicPage import ComicPage
-from .Config import globalConfig, parseDatatime, runnerConfig, RUNNERVALIDPOLLINTERVALS
+from .Config import globalConfig, parseDatatime, runnerConfig, RUNNERSTARTDATE, RUNNERVALIDPOLLINTERVALS
+from .Frontier import CrawlFrontier
+from .Schedule import metadataFromFiles, PollSchedule, publicationDatesFromDB, publicationDatesFromMetadata
 from .StoreManager import DBStorage
 from ..Utils.Python import LoadModule
+from ..Utils.Web import RunDeadlineExceeded
 
 commit: Optional[Callable] = None
 
+EMPTYDAYSKEY = 'emptyDays'  # Key of feedState with the days checked without comic (mode 'dates')
+
 
 class Crawler:
-    def __init__(self, runnerCFG: runnerConfig, globalCFG: globalConfig, dbStore: Optional[DBStorage] = None):
+    def __init__(self, runnerCFG: runnerConfig, globalCFG: globalConfig, dbStore: Optional[DBStorage] = None,
+                 archive: Optional[ArchiveStore] = None
+                 ):
         self.runnerCFG: runnerConfig = runnerCFG
         self.globalCFG: globalConfig = globalCFG
         self.dataStore: DBStorage = dbStore
+        self.archive: Optional[ArchiveStore] = archive
         self.name = self.runnerCFG.name
         self.state: CrawlerState = CrawlerState(runnerName=self.name, storePath=self.globalCFG.stateD(),
                                                 dbstore=self.dataStore, storeJSON=self.globalCFG.storeJSON).load()
         self.fullModuleName, self.module = LoadModule(moduleName=self.runnerCFG.module,
                                                       classLocation="libs.Cosecha.Sites")
-        self.obj: ComicPage = self.module.Page(URL=self.state.lastURL, **dict(self.runnerCFG.data['RUNNER']))
+        self.pageArgs: dict = dict(self.runnerCFG.data['RUNNER'])
+        self.obj: ComicPage = self.module.Page(URL=self.state.lastURL, **self.pageArgs)
         self.key: str = self.obj.key
+        self.pageArgs['key'] = self.key
         self.results: List[ComicPage] = list()
+        self.resultsSize: int = 0  # Bytes of media of results (kept as they are added)
+        self.saver: Optional[Callable[['Crawler', ComicPage], None]] = None
+        self.savedResults: List[ComicPage] = list()
+        self.saveFailed: bool = False
+        self.requestsSent: int = 0
+        self.duplicateHits: int = 0
+        self.duration: Optional[float] = None  # Seconds it took to run (see Harvest.download)
+        self.feedState: dict = self.loadFeedState()
+        self.schedule: Optional[PollSchedule] = self.loadSchedule()
+        self.frontier: Optional[CrawlFrontier] = None
+        self.frontierKeys: Dict[str, str] = dict()  # URL of page downloaded -> URL taken from frontier
+        if self.runnerCFG.frontier and self.runnerCFG.mode == "crawler":
+            self.frontier = CrawlFrontier(runnerName=self.name, storePath=self.globalCFG.stateD(),
+                                          readOnly=self.globalCFG.dryRun).load()
 
         logging.debug(f"CrawlerState: {self.state}")
         global commit
-        if commit is None:
+        if commit is None and self.dataStore is not None:
             commit = self.dataStore.module.commit
 
         if self.state.lastUpdated is None:
@@ -52,22 +79,86 @@ class Crawler:
         return len(self.results)
 
     def size(self):
-        return sum([img.size() for img in self.results])
+        return self.resultsSize
+
+    def itemLimit(self) -> int:
+        result = min(self.runnerCFG.batchSize, self.globalCFG.maxBatchSize)
+        return result
 
     def title(self):
         if self.runnerCFG.title is not None:
             return self.runnerCFG.title
         return self.name
 
+    def newPage(self, URL: str) -> ComicPage:
+        """
+        Creates a page of the crawler's plugin with the parameters of runner configuration
+        :param URL: URL of page
+        """
+        auxArgs = self.pageArgs.copy()
+        auxArgs['URL'] = URL
+        return self.module.Page(**auxArgs)
+
+    def addResult(self, page: ComicPage):
+        """
+        Adds a downloaded page to results. If there is a saver (see Harvest.SavePipeline), page is handed to it
+        """
+        self.results.append(page)
+        self.resultsSize += page.size() or 0
+        if self.saver is not None:
+            self.saver(self, page)
+
+    def setResults(self, pages: List[ComicPage]):
+        self.results = list(pages)
+        self.resultsSize = sum(page.size() or 0 for page in self.results)
+
+    def restoreResults(self, pageStates: List[dict]):
+        """
+        Sets as results the pages downloaded by another process (see ComicPage.resultState)
+        """
+        self.setResults([self.newPage(state['URL']).restoreResultState(state) for state in pageStates])
+
+    def feedStateFilename(self) -> str:
+        return path.join(self.globalCFG.stateD(), f"{self.name}.feed")
+
+    def loadFeedState(self) -> dict:
+        """
+        Data from previous downloads of feeds (ETag, Last-Modified...) so they are only downloaded if they've changed
+        """
+        try:
+            result = loadYAML(self.feedStateFilename())
+        except FileNotFoundError:
+            return dict()
+        except Exception as exc:
+            logging.warning(f"Crawler '{self.name}': problems reading feed state. Ignoring it. {type(exc)} {exc}")
+            return dict()
+
+        return result or dict()
+
+    def storeFeedState(self):
+        """
+        Stores data of feeds. Must be called only once all the results of the crawler have been saved, otherwise next
+        execution could skip items that were never stored
+        """
+        if not (self.feedState or path.exists(self.feedStateFilename())):
+            return
+        makedirs(self.globalCFG.stateD(), mode=0o755, exist_ok=True)
+        saveYAML(self.feedState, self.feedStateFilename())
+
     def go(self):
         if self.runnerCFG.mode == "crawler":
             self.crawl()
         elif self.runnerCFG.mode == "poll":
             self.poll()
+        elif self.runnerCFG.mode == "dates":
+            self.fillDates()
         else:
             raise TypeError(f"Unknown mode '{self.runnerCFG.mode}'")
 
     def crawl(self):
+        if self.frontier is not None:
+            self.crawlFrontier()
+            return
         remainingImgs = min(self.runnerCFG.batchSize, self.globalCFG.maxBatchSize)
         logging.debug(f"Crawler '{self.name}: batchSize: from global {self.globalCFG.maxBatchSize} from conf "
                       f"{self.runnerCFG.batchSize} -> {remainingImgs}")
@@ -75,34 +166,39 @@ class Crawler:
         downloadedOnce = False
         while remainingImgs > 0:
             try:
+                initialPage = None
                 if (self.state.lastURL is None) and not downloadedOnce:
                     self.obj.downloadPage()
+                    initialPage = self.obj
                     initialLink = self.runnerCFG.initial.lower()
                     if initialLink == '*first':
-                        self.obj = self.module.Page(key=self.key, URL=self.obj.linkFirst)
+                        self.obj = self.newPage(self.obj.linkFirst)
                     elif initialLink == '*last':
                         # We should already be on last edited picture but just in case
                         if self.obj.linkLast and self.obj.linkLast != self.obj.URL:
-                            self.obj = self.module.Page(key=self.key, URL=self.obj.linkLast)
+                            self.obj = self.newPage(self.obj.linkLast)
                     elif validators.url(self.runnerCFG.initial):
-                        self.obj = self.module.Page(key=self.key, URL=self.runnerCFG.initial)
+                        self.obj = self.newPage(self.runnerCFG.initial)
                     else:
                         raise ValueError(f"Runner: '{self.name}' {self.runnerCFG.filename}:Unknown initial value:'"
                                          f"{self.runnerCFG.initial}'")
-                self.obj.downloadPage()
+                if self.obj is not initialPage:
+                    self.obj.downloadPage()
                 downloadedOnce = True
-                if not self.obj.exists(self.globalCFG.imagesD(), self.globalCFG.metadataD()):
+                if not self.obj.exists(self.globalCFG.imagesD(), self.globalCFG.metadataD(), archive=self.archive):
                     logging.debug(f"'{self.name}': downloading new image")
                     self.obj.downloadMedia()
-                    self.results.append(self.obj)
+                    self.addResult(self.obj)
                     remainingImgs -= 1
-                    self.state.updateFromImage(self.obj)
                 else:
                     logging.debug(f"'{self.name}' {self.obj.URL}: already downloaded")
                 if self.obj.linkNext and self.obj.linkNext != self.obj.URL:
-                    self.obj = self.module.Page(key=self.key, URL=self.obj.linkNext)
+                    self.obj = self.newPage(self.obj.linkNext)
                 else:
                     break
+            except RunDeadlineExceeded as exc:
+                logging.warning(f"Crawler(crawl) '{self.name}': {exc}. Stopping with {len(self.results)} results")
+                break
             except HTTPError as exc:
                 logging.error(
                         f"Crawler(crawl) '{self.name}': Problems downloading media {self.obj.URL}: {self.obj.mediaURL} "
@@ -113,24 +209,145 @@ class Crawler:
                 logging.exception(exc, stack_info=True)
                 break
 
+    def crawlFrontier(self):
+        """
+        Crawls the URLs pending in the frontier of runner (taking up to batch size of them), adding the links to next
+        pages as they are found. If frontier is empty, it starts from last URL downloaded or from 'initial' of runner.
+        If nothing is pending in a frontier not seeded (it had caught up), last page crawled is checked for a new next
+        """
+        remainingImgs = min(self.runnerCFG.batchSize, self.globalCFG.maxBatchSize)
+        logging.info(f"Runner: '{self.name}'[{self.runnerCFG.module}] Crawling frontier: {self.frontier.describe()}")
+        leased: List[str] = []
+        processed: Set[str] = set()
+        try:
+            if not len(self.frontier):
+                self.frontier.add([self.state.lastURL or self.initialURL()])
+            checkedTail = False
+            while remainingImgs > 0:
+                newLeased = self.frontier.lease(remainingImgs)
+                if not newLeased:
+                    if checkedTail or self.frontier.seeded or self.frontier.pending:
+                        break
+                    checkedTail = True
+                    if not self.addNextOfTail():
+                        break
+                    continue
+                leased.extend(newLeased)
+                for url in newLeased:
+                    page = self.newPage(url)
+                    page.downloadPage()
+                    if page.exists(self.globalCFG.imagesD(), self.globalCFG.metadataD(), archive=self.archive):
+                        logging.debug(f"'{self.name}' {page.URL}: already downloaded")
+                        self.frontier.markDone([url])
+                    else:
+                        logging.debug(f"'{self.name}': downloading new image {page.URL} -> {page.mediaURL}")
+                        page.downloadMedia()
+                        self.frontierKeys[page.URL] = url
+                        self.addResult(page)
+                        remainingImgs -= 1
+                    processed.add(url)
+                    self.obj = page
+                    if page.linkNext and page.linkNext != page.URL:
+                        self.frontier.add([page.linkNext])
+                    else:
+                        self.frontier.setTail(url)
+        except RunDeadlineExceeded as exc:
+            logging.warning(f"Crawler(crawl) '{self.name}': {exc}. Stopping with {len(self.results)} results")
+        except HTTPError as exc:
+            logging.error(f"Crawler(crawl) '{self.name}': Problems downloading {self.obj.URL}: {exc}")
+        except Exception as exc:
+            logging.error(f"Crawler(crawl) '{self.name}': problem:{type(exc)} {exc}")
+            logging.exception(exc, stack_info=True)
+        self.frontier.release(url for url in leased if url not in processed)
+
+    def addNextOfTail(self) -> bool:
+        """
+        Downloads again the last page crawled (it had no next one) and adds its link to next page to the frontier
+        :return: True if something new was added
+        """
+        tailURL = self.frontier.tail or self.state.lastURL
+        if tailURL is None:
+            return False
+        page = self.newPage(tailURL)
+        page.downloadPage()
+        self.obj = page
+        if not page.linkNext or page.linkNext == page.URL:
+            logging.debug(f"'{self.name}' {tailURL}: nothing new after last page")
+            return False
+        return self.frontier.add([page.linkNext]) > 0
+
+    def initialURL(self) -> str:
+        """
+        URL of the first page to crawl according to 'initial' of runner (page of crawler is downloaded if needed)
+        """
+        if validators.url(self.runnerCFG.initial):
+            return self.runnerCFG.initial
+        initialLink = self.runnerCFG.initial.lower()
+        self.obj.downloadPage()
+        if initialLink == '*first':
+            return self.obj.linkFirst
+        if initialLink == '*last':
+            return self.obj.linkLast or self.obj.URL
+        raise ValueError(f"Runner: '{self.name}' {self.runnerCFG.filename}:Unknown initial value:'"
+                         f"{self.runnerCFG.initial}'")
+
+    def frontierSaved(self, page: ComicPage):
+        """
+        Marks as done in frontier a page that has been saved
+        """
+        if self.frontier is None:
+            return
+        self.frontier.markDone([self.frontierKeys.pop(page.URL, page.URL)])
+
+    def closeFrontier(self):
+        """
+        URLs taken by this execution that weren't saved go back to pending. Progress is recorded (for ETA)
+        """
+        if self.frontier is None:
+            return
+        self.frontier.releaseAll()
+        self.frontier.recordRun()
+        self.frontierKeys.clear()
+
     def poll(self):
         logging.info(f"Runner: '{self.name}'[{self.runnerCFG.module}] Polling")
+        try:
+            feedPages = self.module.Page.feedPages(feedState=self.feedState, **self.pageArgs)
+            if feedPages is not None:
+                self.pollFeed(feedPages)
+                return
+        except RunDeadlineExceeded as exc:
+            logging.warning(f"Crawler(poll) '{self.name}': {exc}. Stopping with {len(self.results)} results")
+            self.feedState.clear()
+            return
+        except HTTPError as exc:
+            logging.warning(f"Crawler(poll) '{self.name}': Problems downloading feed {exc}. Trying pages")
+        except Exception as exc:
+            logging.warning(f"Crawler(poll) '{self.name}': Problems processing feed {type(exc)} {exc}. Trying pages")
+            logging.exception(exc, stack_info=True)
+
+        if (self.runnerCFG.catchUp or self.globalCFG.catchUp) and self.state.lastURL:
+            self.pollCatchUp()
+            return
+
         try:
             self.obj.downloadPage()
             logging.debug(f"'{self.name}': downloading new image {self.obj.URL} -> {self.obj.mediaURL}")
             if self.obj.linkLast and self.obj.linkLast != self.obj.URL:
-                self.obj = self.module.Page(key=self.key, URL=self.obj.linkLast)
+                self.obj = self.newPage(self.obj.linkLast)
                 self.obj.downloadPage()
             elif self.obj.linkNext and self.obj.linkNext != self.obj.URL:
                 while (self.obj.linkNext and self.obj.linkNext != self.obj.URL):
-                    self.obj = self.module.Page(key=self.key, URL=self.obj.linkNext)
+                    self.obj = self.newPage(self.obj.linkNext)
                     self.obj.downloadPage()
-            if not self.obj.exists(self.globalCFG.imagesD(), self.globalCFG.metadataD()):
+            if not self.obj.exists(self.globalCFG.imagesD(), self.globalCFG.metadataD(), archive=self.archive):
                 logging.debug(f"'{self.name}': downloading new image {self.obj.URL} -> {self.obj.mediaURL}")
                 self.obj.downloadMedia()
-                self.results.append(self.obj)
+                self.addResult(self.obj)
             else:
                 logging.debug(f"'{self.name}': already downloaded")
+        except RunDeadlineExceeded as exc:
+            logging.warning(f"Crawler(poll) '{self.name}': {exc}")
         except HTTPError as exc:
             logging.error(
                     f"Crawler(poll) '{self.name}': Problems downloading media {self.obj.URL}: {self.obj.mediaURL} "
@@ -139,6 +356,247 @@ class Crawler:
             logging.error(f"Crawler(poll) '{self.name}': problem:{type(exc)} {exc}")
             logging.exception(exc, stack_info=True)
 
+    def pollFeed(self, feedPages: List[ComicPage]):
+        """
+        Gets all the comics from a feed that are not already in the archive (newest ones, up to batch size)
+        :param feedPages: pages provided by plugin (oldest first)
+        """
+        remainingImgs = min(self.runnerCFG.batchSize, self.globalCFG.maxBatchSize)
+        newPages: List[ComicPage] = []
+        complete = True
+        for page in reversed(feedPages):
+            if len(newPages) >= remainingImgs:
+                complete = False
+                break
+            try:
+                if page.comicId is None:
+                    page.downloadPage()
+                if page.exists(self.globalCFG.imagesD(), self.globalCFG.metadataD(), archive=self.archive):
+                    logging.debug(f"'{self.name}' {page.URL}: already downloaded")
+                    break
+                newPages.append(page)
+            except HTTPError as exc:
+                logging.error(f"Crawler(poll) '{self.name}': Problems downloading page {page.URL}: {exc}")
+                complete = False
+            except Exception as exc:
+                logging.error(f"Crawler(poll) '{self.name}': Problems with page {page.URL}: {type(exc)} {exc}")
+                logging.exception(exc, stack_info=True)
+                complete = False
+
+        for page in reversed(newPages):
+            try:
+                logging.debug(f"'{self.name}': downloading new image {page.URL} -> {page.mediaURL}")
+                page.downloadMedia()
+                self.addResult(page)
+                self.obj = page
+            except HTTPError as exc:
+                logging.error(f"Crawler(poll) '{self.name}': Problems downloading media {page.URL}: {page.mediaURL} "
+                              f"{exc}")
+                complete = False
+                break
+            except Exception as exc:
+                logging.error(f"Crawler(poll) '{self.name}': Problems with media {page.URL}: {page.mediaURL} "
+                              f"{type(exc)} {exc}")
+                logging.exception(exc, stack_info=True)
+                complete = False
+                break
+
+        if not complete:
+            # Feed must be processed again next time even if it hasn't changed
+            self.feedState.clear()
+
+    def pollCatchUp(self):
+        """
+        Gets the comics published since the last one downloaded (up to batch size), stopping at the first one already
+        in the archive. Pages must be followed one by one (each one has the link to the next) but media of those found
+        is downloaded meanwhile, with several threads
+        """
+        logging.info(f"Runner: '{self.name}'[{self.runnerCFG.module}] Catching up from {self.state.lastURL}")
+        remainingImgs = min(self.runnerCFG.batchSize, self.globalCFG.maxBatchSize)
+        pending = []
+
+        with ThreadPoolExecutor(max_workers=max(1, self.globalCFG.hostConcurrency)) as executor:
+            try:
+                page = self.newPage(self.state.lastURL)
+                page.downloadPage()
+                if self.state.lastId is not None and str(page.comicId) != str(self.state.lastId):
+                    logging.warning(f"Crawler(poll) '{self.name}': last page {self.state.lastURL} has id "
+                                    f"{page.comicId}, expected {self.state.lastId}")
+                while len(pending) < remainingImgs and page.linkNext and page.linkNext != page.URL:
+                    page = self.newPage(page.linkNext)
+                    page.downloadPage()
+                    if page.exists(self.globalCFG.imagesD(), self.globalCFG.metadataD(), archive=self.archive):
+                        logging.debug(f"'{self.name}' {page.URL}: already downloaded")
+                        break
+                    pending.append((page, executor.submit(page.downloadMedia)))
+            except RunDeadlineExceeded as exc:
+                logging.warning(f"Crawler(poll) '{self.name}': {exc}. Stopping with {len(pending)} pages found")
+            except HTTPError as exc:
+                logging.error(f"Crawler(poll) '{self.name}': Problems downloading page: {exc}")
+            except Exception as exc:
+                logging.error(f"Crawler(poll) '{self.name}': problem:{type(exc)} {exc}")
+                logging.exception(exc, stack_info=True)
+
+            for i, (page, future) in enumerate(pending):
+                try:
+                    future.result()
+                except Exception as exc:
+                    # Results must be consecutive so next execution continues from the last one saved
+                    logging.error(f"Crawler(poll) '{self.name}': Problems downloading media {page.URL}: "
+                                  f"{page.mediaURL} {type(exc)} {exc}")
+                    for _, laterFuture in pending[i + 1:]:
+                        laterFuture.cancel()
+                    break
+                self.addResult(page)
+                self.obj = page
+
+    def loadSchedule(self) -> Optional[PollSchedule]:
+        """
+        Publication pattern for runners with 'adaptive' poll interval. First time it is learnt from stored comics
+        """
+        if (self.runnerCFG.pollInterval or '').lower() != 'adaptive':
+            return None
+
+        result = PollSchedule(runnerName=self.name, storePath=self.globalCFG.stateD()).load()
+        if result.loaded:
+            return result
+
+        dateFormat = getattr(self.module.Page, 'DATEFORMAT', None)
+        if self.dataStore is not None:
+            dates = publicationDatesFromDB(self.dataStore, self.key, dateFormat)
+        elif self.archive is not None:
+            dates = publicationDatesFromMetadata(
+                    (self.archive.loadMetadata(self.key, i) or dict() for i in self.archive.itemIds(self.key)),
+                    dateFormat)
+        else:
+            dates = publicationDatesFromMetadata(metadataFromFiles(path.join(self.globalCFG.metadataD(), self.key)),
+                                                 dateFormat)
+        result.learn(dates)
+        logging.debug(f"Crawler '{self.name}': learnt {result}")
+
+        return result
+
+    def storeSchedule(self):
+        """
+        Adds results of this execution to the publication pattern (only for runners with 'adaptive' poll interval)
+        """
+        if self.schedule is None:
+            return
+        self.schedule.learn(pageDate(page) for page in self.results)
+        self.schedule.recordPoll(getUTC(), len(self.results))
+        self.schedule.store()
+
+    def fillDates(self):
+        """
+        Downloads the comics of the days missing in the archive (for plugins whose comics can be addressed by date).
+        Days go from startDate of runner (or the day after the last comic downloaded) to today. Pages are downloaded
+        concurrently. Past days without comic are kept in feedState so they are not checked (nor take room of the
+        batch) again
+        """
+        logging.info(f"Runner: '{self.name}'[{self.runnerCFG.module}] Filling dates")
+        today = date.today()
+        if self.module.Page.dateURL(self.key, today) is None:
+            raise TypeError(f"Runner: '{self.name}': module '{self.runnerCFG.module}' can't get comics by date")
+
+        remainingImgs = min(self.runnerCFG.batchSize, self.globalCFG.maxBatchSize)
+        archivedIds = self.archivedIds()
+        firstDay = self.firstDay(today, remainingImgs)
+        firstDayId = firstDay.strftime(self.module.Page.IDFROMDATE)
+        emptyDays: Set[str] = {d for d in self.feedState.get(EMPTYDAYSKEY, []) if d >= firstDayId}
+
+        pages: List[ComicPage] = []
+        expectedIds: List[str] = []
+        day = firstDay
+        while day <= today and len(pages) < remainingImgs:
+            dayId = day.strftime(self.module.Page.IDFROMDATE)
+            if dayId not in archivedIds and dayId not in emptyDays:
+                pages.append(self.newPage(self.module.Page.dateURL(self.key, day)))
+                expectedIds.append(dayId)
+            day += timedelta(days=1)
+        logging.debug(f"'{self.name}': {len(pages)} days missing from {expectedIds[:1]} to {expectedIds[-1:]}")
+
+        downloaded = self.fetchConcurrently(pages, lambda p: p.downloadPage())
+        newPages: Dict[str, ComicPage] = dict()
+        todayId = today.strftime(self.module.Page.IDFROMDATE)
+        for page, dayId in zip(downloaded, expectedIds):
+            if page is None:
+                continue
+            if page.comicId != dayId:  # No comic that day, site gives another one
+                logging.debug(f"'{self.name}' {dayId}: no comic, got {page.comicId} instead")
+                if dayId != todayId:  # Today's could be published later
+                    emptyDays.add(dayId)
+                continue
+            newPages[dayId] = page
+
+        if emptyDays or EMPTYDAYSKEY in self.feedState:
+            self.feedState[EMPTYDAYSKEY] = sorted(emptyDays)
+
+        for page in self.fetchConcurrently(list(newPages.values()), lambda p: p.downloadMedia()):
+            if page is not None:
+                self.addResult(page)
+                self.obj = page
+
+    def firstDay(self, today: date, numDays: int) -> date:
+        if self.runnerCFG.startDate:
+            return datetime.strptime(self.runnerCFG.startDate, RUNNERSTARTDATE).date()
+        if self.state.lastId:
+            try:
+                return datetime.strptime(self.state.lastId, self.module.Page.IDFROMDATE).date() + timedelta(days=1)
+            except ValueError:
+                logging.warning(f"'{self.name}': unable to get date from last id '{self.state.lastId}'")
+        return today - timedelta(days=numDays - 1)
+
+    def archivedIds(self) -> Set[str]:
+        """
+        Ids of the comics of crawler already stored (from archive, DB or metadata files)
+        """
+        if self.archive is not None:
+            return self.archive.itemIds(self.key)
+
+        result: Set[str] = set()
+        if self.dataStore is not None:
+            key = self.key
+            result.update(r.comicId for r in self.dataStore.obj.ImageMetadata.select(lambda r: r.key == key))
+        if self.globalCFG.storeJSON:
+            prefix = f"{self.key}."
+            for root, dirs, files in os.walk(path.join(self.globalCFG.metadataD(), self.key)):
+                for file in files:
+                    name, ext = path.splitext(file)
+                    if name.startswith(prefix) and ext.lstrip('.') in METADATAEXTENSIONS:
+                        result.add(name.removeprefix(prefix))
+
+        return result
+
+    def fetchConcurrently(self, pages: List[ComicPage], action: Callable[[ComicPage], None]
+                          ) -> List[Optional[ComicPage]]:
+        """
+        Applies action (downloadPage, downloadMedia...) to pages using several threads. Requests to each site are
+        limited by Web.hostThrottle
+        :param pages: list of pages
+        :param action: function to call for each page
+        :return: list with the pages (same order) or None for those that failed
+        """
+
+        def doAction(page: ComicPage) -> Optional[ComicPage]:
+            try:
+                action(page)
+                return page
+            except RunDeadlineExceeded as exc:
+                logging.warning(f"Crawler '{self.name}': {page.URL} {exc}")
+            except HTTPError as exc:
+                logging.warning(f"Crawler '{self.name}': Problems downloading {page.URL}: {exc}")
+            except Exception as exc:
+                logging.error(f"Crawler '{self.name}': {page.URL} problem:{type(exc)} {exc}")
+                logging.exception(exc, stack_info=True)
+            return None
+
+        if not pages:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(len(pages), self.globalCFG.hostConcurrency))) as executor:
+            result = list(executor.map(doAction, pages))
+
+        return result
+
     def checkPollSlot(self, now: struct_time) -> bool:
         """
         Checks if now is in a different poll spot than last successful one
@@ -155,6 +613,8 @@ class Crawler:
             return True
         if self.state.lastUpdated is None:
             return True
+        if mode.lower() == 'adaptive':
+            return self.schedule.shouldPoll(getUTC())
 
         DATEpoll = UTC2local(self.state.lastUpdated)
         DATEnow = UTC2local(getUTC())
@@ -184,6 +644,18 @@ class Crawler:
         raise KeyError("It shouldn't have got here")
 
 
+def pageDate(page: ComicPage) -> datetime:
+    """
+    Publication date of a page if it can be found, otherwise the time it was downloaded
+    """
+    try:
+        result = page.datePub()
+    except (AttributeError, ValueError):
+        result = None
+
+    return result or page.timestamp
+
+
 class CrawlerState:
     stateElements = {'lastId', 'lastUpdated', 'lastURL', 'lastMediaURL'}
     keyTranslations = {'lastMedia': 'lastMediaURL'}
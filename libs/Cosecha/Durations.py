@@ -0,0 +1,116 @@
+"""
+Duration and number of items of the latest executions of each runner, kept between executions, so runners expected to
+take longer are started first (a long crawl started last would set the time of a parallel execution)
+"""
+import heapq
+import json
+import logging
+from os import makedirs, path
+from statistics import mean
+from threading import Lock
+from typing import Dict, List, Optional
+
+DURATIONSFILENAME = 'runner.durations'
+DURATIONSHISTORY = 10  # Executions kept per runner
+
+
+class RunnerDurations:
+
+    def __init__(self, filename: Optional[str] = None):
+        self.filename: Optional[str] = filename
+        self.data: Dict[str, List[List[float]]] = dict()  # Runner -> [[seconds, items], ...] (oldest first)
+        self.lock: Lock = Lock()
+
+    def __str__(self):
+        result = f"RunnerDurations: {len(self)} runners ({self.filename})"
+        return result
+
+    __repr__ = __str__
+
+    def __len__(self):
+        return len(self.data)
+
+    def load(self):
+        if self.filename and path.exists(self.filename):
+            try:
+                with open(self.filename, "r") as handin:
+                    self.data = json.load(handin)
+            except ValueError as exc:
+                logging.warning(f"{self}: unable to read file. Starting from scratch. {exc}")
+                self.data = dict()
+        return self
+
+    def store(self):
+        if not self.filename:
+            return
+        makedirs(path.dirname(self.filename) or '.', mode=0o755, exist_ok=True)
+        with self.lock:
+            with open(self.filename, "w") as handout:
+                json.dump(self.data, handout, indent=1, sort_keys=True)
+
+    def record(self, runner: str, seconds: float, items: int):
+        with self.lock:
+            history = self.data.setdefault(runner, [])
+            history.append([round(seconds, 3), items])
+            self.data[runner] = history[-DURATIONSHISTORY:]
+
+    def expected(self, runner: str, maxItems: Optional[int] = None) -> Optional[float]:
+        """
+        Expected duration (seconds) of runner: average of its latest executions, scaled down if they got more items
+        than allowed now
+        :param maxItems: maximum number of items runner may get (batch size)
+        :return: seconds or None if runner has no history
+        """
+        history = self.data.get(runner)
+        if not history:
+            return None
+        seconds = mean(h[0] for h in history)
+        items = mean(h[1] for h in history)
+        if maxItems is not None and items > maxItems:
+            seconds *= maxItems / items
+        return seconds
+
+    def expectedDurations(self, runners: Dict[str, Optional[int]]) -> Dict[str, Optional[float]]:
+        """
+        Expected duration of runners (None for those without history)
+        :param runners: runner -> maximum number of items it may get
+        """
+        result = {runner: self.expected(runner, maxItems) for runner, maxItems in runners.items()}
+        return result
+
+
+def fillUnknown(expected: Dict[str, Optional[float]]) -> Dict[str, float]:
+    """
+    Runners without history are expected to take as long as the longest known one (so they don't start late)
+    """
+    default = max((seconds for seconds in expected.values() if seconds is not None), default=0.0)
+    result = {runner: default if seconds is None else seconds for runner, seconds in expected.items()}
+    return result
+
+
+def longestFirst(expected: Dict[str, Optional[float]]) -> List[str]:
+    """
+    Runners sorted by expected duration (longest first, name for ties)
+    """
+    filled = fillUnknown(expected)
+    result = sorted(filled, key=lambda runner: (-filled[runner], runner.lower()))
+    return result
+
+
+def predictMakespan(expected: Dict[str, Optional[float]], order: List[str], workers: int = 1) -> Optional[float]:
+    """
+    Time (seconds) to run all the runners when workers take them in the order given as they get free
+    :return: seconds or None if no runner has history
+    """
+    if all(seconds is None for seconds in expected.values()):
+        return None
+    filled = fillUnknown(expected)
+    finishTimes = [0.0] * max(1, workers)
+    for runner in order:
+        heapq.heappush(finishTimes, heapq.heappop(finishTimes) + filled[runner])
+    return max(finishTimes)
+
+
+def formatSeconds(seconds: Optional[float]) -> str:
+    result = "unknown" if seconds is None else f"{seconds:.1f}s"
+    return result
@@ -0,0 +1,198 @@
+import json
+import logging
+import socket
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import timedelta
+from os import getpid, makedirs, path, replace
+from threading import RLock
+from time import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from libs.Utils.Files import lockedFile
+from libs.Utils.Misc import createPath
+
+FRONTIERLEASETIME = 4 * 3600  # Seconds an URL taken by a worker is kept from others (if worker dies, it is released)
+FRONTIERMAXHISTORY = 50  # Runs kept to compute ETA
+
+FrontierProgress = namedtuple('FrontierProgress', ['done', 'total', 'pending', 'leased', 'eta'])
+
+
+class CrawlFrontier:
+    """
+    Work plan of a 'crawler' runner that is stored as it goes so it survives crashes: URLs pending (in crawl order),
+    URLs taken by a worker (leases, they expire) and URLs done (saved or already in archive). Several workers (threads
+    or processes, on the same state directory) can share it: every change is done with the file locked and reloaded,
+    so each worker gets a disjoint slice of pending URLs. A read only frontier (dry runs) is loaded once and changes
+    are kept in memory.
+    """
+    stateElements = {'pending', 'leases', 'done', 'history', 'seeded', 'tail'}
+
+    def __init__(self, runnerName: str, storePath: str, owner: Optional[str] = None, readOnly: bool = False):
+        self.runnerName: str = runnerName
+        self.storePath: str = storePath
+        self.owner: str = owner or f"{socket.gethostname()}:{getpid()}"
+        self.readOnly: bool = readOnly
+        self.pending: List[str] = []
+        self.leases: Dict[str, dict] = dict()
+        self.done: Set[str] = set()
+        self.history: List[List[float]] = []
+        self.seeded: bool = False
+        self.tail: Optional[str] = None  # Last page crawled without link to next one (where to look for new ones)
+        self.lock: RLock = RLock()
+
+    def __str__(self):
+        result = f"CrawlFrontier '{self.runnerName}': {self.describe()}"
+        return result
+
+    __repr__ = __str__
+
+    def __len__(self):
+        return len(self.pending) + len(self.done)
+
+    def fullFilename(self):
+        result = f"{self.runnerName}.frontier"
+        return result
+
+    def completePath(self):
+        result = createPath(self.storePath, self.fullFilename())
+
+        return result
+
+    def exists(self) -> bool:
+        return path.exists(self.completePath())
+
+    def load(self):
+        try:
+            with open(self.completePath(), "r") as handin:
+                inHash = json.load(handin)
+        except FileNotFoundError:
+            return self
+        except ValueError as exc:
+            logging.warning(f"Problems reading frontier for {self.runnerName}. Keeping what is known. {exc}")
+            return self
+
+        self.pending = inHash.get('pending', [])
+        self.leases = inHash.get('leases', dict())
+        self.done = set(inHash.get('done', []))
+        self.history = inHash.get('history', [])
+        self.seeded = inHash.get('seeded', False)
+        self.tail = inHash.get('tail')
+
+        return self
+
+    def store(self):
+        """
+        File is replaced at once (a crash while writing it doesn't lose the previous version)
+        """
+        makedirs(self.storePath, mode=0o755, exist_ok=True)
+        outHash = {k: getattr(self, k) for k in self.stateElements}
+        outHash['done'] = sorted(self.done)
+        auxFilename = f"{self.completePath()}.tmp"
+        with open(auxFilename, "w") as handout:
+            json.dump(outHash, handout, indent=1, sort_keys=True)
+        replace(auxFilename, self.completePath())
+
+    @contextmanager
+    def transaction(self):
+        """
+        Latest version of frontier (from file) is loaded and stored after changes, with file locked
+        """
+        if self.readOnly:
+            with self.lock:
+                yield self
+            return
+        with self.lock, lockedFile(f"{self.completePath()}.lock"):
+            self.load()
+            yield self
+            self.store()
+
+    def add(self, urls: Iterable[str], seed: bool = False) -> int:
+        """
+        Adds URLs (in crawl order) to the end of pending ones. Those already known are ignored
+        :param urls: URLs to add
+        :param seed: URLs are the whole plan (i.e. all the ids of the comic), not only those discovered so far
+        :return: number of URLs added
+        """
+        result = 0
+        with self.transaction():
+            known = self.done.union(self.pending)
+            for url in urls:
+                if url and url not in known:
+                    self.pending.append(url)
+                    known.add(url)
+                    result += 1
+            self.seeded = self.seeded or seed
+        return result
+
+    def lease(self, count: int) -> List[str]:
+        """
+        Takes the first pending URLs not taken already (or whose lease is over)
+        :param count: maximum number of URLs
+        :return: list of URLs (in crawl order)
+        """
+        result = []
+        with self.transaction():
+            now = time()
+            for url in self.pending:
+                if len(result) >= count:
+                    break
+                lease = self.leases.get(url)
+                if lease is not None and lease['expires'] > now:
+                    continue
+                self.leases[url] = {'owner': self.owner, 'expires': now + FRONTIERLEASETIME}
+                result.append(url)
+        return result
+
+    def release(self, urls: Iterable[str]):
+        """
+        URLs taken but not done go back to pending (for any worker)
+        """
+        with self.transaction():
+            for url in urls:
+                if self.leases.get(url, {}).get('owner') == self.owner:
+                    self.leases.pop(url)
+
+    def releaseAll(self):
+        with self.transaction():
+            self.leases = {url: lease for url, lease in self.leases.items() if lease['owner'] != self.owner}
+
+    def markDone(self, urls: Iterable[str]):
+        with self.transaction():
+            urlSet = set(urls)
+            self.done.update(urlSet)
+            self.pending = [url for url in self.pending if url not in urlSet]
+            for url in urlSet:
+                self.leases.pop(url, None)
+
+    def setTail(self, url: str):
+        with self.transaction():
+            self.tail = url
+
+    def recordRun(self):
+        """
+        Keeps number of URLs done at the end of a run (to compute ETA)
+        """
+        with self.transaction():
+            self.history.append([time(), len(self.done)])
+            self.history = self.history[-FRONTIERMAXHISTORY:]
+
+    def progress(self) -> FrontierProgress:
+        now = time()
+        leased = sum(1 for url in self.pending if self.leases.get(url, {}).get('expires', 0) > now)
+        eta = None
+        if len(self.history) > 1:
+            (firstTime, firstDone), (lastTime, lastDone) = self.history[0], self.history[-1]
+            if lastDone > firstDone and lastTime > firstTime:
+                eta = timedelta(seconds=round(len(self.pending) * (lastTime - firstTime) / (lastDone - firstDone)))
+        return FrontierProgress(done=len(self.done), total=len(self), pending=len(self.pending), leased=leased,
+                                eta=eta)
+
+    def describe(self) -> str:
+        progress = self.progress()
+        totalStr = f"{progress.total}" if self.seeded else f"{progress.total} (known so far)"
+        etaStr = f"ETA {progress.eta}" if progress.eta is not None else "ETA unknown"
+        if not progress.pending:
+            etaStr = "complete" if self.seeded else "nothing pending"
+        result = f"{progress.done} of {totalStr} archived ({progress.leased} in flight) {etaStr}"
+        return result
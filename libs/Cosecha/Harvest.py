@@ -2,17 +2,31 @@ import logging
 import smtplib
 from datetime import datetime
 from email.mime.multipart import MIMEMultipart
-from time import gmtime, strftime
-from typing import Callable, List, Optional
-
+from os import path
+from queue import Queue
+from threading import Thread
+from time import gmtime, perf_counter, strftime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .Archive import ArchiveStore, createArchive
+from .ComicPage import ComicPage
 from .Config import globalConfig, GMTIMEFORMATFORMAIL, runnerConfig
 from .Crawler import Crawler
+from .Durations import DURATIONSFILENAME, formatSeconds, longestFirst, predictMakespan, RunnerDurations
 from .Mail import MailMessage
 from .StoreManager import DBStorage
 from ..Utils.Misc import getUTC
+from ..Utils.NegativeCache import NEGATIVECACHEFILENAME
+from ..Utils.ParsePool import configureParsePool, shutdownParsePool
+from ..Utils.RedirectCache import REDIRECTCACHEFILENAME
+from ..Utils.Web import (configureHostThrottle, configureNegativeCache, configureRedirectCache, configureRequestMemo,
+                         configureRequests, deadlineExceeded, DEFAULTHOSTINTERVAL, LATENCYSTATSFILENAME, latencyStats,
+                         negativeCache, redirectCache, requestMemo, setRunDeadline)
 
 session_manager: Optional[Callable] = None
 
+SAVEQUEUESIZE = 8  # Results downloaded waiting to be saved (download stops when queue is full)
+
 
 class Harvest:
     def __init__(self, config: globalConfig, ignoreEnabled: bool = False):
@@ -27,7 +41,15 @@ class Harvest:
         # Working objects
         self.crawlers: List[Crawler] = []
         self.dataStore: Optional[DBStorage] = None
+        self.archive: Optional[ArchiveStore] = None
         self.Mailer: Optional[MailDelivery] = None
+        self.saver: Optional[SavePipeline] = None
+        self.durations: Optional[RunnerDurations] = None
+
+        # Expected duration of runners (seconds, see executionOrder) and time of downloads (predicted and actual)
+        self.expectedDurations: Dict[str, Optional[float]] = dict()
+        self.predictedMakespan: Optional[float] = None
+        self.actualMakespan: Optional[float] = None
 
         self.startTime: Optional[datetime] = None
         self.stopTime: Optional[datetime] = None
@@ -55,6 +77,7 @@ class Harvest:
 
         global session_manager
         self.startTime = datetime.now()
+        setRunDeadline(self.globalCFG.runDeadline)
 
         if self.globalCFG.storeCFG:
             self.prepareStorage()
@@ -66,19 +89,57 @@ class Harvest:
         else:
             doSession(self)
 
+        if not self.globalCFG.dryRun:
+            self.storeCaches()
+        for crawler in self.crawlers:
+            crawler.closeFrontier()
+        shutdownParsePool()
+
         self.stopTime = datetime.now()
 
     def prepareStorage(self):
         self.dataStore = DBStorage(globalCFG=self.globalCFG)
         self.dataStore.prepare()
 
+    def prepareRequests(self):
+        """
+        Sets limits of requests and loads the caches shared by all the crawlers (kept in state directory), durations
+        of runners included
+        """
+        hostInterval = DEFAULTHOSTINTERVAL if self.globalCFG.hostInterval is None else self.globalCFG.hostInterval
+        configureHostThrottle(self.globalCFG.hostConcurrency, hostInterval)
+        configureRequests(self.globalCFG.connectTimeout, self.globalCFG.readTimeout, self.globalCFG.retries,
+                          hedge=self.globalCFG.hedgeRequests,
+                          latencyFile=path.join(self.globalCFG.stateD(), LATENCYSTATSFILENAME))
+        configureNegativeCache(path.join(self.globalCFG.stateD(), NEGATIVECACHEFILENAME),
+                               enabled=not self.globalCFG.ignoreNegativeCache)
+        configureRedirectCache(path.join(self.globalCFG.stateD(), REDIRECTCACHEFILENAME),
+                               enabled=not self.globalCFG.ignoreRedirectCache)
+        configureRequestMemo(enabled=not self.globalCFG.dontMemoRequests)
+        self.durations = RunnerDurations(path.join(self.globalCFG.stateD(), DURATIONSFILENAME)).load()
+
+    def storeCaches(self):
+        negativeCache.store()
+        latencyStats.store()
+        redirectCache.store()
+        if self.durations is not None:
+            self.durations.store()
+
     def prepare(self):
         """
         Creates Crawler objects from configuration files
         :return:
         """
         execTime = getUTC()
+        self.archive = createArchive(self.globalCFG)
+        self.prepareRequests()
+        configureParsePool(self.globalCFG.parseWorkers)
+        self.createCrawlers(execTime)
 
+    def createCrawlers(self, execTime):
+        """
+        Creates Crawler objects (in alphabetical order) of the required runners that are enabled and due
+        """
         if not self.globalCFG.runnersData:
             raise EnvironmentError(
                     f"No configuration files found for runners. HomeDir: {self.globalCFG.homeDirectory()} Glob for "
@@ -97,7 +158,8 @@ class Harvest:
                 continue
 
             try:
-                newCrawler = Crawler(runnerCFG=cfgData, globalCFG=self.globalCFG, dbStore=self.dataStore)
+                newCrawler = Crawler(runnerCFG=cfgData, globalCFG=self.globalCFG, dbStore=self.dataStore,
+                                     archive=self.archive)
                 if not (self.globalCFG.ignorePollInterval or newCrawler.checkPollSlot(execTime)):
                     logging.debug(f"Crawler '{newCrawler.name}' skipped as file was obtained on same period "
                                   f"{newCrawler.state.lastUpdated}")
@@ -112,28 +174,60 @@ class Harvest:
             logging.info("No crawlers to execute")
 
     def download(self):
-        for crawler in self.crawlers:
-            crawler.go()
+        """
+        Runs the crawlers. Unless saving is disabled, results are saved as they are downloaded (see SavePipeline)
+        """
+        if not (self.globalCFG.dryRun or self.globalCFG.dontSave):
+            self.saver = SavePipeline(self, threaded=self.dataStore is None).start()
+            for crawler in self.crawlers:
+                crawler.saver = self.saver.put
+        downloadStart = perf_counter()
+        self.executionOrder()  # Only for the prediction: one by one, alphabetical order is as good as any other
+        try:
+            for crawler in self.crawlers:
+                if deadlineExceeded():
+                    logging.warning(f"Run deadline exceeded. Crawler '{crawler.name}' (and later ones) not executed")
+                    break
+                sentBefore, hitsBefore = requestMemo.counters()
+                crawlerStart = perf_counter()
+                crawler.go()
+                crawler.duration = perf_counter() - crawlerStart
+                sentAfter, hitsAfter = requestMemo.counters()
+                crawler.requestsSent = sentAfter - sentBefore
+                crawler.duplicateHits = hitsAfter - hitsBefore
+                self.durations.record(crawler.name, crawler.duration, len(crawler.results))
+        finally:
+            if self.saver is not None:
+                self.saver.finish()
+            self.actualMakespan = perf_counter() - downloadStart
+
+    def executionOrder(self, workers: int = 1) -> List[Crawler]:
+        """
+        Crawlers expected to take longer (from previous executions) go first, so in parallel executions (see
+        ShardedHarvest) a long one doesn't start last. Reports and mail keep alphabetical order
+        :param workers: number of crawlers run at the same time (for the prediction of time of downloads)
+        """
+        self.expectedDurations = self.durations.expectedDurations({c.name: c.itemLimit() for c in self.crawlers})
+        order = longestFirst(self.expectedDurations)
+        self.predictedMakespan = predictMakespan(self.expectedDurations, order, workers)
+        crawlersByName = {crawler.name: crawler for crawler in self.crawlers}
+
+        return [crawlersByName[runner] for runner in order]
 
     def save(self):
+        """
+        Finishes saving: results have been saved while downloading (see download). Crawlers that had problems keep
+        only the results that were saved (they are consecutive so next execution continues from the last one)
+        """
         if (self.globalCFG.dryRun or self.globalCFG.dontSave):
             return
-        for crawler in self.usefulCrawlers():
-            savedFiles = []
-            if crawler.results:
-                for res in crawler.results:
-                    try:
-                        res.saveFiles(self.globalCFG.imagesD(), self.globalCFG.metadataD(), self.dataStore,
-                                      self.globalCFG.storeJSON)
-                        crawler.state.updateFromImage(res)
-                        crawler.state.store()
-                        savedFiles.append(res)
-                    except Exception as exc:
-                        logging.error(f"Crawler '{crawler.name}': problem saving results:{type(exc)} {exc}")
-                        logging.exception(exc, exc_info=True)
-                        break
-                if len(savedFiles) != len(crawler.results):
-                    crawler.results = savedFiles
+        for crawler in self.crawlers:
+            if crawler.saveFailed or len(crawler.savedResults) != len(crawler.results):
+                crawler.setResults(crawler.savedResults)
+                continue
+            crawler.storeFeedState()
+        for crawler in self.crawlers:
+            crawler.storeSchedule()
 
     def printFilesReport(self):
         lines: List[str] = []
@@ -151,6 +245,58 @@ class Harvest:
 
         print("\n".join(lines))
 
+    def printRequestsReport(self):
+        lines: List[str] = []
+
+        lines.append(f"REQUESTS REPORT: {requestMemo.sent} requests sent, {requestMemo.hits} duplicates answered from "
+                     f"memo")
+        for crawler in sorted(self.crawlers, key=lambda c: (-c.requestsSent, c.name)):
+            lines.append(f"     '{crawler.name}': {crawler.requestsSent} requests {crawler.duplicateHits} duplicates")
+        lines.append("")
+
+        print("\n".join(lines))
+
+    def printFrontierReport(self):
+        frontierCrawlers = [c for c in self.crawlers if c.frontier is not None]
+        if not frontierCrawlers:
+            return
+        lines: List[str] = []
+
+        lines.append(f"FRONTIER REPORT: {len(frontierCrawlers)} runners")
+        for crawler in sorted(frontierCrawlers, key=lambda c: c.name):
+            lines.append(f"     '{crawler.name}': {crawler.frontier.describe()}")
+        lines.append("")
+
+        print("\n".join(lines))
+
+    def printScheduleReport(self):
+        timedCrawlers = [c for c in self.crawlers if c.duration is not None]
+        if not timedCrawlers:
+            return
+        lines: List[str] = []
+
+        lines.append(f"SCHEDULE REPORT: downloads took {formatSeconds(self.actualMakespan)} (predicted "
+                     f"{formatSeconds(self.predictedMakespan)}) running longest expected first")
+        for crawler in sorted(timedCrawlers, key=lambda c: (-c.duration, c.name)):
+            lines.append(f"     '{crawler.name}': {formatSeconds(crawler.duration)} (expected "
+                         f"{formatSeconds(self.expectedDurations.get(crawler.name))}) {len(crawler.results)} items")
+        lines.append("")
+
+        print("\n".join(lines))
+
+    def printFailuresReport(self):
+        chronicFailures = negativeCache.chronic()
+        if not chronicFailures:
+            return
+        lines: List[str] = []
+
+        lines.append(f"FAILURES REPORT: {len(chronicFailures)} URLs keep failing ({negativeCache.skipped} requests "
+                     f"skipped this run)")
+        for url, _ in chronicFailures:
+            lines.append(f"     {negativeCache.describe(url)}")
+
+        print("\n".join(lines))
+
     def email(self):
         self.Mailer = MailDelivery(self)
 
@@ -183,11 +329,86 @@ class Harvest:
         if self.globalCFG.printDetailedReport:
             print("\n")
             self.printFilesReport()
+            self.printRequestsReport()
+            self.printFrontierReport()
+            self.printScheduleReport()
+            self.printFailuresReport()
             if self.Mailer:
                 print("\n")
                 self.Mailer.print()
 
 
+class SavePipeline:
+    """
+    Saves results (files, DB records, state of crawler) as crawlers produce them, so a problem late in the execution
+    doesn't lose what was downloaded before. If threaded, saving is done by a thread of its own that gets results
+    through a bounded queue (disk writes overlap with downloads). Otherwise (i.e. with DB store, as sessions can't be
+    shared between threads) results are saved by the thread that produces them.
+    """
+
+    def __init__(self, harvest: Harvest, threaded: bool = True, queueSize: int = SAVEQUEUESIZE):
+        self.globalCFG: globalConfig = harvest.globalCFG
+        self.dataStore: Optional[DBStorage] = harvest.dataStore
+        self.archive: Optional[ArchiveStore] = harvest.archive
+        self.threaded: bool = threaded
+        self.queue: Queue[Optional[Tuple[Crawler, ComicPage]]] = Queue(maxsize=max(1, queueSize))
+        self.worker: Optional[Thread] = None
+
+    def __str__(self):
+        result = f"SavePipeline: {'threaded' if self.threaded else 'inline'} queue: {self.queue.qsize()}"
+        return result
+
+    __repr__ = __str__
+
+    def start(self):
+        if self.threaded:
+            self.worker = Thread(target=self.run, name="SavePipeline")
+            self.worker.start()
+        return self
+
+    def put(self, crawler: Crawler, page: ComicPage):
+        """
+        Hands a result to be saved. It blocks if queue is full
+        """
+        if self.threaded:
+            self.queue.put((crawler, page))
+        else:
+            self.saveResult(crawler, page)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            self.saveResult(*item)
+
+    def finish(self):
+        """
+        Waits until all the results handed have been saved
+        """
+        if self.worker is not None:
+            self.queue.put(None)
+            self.worker.join()
+            self.worker = None
+
+    def saveResult(self, crawler: Crawler, page: ComicPage):
+        if crawler.saveFailed:
+            return
+        try:
+            page.saveFiles(self.globalCFG.imagesD(), self.globalCFG.metadataD(), self.dataStore,
+                           self.globalCFG.storeJSON, archive=self.archive, metadataFormat=self.globalCFG.metadataFormat)
+            crawler.state.updateFromImage(page)
+            crawler.state.store()
+            crawler.frontierSaved(page)
+            crawler.savedResults.append(page)
+            page.releasePayload(self.archive)
+        except Exception as exc:
+            # Results after this one are not saved so next execution continues from the last one saved
+            logging.error(f"Crawler '{crawler.name}': problem saving results:{type(exc)} {exc}")
+            logging.exception(exc, exc_info=True)
+            crawler.saveFailed = True
+
+
 class MailDelivery:
     def __init__(self, harvest: Harvest):
         self.mailConfig = harvest.globalCFG.mailCFG
@@ -273,7 +494,7 @@ class MailDelivery:
             server.ehlo()  # Can be omitted
 
             for msg in self.cargo:
-                server.sendmail(self.mailConfig.sender, self.mailConfig.to, msg.as_string())
+                server.sendmail(self.mailConfig.sender, self.mailConfig.to, msg.as_bytes())
         except Exception as e:
             # Print any error messages to stdout
             logging.error(e)
@@ -10,6 +10,7 @@ from .ComicPage import ComicPage
 from .Config import mailConfig
 from .Crawler import Crawler
 from ..Utils.Misc import listize
+from ..Utils.ParsePool import runParser
 
 
 class MailBundle:
@@ -127,7 +128,7 @@ class MailMessage:
             attachments.extend(listAttachments)
 
         finalPlain = "\n".join(resultPlain)
-        finalHTML = markdown.markdown(finalPlain)
+        finalHTML = runParser(markdown.markdown, finalPlain)
 
         auxMID = f"{self.mid}".zfill(ceil(log10(self.mcnt)))
         fullSubject = f"{subject} {auxMID}/{self.mcnt}"
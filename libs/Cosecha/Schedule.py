@@ -0,0 +1,181 @@
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from os import makedirs, path
+from typing import Iterable, List, Optional
+
+from libs.Utils.Files import loadMetadata, loadYAML, saveYAML
+from libs.Utils.Misc import createPath, UTC2local
+from .Config import TIMESTAMPFORMAT
+
+ADAPTIVEMINHISTORY = 10  # Below this number of comics known, runner is polled every time
+ADAPTIVEMINYIELD = 0.25  # Minimum number of comics expected since last poll to poll again
+ADAPTIVEGRACEPOLLS = 2  # Empty polls allowed before backing off
+ADAPTIVEMAXBACKOFF = 16  # Maximum days between polls when backing off
+
+
+class PollSchedule:
+    """
+    Publication pattern of a runner (comics per weekday and hour, in local time) and results of its last polls. Used
+    by the 'adaptive' poll interval to skip polls that are unlikely to find anything new.
+    """
+    stateElements = {'weekdayCounts', 'hourCounts', 'firstSeen', 'lastSeen', 'lastPoll', 'emptyPolls'}
+
+    def __init__(self, runnerName: str, storePath: str):
+        self.runnerName: str = runnerName
+        self.storePath: str = storePath
+        self.weekdayCounts: List[int] = [0] * 7
+        self.hourCounts: List[int] = [0] * 24
+        self.firstSeen: Optional[datetime] = None
+        self.lastSeen: Optional[datetime] = None
+        self.lastPoll: Optional[datetime] = None
+        self.emptyPolls: int = 0
+        self.loaded: bool = False
+
+    def __str__(self):
+        result = (f"PollSchedule '{self.runnerName}': comics: {len(self)} weekdays: {self.weekdayCounts} "
+                  f"lastPoll: {self.lastPoll} emptyPolls: {self.emptyPolls}")
+        return result
+
+    __repr__ = __str__
+
+    def __len__(self):
+        return sum(self.weekdayCounts)
+
+    def fullFilename(self):
+        result = f"{self.runnerName}.schedule"
+        return result
+
+    def completePath(self):
+        result = createPath(self.storePath, self.fullFilename())
+
+        return result
+
+    def load(self):
+        try:
+            inHash = loadYAML(self.completePath()) or dict()
+        except FileNotFoundError:
+            return self
+        except Exception as exc:
+            logging.warning(f"Problems reading poll schedule for {self.runnerName}. Will learn it again. {exc}")
+            return self
+
+        for k in self.stateElements:
+            if k in inHash:
+                setattr(self, k, inHash[k])
+        self.loaded = True
+
+        return self
+
+    def store(self):
+        makedirs(self.storePath, mode=0o755, exist_ok=True)
+        outHash = {k: getattr(self, k) for k in self.stateElements}
+        saveYAML(outHash, self.completePath())
+
+    def learn(self, dates: Iterable[datetime]):
+        """
+        Adds publication dates to the pattern
+        :param dates: datetimes (naive ones are taken as local time). Those at 00:00:00 are supposed to come from a
+        date without time and don't count for hour pattern
+        """
+        for pubDate in dates:
+            localDate = UTC2local(pubDate) if pubDate.tzinfo else pubDate
+            self.weekdayCounts[localDate.weekday()] += 1
+            if localDate.time() != datetime.min.time():
+                self.hourCounts[localDate.hour] += 1
+            naiveDate = localDate.replace(tzinfo=None)
+            self.firstSeen = naiveDate if self.firstSeen is None else min(self.firstSeen, naiveDate)
+            self.lastSeen = naiveDate if self.lastSeen is None else max(self.lastSeen, naiveDate)
+
+    def recordPoll(self, when: datetime, numResults: int):
+        self.lastPoll = UTC2local(when).replace(tzinfo=None)
+        self.emptyPolls = 0 if numResults else self.emptyPolls + 1
+
+    def expectedComics(self, start: datetime, end: datetime) -> float:
+        """
+        Number of comics expected to be published between two (naive, local) datetimes according to the pattern
+        """
+        numWeeks = (self.lastSeen - self.firstSeen).days / 7 + 1
+        hoursKnown = sum(self.hourCounts)
+
+        def dayFraction(fromHour: float, toHour: float) -> float:
+            if not hoursKnown:
+                return (toHour - fromHour) / 24
+            result = 0.0
+            for hour in range(int(fromHour), min(24, int(toHour) + 1)):
+                overlap = min(toHour, hour + 1) - max(fromHour, hour)
+                if overlap > 0:
+                    result += self.hourCounts[hour] / hoursKnown * overlap
+            return result
+
+        result = 0.0
+        current = start
+        while current < end:
+            dayEnd = min(end, datetime.combine(current.date() + timedelta(days=1), datetime.min.time()))
+            fromHour = current.hour + current.minute / 60
+            toHour = 24.0 if dayEnd.date() != current.date() else dayEnd.hour + dayEnd.minute / 60
+            result += self.weekdayCounts[current.weekday()] / numWeeks * dayFraction(fromHour, toHour)
+            current = dayEnd
+
+        return result
+
+    def shouldPoll(self, now: datetime) -> bool:
+        """
+        Decides if it is worth to poll now
+        :param now: aware datetime
+        :return: True if there is a chance of something new
+        """
+        if self.lastPoll is None or len(self) < ADAPTIVEMINHISTORY:
+            return True
+
+        localNow = UTC2local(now).replace(tzinfo=None)
+        if self.emptyPolls > ADAPTIVEGRACEPOLLS:
+            backoffDays = min(ADAPTIVEMAXBACKOFF, 2 ** (self.emptyPolls - ADAPTIVEGRACEPOLLS - 1))
+            if localNow - self.lastPoll < timedelta(days=backoffDays):
+                logging.debug(f"{self}: backing off ({backoffDays} days)")
+                return False
+
+        expected = self.expectedComics(self.lastPoll, localNow)
+        logging.debug(f"{self}: expected comics since last poll: {expected:.2f}")
+
+        return expected >= ADAPTIVEMINYIELD
+
+
+def publicationDatesFromDB(dbStore, key: str, dateFormat: Optional[str]) -> List[datetime]:
+    result = []
+    for record in dbStore.obj.ImageMetadata.select(lambda r: r.key == key):
+        timestamp = record.timestamp if record.timestamp.tzinfo else record.timestamp.replace(tzinfo=timezone.utc)
+        result.append(parsePublicationDate(record.comicDate, dateFormat) or timestamp)
+    return result
+
+
+def publicationDatesFromMetadata(metadataList: Iterable[dict], dateFormat: Optional[str]) -> List[datetime]:
+    result = []
+    for metadata in metadataList:
+        pubDate = parsePublicationDate(metadata.get('datePublished'), dateFormat)
+        if pubDate is None and metadata.get('timestamp'):
+            try:
+                pubDate = datetime.strptime(metadata['timestamp'], TIMESTAMPFORMAT)
+            except ValueError:
+                pass
+        if pubDate is not None:
+            result.append(pubDate)
+    return result
+
+
+def metadataFromFiles(metadataFolder: str) -> Iterable[dict]:
+    for root, dirs, files in os.walk(metadataFolder):
+        for file in files:
+            try:
+                yield loadMetadata(path.join(root, file))
+            except Exception as exc:
+                logging.debug(f"{path.join(root, file)}: unable to read metadata {type(exc)} {exc}")
+
+
+def parsePublicationDate(dateStr: Optional[str], dateFormat: Optional[str]) -> Optional[datetime]:
+    if not (dateStr and dateFormat):
+        return None
+    try:
+        return datetime.strptime(dateStr, dateFormat)
+    except ValueError:
+        return None
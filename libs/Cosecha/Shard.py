@@ -0,0 +1,419 @@
+"""
+Harvest split among worker processes of this host or of several hosts sharing the state directory. Runners are taken
+from a lease table (in state directory) so each one is executed by a single worker. Workers save what they download as
+usual and leave a report per runner. A coordinator (the first host to join the execution) merges the reports into one
+summary, one mail delivery and one update of the caches shared by all runners. Other hosts only run workers.
+"""
+import copy
+import json
+import logging
+import pickle
+import socket
+from contextlib import contextmanager
+from datetime import datetime
+from multiprocessing import get_context
+from os import getpid, listdir, makedirs, path, replace
+from shutil import rmtree
+from threading import RLock
+from time import perf_counter, sleep, time
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from .Config import globalConfig
+from .Crawler import Crawler
+from .Harvest import Harvest
+from ..Utils.Files import getSaneFilenameStr, lockedFile
+from ..Utils.Logging import prepareLogger
+from ..Utils.Misc import getUTC
+from ..Utils.Web import latencyStats, negativeCache, redirectCache, requestMemo
+
+SHARDDIRECTORY = 'shards'  # In state directory. A folder for each execution
+SHARDLEASETIME = 4 * 3600  # Seconds a runner taken by a worker is kept from others (if worker dies, it is released)
+SHARDPOLLINTERVAL = 10  # Seconds between checks of runners executed by other hosts
+SHARDREPORTEXTENSION = 'report'
+
+RUNNERPENDING = 'pending'
+RUNNERLEASED = 'leased'
+RUNNERDONE = 'done'
+
+# Caches shared by all runners. Workers don't store them, coordinator merges their changes (see mergeCacheChanges)
+SHAREDCACHES = {'negativeCache': negativeCache, 'redirectCache': redirectCache, 'latencyStats': latencyStats}
+
+
+def leaseOwner(pid: Optional[int] = None) -> str:
+    result = f"{socket.gethostname()}:{pid or getpid()}"
+    return result
+
+
+class RunnerLeases:
+    """
+    Runners of a sharded execution and who is executing them. Workers (processes of any host with the state directory)
+    share it: every change is done with the file locked and reloaded, so a runner is leased to one worker only.
+    """
+
+    def __init__(self, runPath: str, owner: Optional[str] = None):
+        self.runPath: str = runPath
+        self.owner: str = owner or leaseOwner()
+        self.runners: Dict[str, dict] = dict()  # Runner -> {'state', 'owner', 'expires'} (in order of execution)
+        self.lock: RLock = RLock()
+
+    def __str__(self):
+        counts = {state: sum(1 for lease in self.runners.values() if lease['state'] == state) for state in
+                  (RUNNERPENDING, RUNNERLEASED, RUNNERDONE)}
+        result = f"RunnerLeases '{self.runPath}': {counts}"
+        return result
+
+    __repr__ = __str__
+
+    def __len__(self):
+        return len(self.runners)
+
+    def completePath(self):
+        result = path.join(self.runPath, "runners.leases")
+        return result
+
+    def coordinatorPath(self):
+        result = path.join(self.runPath, "coordinator.lease")
+        return result
+
+    def load(self):
+        try:
+            with open(self.completePath(), "r") as handin:
+                self.runners = json.load(handin)
+        except FileNotFoundError:
+            pass
+        except ValueError as exc:
+            logging.warning(f"Problems reading runner leases from {self.completePath()}. Keeping what is known. {exc}")
+
+        return self
+
+    def store(self):
+        """
+        File is replaced at once (a crash while writing it doesn't lose the previous version)
+        """
+        makedirs(self.runPath, mode=0o755, exist_ok=True)
+        auxFilename = f"{self.completePath()}.tmp"
+        with open(auxFilename, "w") as handout:
+            json.dump(self.runners, handout, indent=1)
+        replace(auxFilename, self.completePath())
+
+    @contextmanager
+    def transaction(self):
+        """
+        Latest version of table (from file) is loaded and stored after changes, with file locked
+        """
+        with self.lock, lockedFile(f"{self.completePath()}.lock"):
+            self.load()
+            yield self
+            self.store()
+
+    def seed(self, runners: Iterable[str]) -> int:
+        """
+        Adds runners (in order of execution) as pending. Those already known (i.e. added by another host) are ignored
+        :return: number of runners added
+        """
+        result = 0
+        with self.transaction():
+            for runner in runners:
+                if runner not in self.runners:
+                    self.runners[runner] = {'state': RUNNERPENDING, 'owner': None, 'expires': None}
+                    result += 1
+        return result
+
+    def lease(self) -> Optional[str]:
+        """
+        Takes the first runner pending (or whose lease is over)
+        :return: name of runner or None if there is nothing left
+        """
+        with self.transaction():
+            now = time()
+            for runner, lease in self.runners.items():
+                if lease['state'] == RUNNERDONE or (lease['state'] == RUNNERLEASED and lease['expires'] > now):
+                    continue
+                self.runners[runner] = {'state': RUNNERLEASED, 'owner': self.owner, 'expires': now + SHARDLEASETIME}
+                return runner
+        return None
+
+    def finish(self, runner: str):
+        with self.transaction():
+            self.runners[runner] = {'state': RUNNERDONE, 'owner': self.owner, 'expires': None}
+
+    def abandon(self, owners: Set[str]):
+        """
+        Runners leased by owners (workers that are gone) go back to pending
+        """
+        with self.transaction():
+            for runner, lease in self.runners.items():
+                if lease['state'] == RUNNERLEASED and lease['owner'] in owners:
+                    self.runners[runner] = {'state': RUNNERPENDING, 'owner': None, 'expires': None}
+
+    def claimCoordinator(self) -> Optional[str]:
+        """
+        Takes the role of coordinator (merge of reports, mails, shared caches) of the execution if nobody has it (or
+        its lease is over)
+        :return: owner that is coordinator (self.owner if it was taken)
+        """
+        with self.transaction():
+            now = time()
+            try:
+                with open(self.coordinatorPath(), "r") as handin:
+                    lease = json.load(handin)
+            except (FileNotFoundError, ValueError):
+                lease = None
+            if lease is None or lease['owner'] == self.owner or lease['expires'] <= now:
+                lease = {'owner': self.owner, 'expires': now + SHARDLEASETIME}
+                auxFilename = f"{self.coordinatorPath()}.tmp"
+                with open(auxFilename, "w") as handout:
+                    json.dump(lease, handout, indent=1)
+                replace(auxFilename, self.coordinatorPath())
+        return lease['owner']
+
+    def inFlight(self) -> List[str]:
+        now = time()
+        self.load()
+        result = [runner for runner, lease in self.runners.items() if
+                  lease['state'] == RUNNERLEASED and lease['expires'] > now]
+        return result
+
+    def notDone(self) -> List[str]:
+        self.load()
+        result = [runner for runner, lease in self.runners.items() if lease['state'] != RUNNERDONE]
+        return result
+
+
+def addCounts(target: Optional[List[int]], before: Optional[List[int]], after: List[int]) -> List[int]:
+    """
+    Counters (i.e. histogram of latencies) of target plus what a worker added to them
+    """
+    target = target or [0] * len(after)
+    before = before or [0] * len(after)
+    result = [t + a - b for t, b, a in zip(target, before, after)]
+    return result
+
+
+# How a changed entry of a cache is combined with the one in the coordinator (default: changed one wins)
+CACHECOMBINERS: Dict[str, Callable] = {'latencyStats': addCounts}
+
+
+def cacheChanges(baseline: dict, current: dict) -> dict:
+    """
+    Entries of current that differ from baseline (as before, after) and entries of baseline removed
+    """
+    result = {'changed': {key: (baseline.get(key), value) for key, value in current.items() if
+                          baseline.get(key) != value},
+              'removed': [key for key in baseline if key not in current]}
+    return result
+
+
+def mergeCacheChanges(target: dict, changes: dict, combine: Optional[Callable] = None):
+    """
+    Applies to target the changes made to a cache by a worker (see cacheChanges)
+    :param combine: function(target entry, entry before, entry after) to get the new entry. Default: entry after
+    """
+    for key, (before, after) in changes['changed'].items():
+        target[key] = after if combine is None else combine(target.get(key), before, after)
+    for key in changes['removed']:
+        target.pop(key, None)
+
+
+class ShardHarvest(Harvest):
+    """
+    Harvest of a runner leased by a worker. Caches shared by all runners are not stored: they go in the report of the
+    runner, with the results, for the coordinator
+    """
+
+    def __init__(self, config: globalConfig, ignoreEnabled: bool = False):
+        super().__init__(config=config, ignoreEnabled=ignoreEnabled)
+        self.cacheBaselines: Dict[str, dict] = dict()
+
+    def prepareRequests(self):
+        super().prepareRequests()
+        self.cacheBaselines = {name: copy.deepcopy(cache.data) for name, cache in SHAREDCACHES.items()}
+
+    def storeCaches(self):
+        pass
+
+    def storeReport(self, runPath: str, runner: str, skipped: int = 0):
+        report = {'runner': runner, 'owner': leaseOwner(),
+                  'crawlers': [{'name': crawler.name, 'results': [page.resultState() for page in crawler.results],
+                                'requestsSent': crawler.requestsSent, 'duplicateHits': crawler.duplicateHits,
+                                'duration': crawler.duration} for crawler in self.crawlers],
+                  'caches': {name: cacheChanges(self.cacheBaselines.get(name, {}), cache.data) for name, cache in
+                             SHAREDCACHES.items()}, 'skipped': skipped}
+
+        filename = path.join(runPath, f"{getSaneFilenameStr(runner)}.{SHARDREPORTEXTENSION}")
+        auxFilename = f"{filename}.tmp"
+        with open(auxFilename, "wb") as handout:
+            pickle.dump(report, handout)
+        replace(auxFilename, filename)
+
+
+def runShardWorker(config: globalConfig, runPath: str, ignoreEnabled: bool = False, deadline: Optional[float] = None,
+                   logLevel: int = logging.WARNING):
+    """
+    Worker process: executes runners leased from the table of the execution until there is none left
+    :param deadline: time (epoch) when downloads must stop (the same for all workers)
+    """
+    prepareLogger(logger=logging.getLogger(), level=logLevel)
+    leases = RunnerLeases(runPath)
+
+    while True:
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time()
+            if remaining <= 0:
+                logging.warning(f"Shard worker {leases.owner}: run deadline exceeded. Not taking more runners")
+                break
+        runner = leases.lease()
+        if runner is None:
+            break
+
+        shardConfig = copy.copy(config)
+        shardConfig.requiredRunners = [runner]
+        shardConfig.dontSendEmails = True
+        shardConfig.harvestWorkers = 0
+        shardConfig.shardRun = None
+        if remaining is not None:
+            shardConfig.runDeadline = max(1, int(remaining))
+
+        harvest = ShardHarvest(config=shardConfig, ignoreEnabled=ignoreEnabled)
+        skippedBefore = negativeCache.skipped
+        try:
+            harvest.go()
+        except Exception as exc:
+            logging.error(f"Shard worker {leases.owner}: problems executing runner '{runner}' {type(exc)}:{exc}")
+            logging.exception(exc, stack_info=True)
+        harvest.storeReport(runPath, runner, skipped=negativeCache.skipped - skippedBefore)
+        leases.finish(runner)
+
+
+class ShardedHarvest(Harvest):
+    """
+    Coordinator of a sharded execution. Runners are shared among local worker processes (and workers of other hosts
+    that join the same execution, see globalConfig.shardRun). Once all runners are done, reports are merged so
+    summary, mail and shared caches are the same as with a single process.
+    """
+
+    def __init__(self, config: globalConfig, ignoreEnabled: bool = False):
+        super().__init__(config=config, ignoreEnabled=ignoreEnabled)
+
+        self.workers: int = max(0, config.harvestWorkers)
+        self.sharedRun: bool = config.shardRun is not None
+        self.runName: str = config.shardRun or f"{datetime.now():%Y%m%d%H%M%S}-{socket.gethostname()}-{getpid()}"
+        self.runPath: str = path.join(config.stateD(), SHARDDIRECTORY, getSaneFilenameStr(self.runName))
+        self.leases: RunnerLeases = RunnerLeases(self.runPath)
+        self.coordinator: Optional[str] = None
+        self.missingRunners: List[str] = []
+
+    def isCoordinator(self) -> bool:
+        return self.coordinator == self.leases.owner
+
+    def go(self):
+        self.startTime = datetime.now()
+        self.prepareRequests()
+
+        # Due runners are leased longest expected first. Workers create their own crawlers, these are dropped
+        self.createCrawlers(getUTC())
+        self.leases.seed(crawler.name for crawler in self.executionOrder(workers=max(1, self.workers)))
+        self.crawlers = []
+        self.coordinator = self.leases.claimCoordinator()
+
+        downloadStart = perf_counter()
+        self.runWorkers()
+        if not self.isCoordinator():
+            logging.info(f"Sharded execution '{self.runName}': {self.coordinator} is coordinator. Workers done")
+            self.stopTime = datetime.now()
+            return
+        self.waitForOthers()
+        self.actualMakespan = perf_counter() - downloadStart
+        self.merge()
+
+        if not self.globalCFG.dryRun:
+            self.storeCaches()
+            if (not self.globalCFG.dontSendEmails) and self.globalCFG.mailCFG:
+                self.email()
+        if not self.sharedRun:
+            rmtree(self.runPath, ignore_errors=True)
+
+        self.stopTime = datetime.now()
+
+    def runWorkers(self):
+        if not self.workers:
+            return
+        deadline = (time() + self.globalCFG.runDeadline) if self.globalCFG.runDeadline else None
+        context = get_context('spawn')
+        processes = [context.Process(target=runShardWorker, name=f"ShardWorker-{i}",
+                                     args=(self.globalCFG, self.runPath, self.ignoreEnabled, deadline,
+                                           logging.getLogger().level)) for i in range(self.workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            if process.exitcode:
+                logging.error(f"Shard worker {process.name} ({process.pid}) ended with code {process.exitcode}")
+        self.leases.abandon({leaseOwner(process.pid) for process in processes})
+
+    def waitForOthers(self):
+        """
+        Waits until runners leased by workers of other hosts are done (or their leases are over)
+        """
+        inFlight = self.leases.inFlight()
+        if inFlight:
+            logging.info(f"Waiting for runners executed by other hosts: {inFlight}")
+        while inFlight:
+            sleep(SHARDPOLLINTERVAL)
+            self.leases.claimCoordinator()  # Keeps lease of coordinator while waiting
+            inFlight = self.leases.inFlight()
+
+    def merge(self):
+        """
+        Gathers the reports of the execution: results of crawlers (as Crawler objects, as if they had run here) and
+        changes of shared caches
+        """
+        dictRunners = self.globalCFG.allRunners()
+        reportFiles = sorted(f for f in listdir(self.runPath) if f.endswith(f".{SHARDREPORTEXTENSION}"))
+        for filename in reportFiles:
+            try:
+                with open(path.join(self.runPath, filename), "rb") as handin:
+                    report = pickle.load(handin)
+            except Exception as exc:
+                logging.error(f"Problems reading shard report '{filename}' {type(exc)}:{exc}")
+                continue
+
+            for crawlerData in report['crawlers']:
+                cfgData = dictRunners.get(crawlerData['name'])
+                if cfgData is None:
+                    logging.error(f"Runner '{crawlerData['name']}' (reported by {report['owner']}) not in list of "
+                                  f"known runners. Results not merged")
+                    continue
+                try:
+                    crawler = Crawler(runnerCFG=cfgData, globalCFG=self.globalCFG)
+                    crawler.restoreResults(crawlerData['results'])
+                except Exception as exc:
+                    logging.error(f"Problems merging results of runner '{cfgData.name}' {type(exc)}:{exc}")
+                    logging.exception(exc, stack_info=True)
+                    continue
+                crawler.requestsSent = crawlerData['requestsSent']
+                crawler.duplicateHits = crawlerData['duplicateHits']
+                crawler.duration = crawlerData['duration']
+                if crawler.duration is not None:
+                    self.durations.record(crawler.name, crawler.duration, len(crawler.results))
+                requestMemo.sent += crawler.requestsSent
+                requestMemo.hits += crawler.duplicateHits
+                self.crawlers.append(crawler)
+
+            for name, cache in SHAREDCACHES.items():
+                if name in report['caches']:
+                    mergeCacheChanges(cache.data, report['caches'][name], combine=CACHECOMBINERS.get(name))
+            negativeCache.skipped += report['skipped']
+
+        self.crawlers.sort(key=lambda c: c.name.lower())
+        self.missingRunners = self.leases.notDone()
+        if self.missingRunners:
+            logging.warning(f"Sharded execution '{self.runName}': runners not executed {self.missingRunners}")
+
+    def printSummary(self, showFiles=True, showMails=True):
+        super().printSummary(showFiles=showFiles, showMails=showMails)
+        if not self.isCoordinator():
+            print(f" Sharded execution '{self.runName}': workers only, results are reported by {self.coordinator}")
+        if self.missingRunners:
+            print(f" Sharded execution '{self.runName}': runners not executed: {', '.join(self.missingRunners)}")
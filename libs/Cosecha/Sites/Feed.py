@@ -0,0 +1,254 @@
+"""
+Generic plugin for comics that publish a RSS/Atom feed with the images. Runner configuration ([RUNNER] section):
+* key: key for comic (required)
+* feedURL: URL of feed (required)
+* mediaRule: rules to find the URL of image in an item (one per line, first one that gets something wins).
+  Default: enclosure & img
+* commentRule: rules to find a comment for the image (alt text...). Default: none
+* idRule: rule to build the id of comic from the link of an item. Default: from date of item
+
+Rules:
+* enclosure: first image attached to the item (enclosure, media:content...)
+* img: src of first <img> in item content
+* xpath:<expression>: first result of XPath expression over item content (HTML)
+* regex:<pattern>: regular expression over item content (or link for idRule). Group 'value' or the whole match
+"""
+import logging
+import re
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from lxml import etree, html
+
+from libs.Cosecha.ComicPage import ComicPage
+from libs.Cosecha.Config import FEEDDATE
+from libs.Utils.Feed import parseFeedItems
+from libs.Utils.Files import getSaneFilenameStr
+from libs.Utils.Misc import datePub2Id
+from libs.Utils.Web import DownloadConditional, DownloadRawPage, MergeURL
+
+DEFAULTMEDIARULES = "enclosure\nimg"
+
+feedCache: Dict[str, dict] = dict()  # Downloaded feeds (URL -> {'timestamp':..., 'items': [...]}) for this execution
+ruleCache: Dict[Tuple[str, str], Callable[[dict], Optional[str]]] = dict()  # Compiled rules by (rule, field)
+
+
+class Page(ComicPage):
+    DATEFORMAT = FEEDDATE
+    IDFROMDATE = '%Y%m%dT%H%M'
+
+    def __init__(self, **kwargs):
+        # Keys from runner configuration come lowercased from ConfigParser
+        self.feedURL: Optional[str] = kwargs.pop('feedurl', None) or kwargs.pop('feedURL', None)
+        if not self.feedURL:
+            raise KeyError("Missing feedURL parameter")
+        self.mediaRules: str = kwargs.pop('mediarule', None) or DEFAULTMEDIARULES
+        self.commentRules: Optional[str] = kwargs.pop('commentrule', None)
+        self.idRule: Optional[str] = kwargs.pop('idrule', None)
+
+        auxURL = kwargs.pop('URL', None) or self.feedURL
+
+        super().__init__(URL=auxURL, **kwargs)
+
+    def __str__(self):
+        dataStr = f"[{self.size()}b]" if self.payload is not None else "No data"
+        idStr = f"{self.comicId}"
+        dateStr = f" ({self.dayWeek()})" if self.datePub() else ""
+
+        result = f"Comic '{self.key}' [{idStr}] {self.URL} -> {self.info.get('title')} {dataStr}{dateStr}"
+
+        return result
+
+    __repr__ = __str__
+
+    def pageArgs(self) -> dict:
+        result = {'key': self.key, 'feedurl': self.feedURL, 'mediarule': self.mediaRules,
+                  'commentrule': self.commentRules, 'idrule': self.idRule}
+        return result
+
+    @classmethod
+    def feedPages(cls, **kwargs) -> List[ComicPage]:
+        """
+        Gets the items of feed (if it has changed since last time)
+        :param kwargs: runner configuration. 'feedState' is a dict with data of previous downloads of feed
+        """
+        feedState: dict = kwargs.pop('feedState', None)
+        if feedState is None:
+            feedState = dict()
+        samplePage = cls(**kwargs)
+        feedURL = samplePage.feedURL
+
+        validators = feedState.setdefault(feedURL, dict())
+        feed = DownloadConditional(feedURL, validators)
+        if feed is None:
+            return []
+        storeFeed(feedURL, feed.data, feed.timestamp)
+
+        result = []
+        for item in feedCache[feedURL]['items']:
+            if item['date'] is None:
+                logging.warning(f"'{samplePage.key}' {item.get('link')}: no usable date in feed. Ignoring it")
+                continue
+            page = cls(**samplePage.pageArgs(), URL=item['link'])
+            try:
+                page.fillFromFeedItem(item, timestamp=feed.timestamp)
+            except (AttributeError, KeyError, TypeError, ValueError) as exc:
+                logging.warning(f"'{page.key}' {item.get('link')}: not enough data in feed ({type(exc)} {exc}). "
+                                f"Ignoring it")
+                continue
+            result.append(page)
+
+        return sorted(result, key=lambda p: p.datePub())
+
+    def downloadPage(self):
+        if self.feedURL not in feedCache:
+            feed = DownloadRawPage(self.feedURL)
+            storeFeed(self.feedURL, feed.data, feed.timestamp)
+        feedData = feedCache[self.feedURL]
+
+        items = sorted([i for i in feedData['items'] if i['date'] is not None], key=lambda i: i['date'])
+        if not items:
+            raise ValueError(f"'{self.key}': no usable items in feed {self.feedURL}")
+
+        if self.URL == self.feedURL:
+            position = len(items) - 1
+        else:
+            links = [i['link'] for i in items]
+            if self.URL not in links:
+                raise ValueError(f"'{self.key}': unable to find {self.URL} in feed {self.feedURL}")
+            position = links.index(self.URL)
+
+        self.fillFromFeedItem(items[position], timestamp=feedData['timestamp'])
+
+        links = {'first': items[0]['link'], 'last': items[-1]['link']}
+        if position > 0:
+            links['prev'] = items[position - 1]['link']
+        if position < len(items) - 1:
+            links['next'] = items[position + 1]['link']
+        self.updateLinksFromDict(links)
+
+    def fillFromFeedItem(self, item: dict, timestamp: datetime):
+        self.info = dict()
+
+        mediaURL = applyRules(self.mediaRules, item)
+        if mediaURL is None:
+            raise KeyError(f"Unable to find media with rules {self.mediaRules.split()}")
+
+        self.info['url'] = self.URL = item['link']
+        self.info['title'] = item['title'] or ""
+        self.info['datePublished'] = self.comicDate = item['date'].strftime(self.DATEFORMAT)
+        self.info['mediaURL'] = self.mediaURL = MergeURL(item['link'], mediaURL)
+        if self.commentRules:
+            self.info['comment'] = applyRules(self.commentRules, item)
+
+        if self.idRule:
+            self.comicId = applyRules(self.idRule, item, field='link')
+            if self.comicId is None:
+                raise KeyError(f"Unable to find id in '{item['link']}' with rule {self.idRule}")
+        else:
+            self.comicId = datePub2Id(self.comicDate, self.DATEFORMAT, self.IDFROMDATE)
+        self.info['id'] = self.comicId
+        self.info['titleStr'] = getSaneFilenameStr(self.info['title'])
+        self.timestamp = timestamp
+
+    def updateOtherInfo(self):
+        # Will do if need arises
+        pass
+
+    dataPath = ComicPage.sharedPathWithDate
+    metadataPath = ComicPage.sharedPathWithDate
+
+    def dataFilename(self):
+        ext = self.fileExtension()
+        intId = self.comicId
+
+        result = f"{self.key}.{intId}.{ext}"
+
+        return result
+
+    def metadataFilename(self):
+        ext = 'yml'
+        intId = self.comicId
+
+        result = f"{self.key}.{intId}.{ext}"
+        return result
+
+    def mailBodyFragment(self, indent=1, imgSeq: int = 0, imgTot: int = 0, **kwargs):
+        title = self.info.get('title') or self.comicId
+        dateStr = f" ({self.dayWeek()})" if self.datePub() else ""
+        commentStr = f"\n\"{self.info['comment']}\"\n" if self.info.get('comment') else ""
+
+        text = f"""{indent * "#"} ({imgSeq}/{imgTot}) {self.key} #{self.comicId}{dateStr} [{title}]({self.URL})
+![{self.mediaURL}](cid:{self.mediaAttId})
+{commentStr}"""
+
+        return text
+
+
+###############################
+def storeFeed(feedURL: str, raw: bytes, timestamp: datetime):
+    feedCache[feedURL] = {'timestamp': timestamp, 'items': parseFeedItems(raw)}
+
+
+def applyRules(rules: str, item: dict, field: str = 'content') -> Optional[str]:
+    """
+    Applies rules (one per line) to a feed item until one of them finds something
+    """
+    for rule in rules.splitlines():
+        rule = rule.strip()
+        if not rule:
+            continue
+        if (rule, field) not in ruleCache:
+            ruleCache[(rule, field)] = compileRule(rule, field)
+        result = ruleCache[(rule, field)](item)
+        if result:
+            return result.strip()
+
+    return None
+
+
+def compileRule(rule: str, field: str = 'content') -> Callable[[dict], Optional[str]]:
+    if rule == 'enclosure':
+        return lambda item: item['enclosures'][0] if item['enclosures'] else None
+
+    if rule == 'img':
+        rule = 'xpath://img/@src'
+
+    if rule.startswith('xpath:'):
+        expression = etree.XPath(rule.removeprefix('xpath:'))
+
+        def xpathRule(item: dict) -> Optional[str]:
+            tree = contentTree(item)
+            if tree is None:
+                return None
+            found = expression(tree)
+            if not found:
+                return None
+            first = found[0]
+            return first if isinstance(first, str) else first.text_content()
+
+        return xpathRule
+
+    if rule.startswith('regex:'):
+        pattern = re.compile(rule.removeprefix('regex:'), re.DOTALL)
+
+        def regexRule(item: dict) -> Optional[str]:
+            match = pattern.search(item.get(field) or '')
+            if not match:
+                return None
+            return match.group('value') if 'value' in pattern.groupindex else match.group(0)
+
+        return regexRule
+
+    raise ValueError(f"Unknown rule '{rule}'")
+
+
+def contentTree(item: dict):
+    """
+    Parsed content of item (parsed only once)
+    """
+    if '_tree' not in item:
+        content = item.get('content')
+        item['_tree'] = html.fragment_fromstring(content, create_parent='div') if content else None
+
+    return item['_tree']
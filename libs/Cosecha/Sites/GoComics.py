@@ -1,17 +1,35 @@
 import re
+from datetime import date
 from os import path
 from time import strftime, struct_time
-from typing import Optional
+from typing import Optional, Union
 from urllib.parse import urljoin
 
-import bs4
-
 from libs.Cosecha.ComicPage import ComicPage
 from libs.Cosecha.Config import GOCOMICSDATE
+from libs.Utils.Extract import hasClass, parseHTML, Rule, RuleSet
 from libs.Utils.Misc import datePub2Id
-from libs.Utils.Web import DownloadPage, findObjectsWithAttributes
+from libs.Utils.ParsePool import runParser
+from libs.Utils.Web import DownloadPage
 
 URLBASE = 'https://www.gocomics.com'
+URLDATEFORMAT = "%Y/%m/%d"
+
+COMICSNAVLINK = f"(//nav[{hasClass('content-section-padded-sm')}])[1]//a[@data-link='comics']"
+METADATAFIELDS = ['url', 'title', 'author', 'datePublished', 'mediaURL', 'about']
+LINKFIELDS = ['last', 'next', 'prev', 'first']
+PAGERULES = RuleSet(Rule('navHref', f"{COMICSNAVLINK}/@href"),
+                    Rule('navClass', f"{COMICSNAVLINK}/@class"),
+                    Rule('url', "//head/meta[@property='og:url']/@content"),
+                    Rule('title', "//head/meta[@name='twitter:description']/@content"),
+                    Rule('author', "//head/meta[@property='article:author']/@content"),
+                    Rule('datePublished', "//head/meta[@property='article:published_time']/@content"),
+                    Rule('mediaURL', "//head/meta[@property='og:image']/@content"),
+                    Rule('about', "//head/meta[@name='twitter:title']/@content"),
+                    Rule('last', f"//a[{hasClass('fa-forward')}]/@href"),
+                    Rule('next', f"//a[{hasClass('fa-caret-right')}]/@href"),
+                    Rule('prev', f"//a[{hasClass('fa-caret-left')}]/@href"),
+                    Rule('first', f"//a[{hasClass('fa-backward')}]/@href"), )
 
 
 class Page(ComicPage):
@@ -27,7 +45,7 @@ class Page(ComicPage):
         super().__init__(URL=auxURL, **kwargs)
 
     def __str__(self):
-        dataStr = f"[{self.size()}b]" if self.data else "No data"
+        dataStr = f"[{self.size()}b]" if self.payload is not None else "No data"
         idStr = f"{self.comicId}"
         dateStr = f" ({self.dayWeek()})" if self.datePub() else ""
 
@@ -37,22 +55,24 @@ class Page(ComicPage):
 
     __repr__ = __str__
 
+    @classmethod
+    def dateURL(cls, key: str, day: date) -> Optional[str]:
+        return buildURL(key, day)
+
     def downloadPage(self):
         self.info = dict()
 
-        pagBase = DownloadPage(self.URL)
+        pagBase = DownloadPage(self.URL, parse=False)
         self.timestamp = pagBase.timestamp
 
-        divNav = pagBase.data.find('nav', attrs={'class': 'content-section-padded-sm'})
-        if divNav is None:
-            raise ValueError(f"Unable to find nav bar in {self.URL}")
-        comicLink = divNav.find('a', attrs={'data-link': 'comics'})
-        comicPageURL = urljoin(self.URL, comicLink['href'])
-        if 'active' not in comicLink.attrs['class']:
-            pagBase = DownloadPage(comicPageURL)
-            self.URL = comicPageURL
+        # Pages addressed by date are already comic pages. Others (i.e. the one of the strip) may not be
+        parsed = runParser(parsePage, pagBase.data, self.URL, checkNav=not isDateURL(self.URL))
+        if 'comicPageURL' in parsed:
+            self.URL = parsed['comicPageURL']
+            pagBase = DownloadPage(self.URL, parse=False)
+            parsed = runParser(parsePage, pagBase.data, self.URL, checkNav=False)
 
-        metadata = findMetadata(pagBase.data)
+        metadata = parsed['metadata']
         self.info.update(metadata)
         self.comicDate = metadata['datePublished']
 
@@ -60,9 +80,7 @@ class Page(ComicPage):
         self.mediaURL = self.info['mediaURL']
         self.info['about'] = re.sub(r' \| GoComics.com', r'', self.info['about']).strip()
 
-        links = findComicLinks(pagBase.data, here=self.URL)
-
-        self.updateLinksFromDict(links)
+        self.updateLinksFromDict(parsed['links'])
 
     def updateOtherInfo(self):
         # Will do if need arises
@@ -97,7 +115,7 @@ class Page(ComicPage):
         return text
 
 
-def buildURL(key: str, dateOpt: Optional[struct_time] = None):
+def buildURL(key: str, dateOpt: Optional[Union[struct_time, date]] = None):
     """
     Builds a URL to retrieve things from GoComics
     :param key: key for desired comic
@@ -107,7 +125,7 @@ def buildURL(key: str, dateOpt: Optional[struct_time] = None):
 
     extraFields = [key]
     if dateOpt:
-        dateStr = strftime("%Y/%m/%d")
+        dateStr = dateOpt.strftime(URLDATEFORMAT) if isinstance(dateOpt, date) else strftime(URLDATEFORMAT, dateOpt)
         extraFields.append(dateStr)
 
     extraURL = path.join(*extraFields)
@@ -116,32 +134,30 @@ def buildURL(key: str, dateOpt: Optional[struct_time] = None):
     return result
 
 
-def findMetadata(webContent: bs4.BeautifulSoup):
-    targetInfo = [('url', 'property', "og:url"), ('title', 'name', "twitter:description"),
-                  ('author', 'property', "article:author"), ('datePublished', 'property', "article:published_time"),
-                  ('mediaURL', 'property', "og:image"), ('about', 'name', "twitter:title"), ]
-    result = dict()
+def isDateURL(url: str) -> bool:
+    return re.search(r'/\d{4}/\d{2}/\d{2}/?$', url) is not None
 
-    interestingMetas = findObjectsWithAttributes(webContent.find('head'), 'meta', targetInfo)
-
-    for label, tag in interestingMetas.items():
-        result[label] = tag['content']
-
-    return result
 
+def parsePage(raw: bytes, url: str, checkNav: bool = True) -> dict:
+    """
+    Extracts the data of a page (it may run in ParsePool)
+    :param raw: content of page
+    :param url: URL of page
+    :param checkNav: check in nav bar that it is the page of a comic
+    :return: dict with 'metadata' and 'links' or, if it is not the page of a comic, 'comicPageURL'
+    """
+    data = PAGERULES.extract(parseHTML(raw))
 
-def findComicLinks(webContent: bs4.BeautifulSoup, here: Optional[str] = None):
-    result = dict()
-
-    targetInfo = [('last', 'class', "fa-forward"), ('next', 'class', "fa-caret-right"),
-                  ('prev', 'class', "fa-caret-left"), ('first', 'class', "fa-backward"), ]
-
-    auxButtons = findObjectsWithAttributes(webContent, 'a', targetInfo)
+    if checkNav:
+        if data['navHref'] is None:
+            raise ValueError(f"Unable to find nav bar in {url}")
+        if 'active' not in (data['navClass'] or '').split():
+            return {'comicPageURL': urljoin(url, data['navHref'])}
 
-    for label, tag in auxButtons.items():
-        destLink = urljoin(here, tag['href'])
-        result[label] = destLink
+    result = {'metadata': {k: data[k] for k in METADATAFIELDS if data[k] is not None},
+              'links': {k: urljoin(url, data[k]) for k in LINKFIELDS if data[k] is not None}}
 
     return result
 
+
 ###############################
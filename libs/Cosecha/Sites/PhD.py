@@ -1,20 +1,33 @@
 import logging
 import os.path
 import re
-from typing import List
+from typing import List, Optional
 from urllib.parse import parse_qs, urlencode, urlparse
 
-import bs4
-from markdownify import markdownify
+from lxml import etree
 
 from libs.Cosecha.ComicPage import ComicPage
 from libs.Cosecha.Config import IDPATHDIVIDER
+from libs.Utils.Extract import parseHTML, Rule, RuleSet
 from libs.Utils.Files import getSaneFilenameStr
+from libs.Utils.ParsePool import runParser
 from libs.Utils.Web import DownloadPage
 
 URLBASE = "https://phdcomics.com/"
 KEY = "PhD"
 
+BUTTONSURL = "http://phdcomics.com/comics/images"
+PAGERULES = RuleSet(Rule('urlImg', "//head/meta[@property='og:image']/@content"),
+                    Rule('title', "//head/meta[@name='twitter:title']/@content"),
+                    Rule('print', f"//img[@src='{BUTTONSURL}/printit_button.gif']/parent::*/@href"),
+                    Rule('prev', f"//img[@src='{BUTTONSURL}/prev_button.gif']/parent::*/@href"),
+                    Rule('first', f"//img[@src='{BUTTONSURL}/first_button.gif']/parent::*/@href"),
+                    Rule('next', f"//img[@src='{BUTTONSURL}/next_button.gif']/parent::*/@href"), )
+IMGRULES = RuleSet(Rule('images', "//img[@src]", many=True), )
+FOOTNOTECELLS = etree.XPath("following-sibling::div//table//td")
+INLINEMARKS = {'i': '*', 'em': '*', 'b': '**', 'strong': '**'}
+MARKDOWNESCAPERE = re.compile(r'[*_]')
+
 
 class Page(ComicPage):
 
@@ -25,18 +38,23 @@ class Page(ComicPage):
         super().__init__(key=auxKey, URL=auxURL, **kwargs)
 
     def __str__(self):
-        dataStr = f"[{self.size()}b]" if self.data else "No data"
+        dataStr = f"[{self.size()}b]" if self.payload is not None else "No data"
         idStr = f"{self.comicId}"
         result = f"Comic '{self.key}' [{idStr}] {self.URL} -> {self.info['title']} {dataStr}"
 
         return result
 
+    @classmethod
+    def idURL(cls, key: str, comicId: str) -> Optional[str]:
+        return URLfromId(comicId)
+
     def downloadPage(self):
         self.info = dict()
 
-        pagBase = DownloadPage(self.URL, sanitizer=sanitizer)
+        pagBase = DownloadPage(self.URL, sanitizer=sanitizer, parse=False)
         self.timestamp = pagBase.timestamp
-        metadata = findMetas(pagBase.data)
+        parsed = runParser(parsePage, pagBase.data)
+        metadata = parsed['metadata']
         for k in ['urlImg', 'title', 'id', 'url']:
             if k in metadata:
                 self.info[k] = metadata[k]
@@ -52,8 +70,7 @@ class Page(ComicPage):
 
         self.info['titleStr'] = getSaneFilenameStr(self.info['title'])
 
-        comments = findFootNotes(webContent=pagBase.data, urlIMG=self.mediaURL)
-        self.info['comments'] = comments
+        self.info['comments'] = parsed['comments']
 
     def updateOtherInfo(self):
         # Will do if need arises
@@ -104,19 +121,27 @@ class Page(ComicPage):
 
 
 ###############################
-def findMetas(webContent: bs4.BeautifulSoup):
-    result = dict()
-
-    imgMeta = webContent.head.find('meta', attrs={'property': "og:image"})
-    if imgMeta:
-        result['urlImg'] = imgMeta['content']
-    metaTitle = webContent.head.find('meta', attrs={'name': "twitter:title"})
-    if metaTitle:
-        result['title'] = metaTitle['content']
-
-    linkPrint = parentOf(webContent, 'img', attrs={'src': 'http://phdcomics.com/comics/images/printit_button.gif'})
-    if linkPrint:
-        urlPrint = linkPrint['href']
+def parsePage(raw: bytes) -> dict:
+    """
+    Extracts the data of a (sanitized) page (it may run in ParsePool). Page is parsed once
+    :param raw: content of page
+    :return: dict with 'metadata' and 'comments'
+    """
+    tree = parseHTML(raw)
+    metadata = findMetas(PAGERULES.extract(tree))
+    result = {'metadata': metadata, 'comments': findFootNotes(tree, urlIMG=metadata['urlImg'])}
+
+    return result
+
+
+def findMetas(data: dict):
+    """
+    :param data: values of PAGERULES
+    """
+    result = {k: " ".join(data[k].split()) for k in ['urlImg', 'title'] if data[k] is not None}
+
+    urlPrint = data['print']
+    if urlPrint:
         comicId = extractId(urlPrint)
         if comicId is not None:
             result['id'] = comicId
@@ -126,28 +151,13 @@ def findMetas(webContent: bs4.BeautifulSoup):
     else:
         raise ValueError(f'Unable to find URL for print')
 
-    INFOLINKS = [('prev', 'http://phdcomics.com/comics/images/prev_button.gif'),
-                 ('first', 'http://phdcomics.com/comics/images/first_button.gif'),
-                 ('next', 'http://phdcomics.com/comics/images/next_button.gif')]
-
-    for label, iconLink in INFOLINKS:
-        parent = parentOf(webContent, 'img', attrs={'src': iconLink})
-        if parent:
-            destLnk = parent['href']
-            result[label] = destLnk
+    for label in ['prev', 'first', 'next']:
+        if data[label]:
+            result[label] = data[label]
 
     return result
 
 
-def parentOf(webContent: bs4.BeautifulSoup, *kargs, **kwargs):
-    son = webContent.find(*kargs, **kwargs)
-
-    if son:
-        return son.parent
-
-    return None
-
-
 def extractId(url: str):
     urlparts = urlparse(url)
     qparams = parse_qs(urlparts.query)
@@ -158,20 +168,19 @@ def extractId(url: str):
 
 def sanitizer(raw: (bytes, str)) -> bytes:
     """
-    Applies some changes to the page so it can be parsed. Let's say the HTML is 'legacy'
+    Applies some changes to the page so it can be parsed. Let's say the HTML is 'legacy': comments are closed with
+    '--!>', which swallows the rest of the page. Whitespace is left alone (texts are normalized when extracted)
     :param raw:
     :return:
     """
     if isinstance(raw, bytes):
-        result = raw.replace(b'--!>', b'-->').replace(b'\t', b' ').replace(b'\n', b' ')
-        result2 = re.sub(rb'\s+', rb' ', result)
+        result = raw.replace(b'--!>', b'-->')
     elif isinstance(raw, str):
-        result = raw.replace('--!>', '-->').replace('\t', ' ').replace('\n', ' ')
-        result2 = re.sub(r'\s+', r' ', result)
+        result = raw.replace('--!>', '-->')
     else:
         raise TypeError(f"sanitizer: don't know what to do with type {type(raw)}")
 
-    return result2
+    return result
 
 
 def URLfromId(comicId: str):
@@ -191,7 +200,12 @@ def URLfromId(comicId: str):
     return result
 
 
-def findFootNotes(webContent: bs4.BeautifulSoup, urlIMG: str):
+def findFootNotes(tree: etree.ElementBase, urlIMG: str) -> List[str]:
+    """
+    Texts (as markdown) of the cells of the tables in the divs that follow the image of comic
+    :param tree: lxml tree of page
+    :param urlIMG: URL of image of comic
+    """
     result = []
 
     def imgNameWithoutExt(path: str):
@@ -199,40 +213,50 @@ def findFootNotes(webContent: bs4.BeautifulSoup, urlIMG: str):
         result = re.sub(r'\.[^.]*$', '', fullFname)
         return result
 
-    def imgMatch(t: bs4.Tag, reqfname: str):
-        if t.name != 'img':
-            return False
+    reqFName = imgNameWithoutExt(urlparse(urlIMG).path)
 
-        if 'src' not in t.attrs:
-            return False
-        provPath = urlparse(t['src']).path
-        provFname = imgNameWithoutExt(provPath)
-        result = (provFname == reqfname)
-        return result
-
-    reqPath = urlparse(urlIMG).path
-    reqFName = imgNameWithoutExt(reqPath)
-
-    imgElem = webContent.find(lambda t: imgMatch(t, reqFName))
+    candidates = IMGRULES.extract(tree)['images']
+    imgElem = next((img for img in candidates if imgNameWithoutExt(urlparse(img.get('src')).path) == reqFName), None)
     if imgElem is None:
-
-        for i in webContent.find_all('img'):
-            logging.debug(f"Found img: '{i}")
+        for i in candidates:
+            logging.debug(f"Found img: '{i.get('src')}")
         raise ValueError("Unable to find Image element with picture")
-    divFootNotes = imgElem.fetchNextSiblings('div')
-    for div in divFootNotes:
-        tabElems = div.find_all('table')
-        if not tabElems:
-            continue
-        for tab in tabElems:
-            auxSubstrs = []
-            for td in tab.find_all('td'):
-                for child in td.find_all('i'):
-                    oldText = child.text
-                    newText = oldText.replace('**', '').strip()
-                    if oldText != newText:
-                        child.string.replace_with(newText)
-                auxSubstrs.append(markdownify(td.prettify(), strip=['td']).replace('\n', ' ').strip())
-
-            result.extend(auxSubstrs)
+
+    for td in FOOTNOTECELLS(imgElem):
+        result.append(" ".join(markdownFromElement(td).split()))
+
     return result
+
+
+def markdownFromElement(elem: etree.ElementBase, inItalics: bool = False) -> str:
+    """
+    Markdown for the (inline) content of an element: italics, bold and links. Other tags are ignored (but not their
+    text). '**' inside italics are dropped (some footnotes have them). Whitespace is kept where the source has it (marks
+    go around the words, spaces at the edges of an element go outside them)
+    """
+
+    def text(content: Optional[str]) -> str:
+        content = content or ''
+        if inItalics:
+            content = content.replace('**', '')
+        return MARKDOWNESCAPERE.sub(r'\\\g<0>', content)
+
+    parts = [text(elem.text)]
+    for child in elem:
+        if isinstance(child.tag, str):
+            tag = child.tag.lower()
+            content = markdownFromElement(child, inItalics=inItalics or INLINEMARKS.get(tag) == '*')
+            inner = content.strip()
+            before = content[:len(content) - len(content.lstrip())]
+            after = content[len(content.rstrip()):] if inner else ''
+            if tag == 'br':
+                parts.append(" ")
+            elif tag in INLINEMARKS and inner:
+                parts.append(f"{before}{INLINEMARKS[tag]}{inner}{INLINEMARKS[tag]}{after}")
+            elif tag == 'a' and child.get('href') and inner:
+                parts.append(f"{before}[{inner}]({child.get('href')}){after}")
+            else:
+                parts.append(content)
+        parts.append(text(child.tail))
+
+    return "".join(parts)
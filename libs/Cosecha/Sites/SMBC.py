@@ -1,16 +1,30 @@
 import json
+import logging
 import re
-from typing import Optional
+from datetime import datetime
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo
 
 import bs4
 
 from libs.Cosecha.ComicPage import ComicPage
 from libs.Cosecha.Config import SMBCDATE
+from libs.Utils.Extract import hasClass, parseHTML, Rule, RuleSet
+from libs.Utils.Feed import parseFeedItems
 from libs.Utils.Misc import datePub2Id
-from libs.Utils.Web import DownloadPage, MergeURL
+from libs.Utils.ParsePool import runParser
+from libs.Utils.Web import DownloadConditional, DownloadPage, MergeURL
 
 URLBASE = "https://www.smbc-comics.com/"
+FEEDURL = "https://www.smbc-comics.com/comic/rss"
 KEY = "smbc"
+SITETIMEZONE = ZoneInfo('America/New_York')  # Dates of pages (ld+json) come in this timezone. Used for feed items
+
+PAGERULES = RuleSet(Rule('ldJSON', "//script[@type='application/ld+json']/text()"),
+                    Rule('navLinks', f"//nav[{hasClass('cc-nav')} and @role='navigation']//a[@rel]", many=True,
+                         post=lambda a: (a.get('rel').split()[0], a.get('href'))),
+                    Rule('comicImgs', "//img[@id='cc-comic']", many=True,
+                         post=lambda img: (img.get('src'), img.get('title'))), )
 
 
 class Page(ComicPage):
@@ -24,7 +38,7 @@ class Page(ComicPage):
         super().__init__(key=auxKey, URL=auxURL, **kwargs)
 
     def __str__(self):
-        dataStr = f"[{self.size()}b]" if self.data else "No data"
+        dataStr = f"[{self.size()}b]" if self.payload is not None else "No data"
         idStr = f"{self.comicId}"
         dateStr = f" ({self.dayWeek()})" if self.datePub() else ""
 
@@ -35,9 +49,10 @@ class Page(ComicPage):
     def downloadPage(self):
         self.info = dict()
 
-        pagBase = DownloadPage(self.URL)
+        pagBase = DownloadPage(self.URL, parse=False)
         self.timestamp = pagBase.timestamp
-        metadata = findMetadataStruct(pagBase.data)
+        parsed = runParser(parsePage, pagBase.data)
+        metadata = parsed['metadata']
 
         for k in ['url', 'author', 'publisher', 'about', 'image', 'datePublished', 'name']:
             self.info[k] = metadata[k]
@@ -47,17 +62,62 @@ class Page(ComicPage):
         self.comicDate = metadata['datePublished']
         self.comicId = self.info['id'] = datePub2Id(self.comicDate, self.DATEFORMAT, self.IDFROMDATE)
 
-        links = findComicLinks(pagBase.data, here=self.URL)
+        links = parsed['links']
         self.linkNext = links.get('next')
         self.linkPrev = links.get('prev')
         self.linkFirst = links.get('first')
         self.linkLast = links.get('last')
 
-        infoImg = findComicImg(pagBase.data, url=self.mediaURL, here=self.URL)
+        infoImg = parsed['infoImg']
         self.info['comment'] = infoImg['comment']
         self.mediaURL = infoImg['urlImg']
         self.info['titleStr'] = findURLstr(self.info['url'])
 
+    @classmethod
+    def feedPages(cls, **kwargs) -> List[ComicPage]:
+        """
+        Gets the latest comics from RSS feed (if it has changed since last time). Items without all the info we need
+        will be downloaded the hard way
+        """
+        auxKey = kwargs.get('key', None) or KEY
+        feedState: dict = kwargs.get('feedState', None)
+        if feedState is None:
+            feedState = dict()
+
+        feed = DownloadConditional(FEEDURL, feedState.setdefault(FEEDURL, dict()))
+        if feed is None:
+            return []
+        result = []
+        for item in parseFeedItems(feed.data):
+            page = cls(key=auxKey, URL=item['link'])
+            try:
+                page.fillFromFeedItem(item, timestamp=feed.timestamp)
+            except (AttributeError, KeyError, TypeError, ValueError) as exc:
+                logging.debug(f"'{auxKey}' {item.get('link')}: not enough data in feed ({type(exc)} {exc})")
+                page = cls(key=auxKey, URL=item['link'])
+            result.append(page)
+
+        result.reverse()  # Feed comes newest first
+
+        return result
+
+    def fillFromFeedItem(self, item: dict, timestamp: datetime):
+        self.info = dict()
+
+        imgData = findFeedDescriptionData(item['content'], here=item['link'])
+        self.info['url'] = self.URL = item['link']
+        self.info['name'] = item['title']
+        self.info['title'] = re.sub(r'^Saturday Morning Breakfast Cereal -', r'', item['title']).strip()
+        self.info['datePublished'] = item['date'].astimezone(SITETIMEZONE).strftime(self.DATEFORMAT)
+        self.info['image'] = imgData['urlImg']
+        self.info['comment'] = imgData['comment']
+        self.info['titleStr'] = findURLstr(self.info['url'])
+
+        self.mediaURL = imgData['urlImg']
+        self.comicDate = self.info['datePublished']
+        self.comicId = self.info['id'] = datePub2Id(self.comicDate, self.DATEFORMAT, self.IDFROMDATE)
+        self.timestamp = timestamp
+
     def updateOtherInfo(self):
         # Will do if need arises
         pass
@@ -85,40 +145,52 @@ class Page(ComicPage):
         title = self.info['title']
         dateStr = f" ({self.dayWeek()})" if self.datePub() else ""
 
+        authorStr = f" (_by {self.info['author']}_)" if self.info.get('author') else ""
+
         text = f"""{indent * "#"} ({imgSeq}/{imgTot}) {self.key} #{self.comicId}{dateStr} [{title}]({self.URL})
 ![{self.mediaURL}](cid:{self.mediaAttId})
 
-"{self.info['comment']}" (_by {self.info['author']}_)
+"{self.info['comment']}"{authorStr}
 """
 
         return text
 
 
 ###############################
-def findMetadataStruct(webContent: bs4.BeautifulSoup):
-    scrInfo = webContent.find('script', attrs={'type': 'application/ld+json'}, recursive=True)
+def parsePage(raw: bytes) -> dict:
+    """
+    Extracts the data of a page (it may run in ParsePool)
+    :param raw: content of page
+    :return: dict with 'metadata', 'links' and 'infoImg'
+    """
+    data = PAGERULES.extract(parseHTML(raw))
+
+    metadata = findMetadataStruct(data['ldJSON'])
+    result = {'metadata': metadata, 'links': findComicLinks(data['navLinks'], here=metadata['url']),
+              'infoImg': findComicImg(data['comicImgs'], url=metadata['image'], here=metadata['url'])}
+
+    return result
 
+
+def findMetadataStruct(scrInfo: Optional[str]):
     if not scrInfo:
         raise ValueError("Unable to find metadata struct")
-    metaInfo = json.loads(scrInfo.text)
+    metaInfo = json.loads(scrInfo)
 
     result = {k: v for k, v in metaInfo.items() if not k.startswith('@')}
 
     return result
 
 
-def findComicLinks(webContent: bs4.BeautifulSoup, here: Optional[str] = None):
+def findComicLinks(navLinks: List[Tuple[str, str]], here: Optional[str] = None):
+    """
+    :param navLinks: (rel, href) of links in navigation bar
+    """
     result = dict()
 
-    barNav = webContent.find('nav', {"class": "cc-nav", "role": "navigation"})
-    for item in barNav.findAll('a'):
-        text = item.text
-        if 'rel' not in item.attrs:
-            continue
-        rel = item.attrs['rel'][0]
-        dest = item.attrs['href']
+    for rel, dest in navLinks:
         if rel not in {'first', 'prev', 'next', 'last'}:
-            raise ValueError(f"{item} '{rel}' It shouldn't have reached here")
+            raise ValueError(f"'{rel}' {dest} It shouldn't have reached here")
         destURL = MergeURL(here, dest)
 
         if destURL == here:
@@ -128,18 +200,17 @@ def findComicLinks(webContent: bs4.BeautifulSoup, here: Optional[str] = None):
     return result
 
 
-def findComicImg(webContent: bs4.BeautifulSoup, url: Optional[str], here: Optional[str] = None):
-    attrs = {'id': 'cc-comic'}
-    if url:
-        attrs['src'] = url
-
-    result = dict()
+def findComicImg(comicImgs: List[Tuple[str, str]], url: Optional[str], here: Optional[str] = None):
+    """
+    :param comicImgs: (src, title) of comic images in page
+    :param url: expected src of image (if known)
+    """
+    candidates = [img for img in comicImgs if not url or img[0] == url]
+    if not candidates:
+        raise ValueError(f"Unable to find comic image {url}")
+    dest, comment = candidates[0]
 
-    imgLink = webContent.find('img', attrs=attrs)
-
-    result['comment'] = imgLink.attrs['title']
-    dest = imgLink.attrs['src']
-    result['urlImg'] = MergeURL(here, dest)
+    result = {'comment': comment, 'urlImg': MergeURL(here, dest)}
 
     return result
 
@@ -153,3 +224,21 @@ def findURLstr(url: str):
         raise ValueError(f"findComicImg: '{url}' doesn't match pattern '{pat}'")
 
     return result
+
+
+def findFeedDescriptionData(description: str, here: Optional[str] = None) -> dict:
+    """
+    Description of feed items contain the image and the hover text
+    """
+    result = dict()
+
+    content = bs4.BeautifulSoup(description, 'html.parser')
+    imgLink = content.find('img')
+    if imgLink and imgLink.get('src'):
+        result['urlImg'] = MergeURL(here, imgLink['src'])
+
+    match = re.search(r'Hovertext:\s*(?P<comment>.+)', content.get_text(separator=' '), re.DOTALL)
+    if match:
+        result['comment'] = " ".join(match['comment'].split())
+
+    return result
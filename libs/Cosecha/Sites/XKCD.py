@@ -1,14 +1,31 @@
+import json
+import logging
 import re
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
-import bs4
+from requests import HTTPError
 
 from libs.Cosecha.ComicPage import ComicPage
 from libs.Cosecha.Config import IDPATHDIVIDER
-from libs.Utils.Web import DownloadPage, MergeURL
+from libs.Utils.Extract import hasClass, parseHTML, Rule, RuleSet
+from libs.Utils.ParsePool import runParser
+from libs.Utils.Web import DownloadJSON, DownloadPage, MergeURL
 
 URLBASE = "https://xkcd.com/"
 KEY = "xkcd"
+JSONENDPOINT = "info.0.json"
+MISSINGNUMS = {404}  # https://xkcd.com/404/ is a joke of its own: it doesn't exist
+
+PAGERULES = RuleSet(Rule('title', "//meta[@property='og:title']/@content"),
+                    Rule('url', "//meta[@property='og:url']/@content"),
+                    Rule('headTitle', "//head/title/text()"),
+                    Rule('permanentLink',
+                         "//text()[contains(., 'Permanent link to this comic: ')]/following::a[1]/text()"),
+                    Rule('navLinks', f"(//ul[{hasClass('comicNav')}])[1]//a", many=True,
+                         post=lambda a: (a.text_content(), a.get('href'))), )
+IMGRULES = RuleSet(Rule('comicImg', "//img[@alt=$title]", post=lambda img: (img.get('src'), img.get('title'))), )
+
+latestComic: Optional[dict] = None  # JSON data of latest comic (retrieved once per execution)
 
 
 class Page(ComicPage):
@@ -20,33 +37,63 @@ class Page(ComicPage):
         super().__init__(key=auxKey, URL=auxURL, **kwargs)
 
     def __str__(self):
-        dataStr = f"[{self.size()}b]" if self.data else "No data"
+        dataStr = f"[{self.size()}b]" if self.payload is not None else "No data"
         idStr = f"{self.comicId}"
         result = f"Comic '{self.key}' [{idStr}] {self.URL} -> {self.info['title']} {dataStr}"
 
         return result
 
     def downloadPage(self):
-        reqMetas = {'title', 'url'}
+        try:
+            self.downloadPageJSON()
+        except (HTTPError, KeyError, ValueError, json.JSONDecodeError) as exc:
+            logging.warning(f"'{self.key}': problems using JSON API for {self.URL} ({type(exc)} {exc}). Trying HTML")
+            self.downloadPageHTML()
+
+    def downloadPageJSON(self):
+        """
+        Fills in fields using the JSON API of XKCD. Navigation links are calculated from comic number (and latest one)
+        """
         self.info = dict()
 
-        pagBase = DownloadPage(self.URL)
-        metas = findInterestingMetas(pagBase.data)
+        latest = getLatestComic()
+        latestNum = int(latest['num'])
+        comicNum = numFromURL(self.URL)
+        if (comicNum is None) or (comicNum == latestNum):
+            comicData = latest
+        else:
+            apiData = DownloadJSON(MergeURL(URLfromNum(comicNum), JSONENDPOINT))
+            self.timestamp = apiData.timestamp
+            comicData = apiData.data
+        comicNum = int(comicData['num'])
+
+        self.info['title'] = comicData.get('safe_title') or comicData['title']
+        self.URL = self.info['url'] = URLfromNum(comicNum)
+        self.comicId = self.info['id'] = str(comicNum)
+        self.info['comment'] = comicData['alt']
+        self.mediaURL = comicData['img']
+        self.info['titleStr'] = titleStrFromMediaURL(self.mediaURL)
 
-        if reqMetas.difference(set(metas.keys())):
-            metas = findInterestingMetasTheHardWay(pagBase.data, currMetas=metas)
+        self.updateLinksFromDict(comicLinksFromNum(comicNum, latestNum))
+
+    def downloadPageHTML(self):
+        self.info = dict()
+
+        pagBase = DownloadPage(self.URL, parse=False)
+        parsed = runParser(parsePage, pagBase.data)
+        metas = parsed['metas']
 
         self.info['title'] = metas['title']
         self.URL = self.info['url'] = metas['url']
         self.comicId = self.info['id'] = extractId(metas['url'])
 
-        links = findComicLinks(pagBase.data, here=self.URL, thisPage=self.info.get('url', None))
+        links = parsed['links']
         self.linkNext = links.get('next')
         self.linkPrev = links.get('prev')
         self.linkFirst = links.get('first')
         self.linkLast = links.get('last')
 
-        infoImg = findComicImg(pagBase.data, title=metas['title'], here=self.URL)
+        infoImg = parsed['infoImg']
         self.info['comment'] = infoImg['comment']
         self.info['titleStr'] = infoImg['titleStr']
         self.mediaURL = infoImg['urlImg']
@@ -96,53 +143,63 @@ class Page(ComicPage):
         return text
 
 
-def findInterestingMetas(webContent: bs4.BeautifulSoup):
+def parsePage(raw: bytes) -> dict:
+    """
+    Extracts the data of a page (it may run in ParsePool)
+    :param raw: content of page
+    :return: dict with 'metas', 'links' and 'infoImg'
+    """
+    reqMetas = {'title', 'url'}
+    tree = parseHTML(raw)
+    data = PAGERULES.extract(tree)
+
+    metas = findInterestingMetas(data)
+    if reqMetas.difference(set(metas.keys())):
+        metas = findInterestingMetasTheHardWay(data, currMetas=metas)
+
+    result = {'metas': metas, 'links': findComicLinks(data['navLinks'], here=metas['url'], thisPage=metas['url']),
+              'infoImg': findComicImg(IMGRULES.extract(tree, title=metas['title'])['comicImg'], here=metas['url'])}
+
+    return result
+
+
+def findInterestingMetas(data: dict):
     """
     Metadata for page (meta's) contain all the interesting info (if present)
-    :param webContent:
+    :param data: values of PAGERULES
     :return:
     """
     labs2extract = {'title', 'url'}
-    result = dict()
-
-    for entry in webContent.findAll('meta'):
-        if 'property' not in entry.attrs:
-            continue
-        label = entry.attrs['property'].removeprefix('og:')
-        if label not in labs2extract:
-            continue
-        result[label] = entry.attrs['content']
+    result = {label: data[label] for label in labs2extract if data[label] is not None}
 
     return result
 
 
-def findInterestingMetasTheHardWay(webContent: bs4.BeautifulSoup, currMetas: dict):
+def findInterestingMetasTheHardWay(data: dict, currMetas: dict):
     """
     If we couldn't extract information from meta tags on the head block, let's find info one by one
-    :param webContent:
+    :param data: values of PAGERULES
     :param currMetas:
     :return:
     """
     result = currMetas.copy()
     if 'title' not in currMetas:
-        auxTitle = webContent.head.find('title').text.lstrip('xkcd:').strip()
+        auxTitle = data['headTitle'].lstrip('xkcd:').strip()
         result['title'] = auxTitle
     if 'url' not in currMetas:
-        auxText = webContent.find(string=re.compile('Permanent link to this comic: '))
-        auxLink = auxText.find_next('a')
-        result['url'] = auxLink.text.strip()
+        result['url'] = data['permanentLink'].strip()
 
     return result
 
 
-def findComicLinks(webContent: bs4.BeautifulSoup, here: Optional[str] = None, thisPage: Optional[str] = None):
+def findComicLinks(navLinks: List[Tuple[str, str]], here: Optional[str] = None, thisPage: Optional[str] = None):
+    """
+    :param navLinks: (text, href) of links in navigation bar
+    """
     result = dict()
 
-    barNav = webContent.find('ul', {"class": "comicNav"})
-    for item in barNav.findAll('a'):
-        text = item.text
+    for text, dest in navLinks:
         label = ''
-        dest = item.attrs['href']
         if (text == '|<'):
             label = 'first'
         elif (text == '< Prev'):
@@ -154,7 +211,7 @@ def findComicLinks(webContent: bs4.BeautifulSoup, here: Optional[str] = None, th
         elif (text == '>|'):
             label = 'last'
         else:
-            raise ValueError(f"{item} '{text}' It shouldn't have reached here")
+            raise ValueError(f"{dest} '{text}' It shouldn't have reached here")
 
         if dest in {'#'}:
             if thisPage:
@@ -184,19 +241,70 @@ def extractId(url):
     raise ValueError(f"extractId: '{url}' doesn't match pattern '{pat}'")
 
 
-def findComicImg(webContent: bs4.BeautifulSoup, title: Optional[str], here: Optional[str] = None):
-    result = dict()
+def findComicImg(comicImg: Optional[Tuple[str, str]], here: Optional[str] = None):
+    """
+    :param comicImg: (src, title) of comic image
+    """
+    if comicImg is None:
+        raise ValueError("Unable to find comic image")
+    dest, comment = comicImg
 
-    imgLink = webContent.find('img', {'alt': title})
-    result['comment'] = imgLink.attrs['title']
-    dest = imgLink.attrs['src']
+    result = dict()
+    result['comment'] = comment
     result['urlImg'] = MergeURL(here, dest)
+    result['titleStr'] = titleStrFromMediaURL(dest)
+
+    return result
 
+
+def titleStrFromMediaURL(url: str) -> str:
     pat = r'/(?P<titleStr>[^./]+)\.\w+$'
-    match = re.search(pat, dest)
+    match = re.search(pat, url)
     if match:
-        result['titleStr'] = match['titleStr']
-    else:
-        raise ValueError(f"findComicImg: '{dest}' doesn't match pattern '{pat}'")
+        return match['titleStr']
+
+    raise ValueError(f"titleStrFromMediaURL: '{url}' doesn't match pattern '{pat}'")
+
+
+def getLatestComic() -> dict:
+    """
+    Retrieves (once per execution) data of latest comic from JSON API
+    :return: dict with API data
+    """
+    global latestComic
+
+    if latestComic is None:
+        latestComic = DownloadJSON(MergeURL(URLBASE, JSONENDPOINT)).data
+
+    return latestComic
+
+
+def numFromURL(url: str) -> Optional[int]:
+    """
+    Number of comic from a URL. None if URL has no number (home page, i.e. latest comic)
+    """
+    match = re.search(r'/(?P<id>\d+)/?$', url)
+
+    return int(match['id']) if match else None
+
+
+def URLfromNum(comicNum: int) -> str:
+    return MergeURL(URLBASE, f"/{comicNum}/")
+
+
+def comicLinksFromNum(comicNum: int, latestNum: int) -> dict:
+    def neighbour(num: int, step: int):
+        result = num + step
+        while result in MISSINGNUMS:
+            result += step
+        return result
+
+    result = dict()
+    if comicNum > 1:
+        result['first'] = URLfromNum(1)
+        result['prev'] = URLfromNum(neighbour(comicNum, -1))
+    if comicNum < latestNum:
+        result['next'] = URLfromNum(neighbour(comicNum, 1))
+        result['last'] = URLfromNum(latestNum)
 
     return result
@@ -0,0 +1,163 @@
+"""
+Declarative extraction of data from HTML pages. Plugins declare their fields as XPath rules, compiled once (when the
+module is loaded) and evaluated over a single lxml tree of the page. Time spent on every rule is kept so slow rules can
+be spotted (see tools/BenchParsers.py). Timings measured in processes of ParsePool are sent back with the results
+(see takeTimings and addTimings).
+"""
+from threading import Lock
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional
+
+from lxml import etree, html
+
+# Rule sets created in this process by key (the same in every process: names and expressions of rules)
+RULESETS: Dict[str, List['RuleSet']] = dict()
+
+def hasClass(className: str, attr: str = 'class') -> str:
+    """
+    XPath test for elements whose attribute (a list of words separated by spaces, like class) contains className
+    """
+    return f"contains(concat(' ', normalize-space(@{attr}), ' '), ' {className} ')"
+
+
+def parseHTML(raw: bytes) -> etree.ElementBase:
+    """
+    Builds the lxml tree of a page
+    """
+    return html.document_fromstring(raw)
+
+
+class Rule:
+    """
+    A field of a page: XPath expression plus optional processing of result
+    """
+
+    def __init__(self, name: str, xpath: str, many: bool = False, post: Optional[Callable[[Any], Any]] = None):
+        """
+        :param name: name of field
+        :param xpath: expression. It may use variables ($name) provided on evaluation
+        :param many: if True, field is the list of all the results. First one (or None) otherwise
+        :param post: function applied to every result
+        """
+        self.name: str = name
+        self.expression: str = xpath
+        self.xpath: etree.XPath = etree.XPath(xpath)
+        self.many: bool = many
+        self.post: Optional[Callable[[Any], Any]] = post
+
+    def __str__(self):
+        result = f"Rule '{self.name}': {self.expression}{' (many)' if self.many else ''}"
+        return result
+
+    __repr__ = __str__
+
+    def evaluate(self, tree: etree.ElementBase, **variables) -> Any:
+        found = self.xpath(tree, **variables)
+        if not isinstance(found, list):  # string(), count()...
+            found = [found]
+        # Strings from lxml keep a reference to the tree. They are turned into plain ones so results can be pickled
+        values = [str(v) if isinstance(v, str) else v for v in found]
+        if self.post:
+            values = [self.post(v) for v in values]
+
+        if self.many:
+            return values
+        return values[0] if values else None
+
+
+class RuleSet:
+    """
+    Group of rules evaluated together over the same tree
+    """
+
+    def __init__(self, *rules: Rule):
+        self.rules: List[Rule] = list(rules)
+        self.timings: Dict[str, List[float]] = {rule.name: [0.0, 0] for rule in self.rules}  # name -> [seconds, calls]
+        self.lock: Lock = Lock()
+        self.key: str = "\n".join(f"{rule.name}={rule.expression}" for rule in self.rules)
+        RULESETS.setdefault(self.key, []).append(self)
+
+    def __str__(self):
+        result = f"RuleSet: {[rule.name for rule in self.rules]}"
+        return result
+
+    __repr__ = __str__
+
+    def extract(self, tree: etree.ElementBase, **variables) -> Dict[str, Any]:
+        """
+        Evaluates all the rules
+        :param tree: lxml tree (see parseHTML)
+        :param variables: values for variables used in expressions
+        :return: dict name of rule -> value
+        """
+        result = dict()
+        elapsed = dict()
+        for rule in self.rules:
+            timeIn = perf_counter()
+            result[rule.name] = rule.evaluate(tree, **variables)
+            elapsed[rule.name] = perf_counter() - timeIn
+
+        with self.lock:
+            for name, seconds in elapsed.items():
+                self.timings[name][0] += seconds
+                self.timings[name][1] += 1
+
+        return result
+
+    def resetTimings(self):
+        with self.lock:
+            self.timings = {rule.name: [0.0, 0] for rule in self.rules}
+
+    def takeTimings(self) -> Dict[str, List[float]]:
+        """
+        Timings measured since last call (they are reset)
+        """
+        with self.lock:
+            result = self.timings
+            self.timings = {rule.name: [0.0, 0] for rule in self.rules}
+        return result
+
+    def addTimings(self, timings: Dict[str, List[float]]):
+        with self.lock:
+            for name, (seconds, calls) in timings.items():
+                if name in self.timings:
+                    self.timings[name][0] += seconds
+                    self.timings[name][1] += calls
+
+    def timingReport(self) -> List[str]:
+        """
+        Average time of every rule, slowest first
+        """
+        with self.lock:
+            timings = {name: list(data) for name, data in self.timings.items()}
+        result = []
+        for name, (seconds, calls) in sorted(timings.items(), key=lambda i: -i[1][0]):
+            avgStr = f"{seconds / calls * 1e6:9.1f}us" if calls else "        -"
+            result.append(f"{name:20} {avgStr} ({calls} calls)")
+        return result
+
+
+def takeTimings() -> Dict[str, Dict[str, List[float]]]:
+    """
+    Timings of all the rule sets of the process measured since last call (only those used). Workers of ParsePool send
+    them with the results
+    :return: dict key of rule set -> timings
+    """
+    result = dict()
+    for key, ruleSets in RULESETS.items():
+        for ruleSet in ruleSets:
+            for name, (seconds, calls) in ruleSet.takeTimings().items():
+                if calls:
+                    total = result.setdefault(key, dict()).setdefault(name, [0.0, 0])
+                    total[0] += seconds
+                    total[1] += calls
+    return result
+
+
+def addTimings(timings: Dict[str, Dict[str, List[float]]]):
+    """
+    Adds timings measured in another process (see takeTimings) to the rule sets of this one
+    """
+    for key, ruleSetTimings in timings.items():
+        if key in RULESETS:
+            RULESETS[key][0].addTimings(ruleSetTimings)
@@ -0,0 +1,95 @@
+"""
+RSS/Atom feeds parsing
+"""
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from io import BytesIO
+from typing import List, Optional
+
+from lxml import etree
+
+ATOMNS = "http://www.w3.org/2005/Atom"
+RSS1NS = "http://purl.org/rss/1.0/"
+MEDIANS = "http://search.yahoo.com/mrss/"
+CONTENTNS = "http://purl.org/rss/1.0/modules/content/"
+DCNS = "http://purl.org/dc/elements/1.1/"
+
+ITEMTAGS = ['item', f"{{{RSS1NS}}}item", f"{{{ATOMNS}}}entry"]
+
+
+def parseFeedItems(raw: bytes) -> List[dict]:
+    """
+    Extracts the items of a RSS or Atom feed. Document is parsed incrementally and elements of items are dropped once
+    processed, so the tree never holds more than one item (raw document and the list of dicts are still kept whole).
+    :param raw: feed as downloaded
+    :return: list of dicts (in the order of the feed) with keys: title, link, id, date (datetime or None), content
+    (HTML as text) and enclosures (list of URLs of images attached to item)
+    """
+    result = []
+
+    for _, elem in etree.iterparse(BytesIO(raw), events=('end',), tag=ITEMTAGS, recover=True, resolve_entities=False,
+                                   no_network=True):
+        result.append(feedItemData(elem))
+
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    return result
+
+
+def feedItemData(elem: etree._Element) -> dict:
+    def childText(*tags) -> Optional[str]:
+        for tag in tags:
+            child = elem.find(tag)
+            if child is not None and child.text:
+                return child.text.strip()
+        return None
+
+    atom = lambda t: f"{{{ATOMNS}}}{t}"
+
+    result = dict()
+    result['title'] = childText('title', f"{{{RSS1NS}}}title", atom('title'))
+    result['link'] = childText('link', f"{{{RSS1NS}}}link")
+    result['id'] = childText('guid', atom('id'))
+    result['content'] = childText(f"{{{CONTENTNS}}}encoded", 'description', f"{{{RSS1NS}}}description",
+                                  atom('content'), atom('summary'))
+    result['date'] = parseFeedDate(
+            childText('pubDate', atom('published'), atom('updated'), f"{{{DCNS}}}date"))
+
+    enclosures = [e.get('url') for e in elem.findall('enclosure') if
+                  e.get('url') and (e.get('type') or 'image/').startswith('image/')]
+    enclosures.extend(e.get('url') for e in elem.iter(f"{{{MEDIANS}}}content") if
+                      e.get('url') and (e.get('medium', 'image') == 'image'))
+    for link in elem.findall(atom('link')):
+        rel = link.get('rel', 'alternate')
+        if rel == 'alternate' and result['link'] is None:
+            result['link'] = link.get('href')
+        elif rel == 'enclosure' and (link.get('type') or 'image/').startswith('image/'):
+            enclosures.append(link.get('href'))
+    result['enclosures'] = enclosures
+
+    if result['id'] is None:
+        result['id'] = result['link']
+
+    return result
+
+
+def parseFeedDate(dateStr: Optional[str]) -> Optional[datetime]:
+    """
+    Dates in feeds may come as RFC 822 (RSS) or ISO 8601 (Atom, Dublin Core). Dates without timezone are taken as UTC
+    """
+    if not dateStr:
+        return None
+    try:
+        result = parsedate_to_datetime(dateStr)
+    except (TypeError, ValueError):
+        try:
+            result = datetime.fromisoformat(dateStr)
+        except ValueError:
+            return None
+
+    if result.tzinfo is None:
+        result = result.replace(tzinfo=timezone.utc)
+
+    return result
@@ -1,20 +1,187 @@
+import fcntl
+import json
 import logging
 import re
+from contextlib import contextmanager
+from datetime import date, datetime
 from hashlib import file_digest, sha256
+from os import makedirs, path, remove
+from typing import Optional
 
+import magic
 import yaml
 
+# libyaml bindings are way faster than pure python ones. Use them if available
+try:
+    from yaml import CSafeDumper as YAMLDumper, CSafeLoader as YAMLLoader
+except ImportError:
+    from yaml import SafeDumper as YAMLDumper, SafeLoader as YAMLLoader
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Format -> extension of metadata files
+METADATAFORMATS = {'yaml': 'yml', 'json': 'json', 'msgpack': 'msgpack'}
+METADATAEXTENSIONS = {'yml': 'yaml', 'yaml': 'yaml', 'json': 'json', 'msgpack': 'msgpack'}
+DEFAULTMETADATAFORMAT = 'yaml'
+MAGICSAMPLESIZE = 64 * 1024  # Bytes of media given to libmagic to find its type
+# JSON & msgpack have no dates. They are stored as {key: ISO string} so they are dates again when loaded (as with YAML)
+DATETIMEKEY = '__datetime__'
+DATEKEY = '__date__'
+
+
+@contextmanager
+def lockedFile(filename: str):
+    """
+    Holds an exclusive lock on filename (created if needed) so processes sharing the directory, even from other hosts,
+    take turns
+    """
+    makedirs(path.dirname(filename) or '.', mode=0o755, exist_ok=True)
+    with open(filename, "a") as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        try:
+            yield lockFile
+        finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+
 
 def loadYAML(filename: str):
     with open(filename, "r") as file:
-        inHash = yaml.safe_load(file)
+        inHash = yaml.load(file, Loader=YAMLLoader)
 
     return inHash
 
 
 def saveYAML(data, filename: str):
     with open(filename, "w") as file:
-        yaml.safe_dump(data, file, indent=2, sort_keys=True)
+        yaml.dump(data, file, Dumper=YAMLDumper, indent=2, sort_keys=True)
+
+
+def dumpYAML(data) -> bytes:
+    result = yaml.dump(data, Dumper=YAMLDumper, indent=2, sort_keys=True).encode('utf-8')
+
+    return result
+
+
+def parseYAML(raw: bytes):
+    result = yaml.load(raw, Loader=YAMLLoader)
+
+    return result
+
+
+def encodeDates(value):
+    """
+    Encoder (default) for JSON & msgpack of values they can't store (see DATETIMEKEY)
+    """
+    if isinstance(value, datetime):
+        return {DATETIMEKEY: value.isoformat()}
+    if isinstance(value, date):
+        return {DATEKEY: value.isoformat()}
+    raise TypeError(f"Unable to store '{value}' ({type(value)}) in metadata")
+
+
+def decodeDates(value: dict):
+    """
+    Decoder (object_hook) for JSON & msgpack of values stored by encodeDates
+    """
+    if len(value) == 1:
+        if DATETIMEKEY in value:
+            return datetime.fromisoformat(value[DATETIMEKEY])
+        if DATEKEY in value:
+            return date.fromisoformat(value[DATEKEY])
+    return value
+
+
+def serializeMetadata(data, fmt: str = DEFAULTMETADATAFORMAT) -> bytes:
+    if fmt == 'yaml':
+        return dumpYAML(data)
+    elif fmt == 'json':
+        return json.dumps(data, sort_keys=True, default=encodeDates).encode('utf-8')
+    elif fmt == 'msgpack':
+        if msgpack is None:
+            raise ImportError("Metadata format 'msgpack' requested but module msgpack is not installed")
+        return msgpack.packb(data, default=encodeDates, use_bin_type=True)
+    raise ValueError(f"Unknown metadata format '{fmt}'. Known ones are {set(METADATAFORMATS.keys())}")
+
+
+def deserializeMetadata(raw: bytes, fmt: str = DEFAULTMETADATAFORMAT):
+    if fmt == 'yaml':
+        return parseYAML(raw)
+    elif fmt == 'json':
+        return json.loads(raw, object_hook=decodeDates)
+    elif fmt == 'msgpack':
+        if msgpack is None:
+            raise ImportError("Metadata format 'msgpack' requested but module msgpack is not installed")
+        return msgpack.unpackb(raw, raw=False, object_hook=decodeDates)
+    raise ValueError(f"Unknown metadata format '{fmt}'. Known ones are {set(METADATAFORMATS.keys())}")
+
+
+def metadataFormatFromFilename(filename: str) -> str:
+    ext = path.splitext(filename)[1].lstrip('.').lower()
+    if ext not in METADATAEXTENSIONS:
+        raise ValueError(f"Unable to find metadata format for '{filename}'")
+
+    return METADATAEXTENSIONS[ext]
+
+
+def metadataFilenameForFormat(filename: str, fmt: str) -> str:
+    if fmt not in METADATAFORMATS:
+        raise ValueError(f"Unknown metadata format '{fmt}'. Known ones are {set(METADATAFORMATS.keys())}")
+
+    return f"{path.splitext(filename)[0]}.{METADATAFORMATS[fmt]}"
+
+
+def findMetadataFile(filename: str) -> Optional[str]:
+    """
+    Finds a metadata file regardless of the format it was stored with
+    :param filename: name of metadata file (extension may not match the one of actual file)
+    :return: name of existing file or None
+    """
+    if path.exists(filename):
+        return filename
+
+    for fmt in METADATAFORMATS:
+        candidate = metadataFilenameForFormat(filename, fmt)
+        if path.exists(candidate):
+            return candidate
+
+    return None
+
+
+def loadMetadata(filename: str):
+    realFilename = findMetadataFile(filename)
+    if realFilename is None:
+        raise FileNotFoundError(f"Unable to find metadata file '{filename}' (any format)")
+
+    with open(realFilename, "rb") as file:
+        raw = file.read()
+
+    return deserializeMetadata(raw, metadataFormatFromFilename(realFilename))
+
+
+def saveMetadata(data, filename: str, fmt: str = DEFAULTMETADATAFORMAT, removeOthers: bool = True) -> str:
+    """
+    Stores metadata in requested format. Extension of file is changed to match format
+    :param data: data to store
+    :param filename: name of metadata file
+    :param fmt: format
+    :param removeOthers: remove files of the same metadata in other formats (findMetadataFile could find them first)
+    :return: name of the file actually written
+    """
+    realFilename = metadataFilenameForFormat(filename, fmt)
+
+    with open(realFilename, "wb") as file:
+        file.write(serializeMetadata(data, fmt))
+
+    if removeOthers:
+        for ext in METADATAEXTENSIONS:
+            otherFilename = f"{path.splitext(filename)[0]}.{ext}"
+            if otherFilename != realFilename and path.exists(otherFilename):
+                remove(otherFilename)
+
+    return realFilename
 
 
 def sha256sum(filename):
@@ -36,6 +203,16 @@ def shaData(data):
     return result
 
 
+def mimeTypeFromData(data) -> str:
+    """
+    MIME type of media. Type is in the first bytes (headers) so only those are given to libmagic
+    :param data: bytes-like object (bytes, memoryview...)
+    """
+    result = magic.detect_from_content(bytes(data[:MAGICSAMPLESIZE])).mime_type
+
+    return result
+
+
 def extensionFromType(dataType: str):
     if dataType in {'image/png'}:
         return 'png'
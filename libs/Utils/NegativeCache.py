@@ -0,0 +1,117 @@
+"""
+URLs that failed recently. They are not requested again until their retry window (which grows exponentially with
+every failure) is over. URLs that don't exist (404, 410) are blocked from the first failure, other problems (timeouts,
+server errors...) must happen several times in a row.
+"""
+import json
+import logging
+from os import makedirs, path
+from threading import Lock
+from time import localtime, strftime, time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+NEGATIVECACHEFILENAME = "negative.cache"
+NEGATIVEBASEWINDOW = 3600  # Seconds before first retry
+NEGATIVEMAXWINDOW = 30 * 86400  # Maximum time between retries
+NEGATIVEPERMANENTSTATUSES = {404, 410}  # Answers that block an URL from the first failure
+NEGATIVEMINATTEMPTS = 3  # Other failures in a row (one per execution) needed to block an URL
+CHRONICATTEMPTS = 5  # Failures for an URL to be considered chronic
+NEGATIVETIMEFORMAT = "%Y-%m-%d %H:%M"
+
+
+class KnownFailingURL(requests.HTTPError):
+    """URL failed recently and its retry window is not over"""
+    pass
+
+
+class NegativeCache:
+
+    def __init__(self, filename: Optional[str] = None, enabled: bool = True):
+        self.filename: Optional[str] = filename
+        self.enabled: bool = enabled
+        self.data: Dict[str, dict] = dict()
+        self.skipped: int = 0
+        self.lock: Lock = Lock()
+
+    def __str__(self):
+        result = f"NegativeCache: {len(self.data)} URLs ({self.skipped} requests skipped) file: '{self.filename}'"
+        return result
+
+    __repr__ = __str__
+
+    def __len__(self):
+        return len(self.data)
+
+    def load(self):
+        if self.filename and path.exists(self.filename):
+            try:
+                with open(self.filename, "r") as handin:
+                    self.data = json.load(handin)
+            except ValueError as exc:
+                logging.warning(f"{self}: unable to read file. Starting from scratch. {exc}")
+                self.data = dict()
+        return self
+
+    def store(self):
+        if not self.filename:
+            return
+        makedirs(path.dirname(self.filename) or '.', mode=0o755, exist_ok=True)
+        with self.lock:
+            with open(self.filename, "w") as handout:
+                json.dump(self.data, handout, indent=1, sort_keys=True)
+
+    @staticmethod
+    def retryAt(entry: dict) -> float:
+        blockFrom = 1 if entry['status'] in NEGATIVEPERMANENTSTATUSES else NEGATIVEMINATTEMPTS
+        if entry['attempts'] < blockFrom:
+            return entry['lastSeen']
+        window = min(NEGATIVEMAXWINDOW, NEGATIVEBASEWINDOW * 2 ** (entry['attempts'] - blockFrom))
+        return entry['lastSeen'] + window
+
+    def check(self, url: str) -> Optional[dict]:
+        """
+        Returns the entry for URL if it must not be requested now (None if it can)
+        """
+        if not self.enabled:
+            return None
+        with self.lock:
+            entry = self.data.get(url)
+            if entry is None or time() >= self.retryAt(entry):
+                return None
+            self.skipped += 1
+            return entry
+
+    def recordFailure(self, url: str, status: Optional[int]):
+        now = time()
+        with self.lock:
+            entry = self.data.setdefault(url, {'firstSeen': now, 'attempts': 0})
+            entry['lastSeen'] = now
+            entry['status'] = status
+            entry['attempts'] += 1
+
+    def recordSuccess(self, url: str):
+        with self.lock:
+            self.data.pop(url, None)
+
+    def forget(self, url: str):
+        self.recordSuccess(url)
+
+    def chronic(self, minAttempts: int = CHRONICATTEMPTS) -> List[Tuple[str, dict]]:
+        """
+        URLs that have failed at least minAttempts times, most failed first
+        """
+        result = [(url, entry) for url, entry in self.data.items() if entry['attempts'] >= minAttempts]
+        return sorted(result, key=lambda i: (-i[1]['attempts'], i[0]))
+
+    def describe(self, url: str) -> str:
+        entry = self.data[url]
+        result = (f"{url} status: {entry['status']} attempts: {entry['attempts']} first: "
+                  f"{formatTime(entry['firstSeen'])} last: {formatTime(entry['lastSeen'])} next try: "
+                  f"{formatTime(self.retryAt(entry))}")
+        return result
+
+
+def formatTime(t: float) -> str:
+    return strftime(NEGATIVETIMEFORMAT, localtime(t))
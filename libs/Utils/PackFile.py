@@ -0,0 +1,112 @@
+"""
+Append-only pack files: lots of small blobs stored in a single data file plus a line-oriented offset index
+"""
+import json
+import logging
+from os import fsync, makedirs, path
+from typing import Dict, Iterator, Optional
+
+PACKEXTENSION = "pack"
+INDEXEXTENSION = "idx"
+
+
+class PackFile:
+    """
+    A pack is a pair of files:
+    * <basename>.pack: blobs one after another, nothing else
+    * <basename>.idx: one JSON line per stored item {'id': ..., 'blobs': {name: [offset, size]}, <extra fields>}
+    Index lines are only written once the blobs are on disk so an interrupted append leaves (at worst) some
+    unreferenced bytes at the end of the pack. If an id is stored twice, the last line wins.
+    """
+
+    def __init__(self, basename: str):
+        self.basename: str = basename
+        self.packFilename: str = f"{basename}.{PACKEXTENSION}"
+        self.indexFilename: str = f"{basename}.{INDEXEXTENSION}"
+        self.index: Dict[str, dict] = dict()
+
+    def __str__(self):
+        result = f"PackFile '{self.basename}' #items: {len(self.index)}"
+        return result
+
+    __repr__ = __str__
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, itemId: str):
+        return itemId in self.index
+
+    def exists(self) -> bool:
+        return path.exists(self.indexFilename)
+
+    def load(self):
+        self.index = dict()
+        if not self.exists():
+            return self
+
+        with open(self.indexFilename, "r") as handin:
+            for lineNum, line in enumerate(handin, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError as exc:
+                    logging.warning(f"{self.indexFilename}:{lineNum}: ignoring damaged index entry. {exc}")
+                    continue
+                self.index[entry['id']] = entry
+
+        return self
+
+    def entry(self, itemId: str) -> Optional[dict]:
+        return self.index.get(itemId)
+
+    def entries(self) -> Iterator[dict]:
+        return iter(self.index.values())
+
+    def append(self, itemId: str, blobs: Dict[str, bytes], extra: Optional[dict] = None) -> dict:
+        """
+        Stores a new version of item
+        :param itemId: identifier of the item inside the pack
+        :param blobs: named chunks of data to store
+        :param extra: additional (JSON serializable) fields to keep in the index
+        :return: the index entry
+        """
+        makedirs(path.dirname(self.packFilename) or '.', mode=0o755, exist_ok=True)
+
+        entry = dict(extra or {})
+        entry['id'] = itemId
+        entry['blobs'] = dict()
+
+        with open(self.packFilename, "ab") as packFile:
+            offset = packFile.seek(0, 2)
+            for name, data in blobs.items():
+                packFile.write(data)
+                entry['blobs'][name] = [offset, len(data)]
+                offset += len(data)
+            packFile.flush()
+            fsync(packFile.fileno())
+
+        with open(self.indexFilename, "a") as indexFile:
+            indexFile.write(json.dumps(entry, sort_keys=True) + "\n")
+
+        self.index[itemId] = entry
+
+        return entry
+
+    def read(self, itemId: str, blobName: str) -> bytes:
+        entry = self.index.get(itemId)
+        if entry is None:
+            raise KeyError(f"{self.basename}: unknown item '{itemId}'")
+        if blobName not in entry['blobs']:
+            raise KeyError(f"{self.basename}: item '{itemId}' has no blob '{blobName}'")
+
+        offset, size = entry['blobs'][blobName]
+        with open(self.packFilename, "rb") as packFile:
+            packFile.seek(offset)
+            result = packFile.read(size)
+
+        if len(result) != size:
+            raise ValueError(f"{self.basename}: item '{itemId}' blob '{blobName}' is truncated ({len(result)}/{size}b)")
+
+        return result
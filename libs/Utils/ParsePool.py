@@ -0,0 +1,60 @@
+"""
+Pool of processes for CPU-bound work (HTML parsing, markdown...) so it doesn't compete for the GIL with the threads
+doing downloads. Functions sent to the pool must be module-level ones that get and return plain data (bytes, str,
+dict...). Without pool (default), they are run in the calling thread. Processes are started with forkserver (or spawn)
+as forking a process with download threads running is not safe. Timings of extraction rules measured in the pool are
+added to those of this process.
+"""
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_all_start_methods, get_context
+from typing import Any, Callable, Optional
+
+from .Extract import addTimings, takeTimings
+
+parseExecutor: Optional[ProcessPoolExecutor] = None
+
+
+def configureParsePool(workers: int):
+    """
+    Creates the pool of processes
+    :param workers: number of processes (0 to do the work in the calling thread)
+    """
+    global parseExecutor
+
+    shutdownParsePool()
+    if workers > 0:
+        logging.debug(f"ParsePool: starting {workers} processes")
+        startMethod = 'forkserver' if 'forkserver' in get_all_start_methods() else 'spawn'
+        parseExecutor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context(startMethod))
+
+
+def shutdownParsePool():
+    global parseExecutor
+
+    if parseExecutor is not None:
+        parseExecutor.shutdown(wait=True)
+        parseExecutor = None
+
+
+def runWithTimings(parser: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Runs parser (in a process of the pool) and returns its result along with the timings of rules it used
+    """
+    result = parser(*args, **kwargs)
+    return result, takeTimings()
+
+
+def runParser(parser: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Runs parser with the arguments in the pool (if there is one) and waits for its result
+    :param parser: module-level function (it must be picklable)
+    :return: whatever parser returns
+    """
+    if parseExecutor is None:
+        return parser(*args, **kwargs)
+
+    result, timings = parseExecutor.submit(runWithTimings, parser, *args, **kwargs).result()
+    addTimings(timings)
+
+    return result
@@ -0,0 +1,79 @@
+"""
+Handle to the media of a page: bytes in memory or a region of a file (i.e. the image saved or its blob in a pack), so
+media doesn't need to stay in memory once it has been saved.
+"""
+import mmap
+from contextlib import contextmanager
+from typing import Iterator, Optional, Union
+
+
+class MediaPayload:
+    __slots__ = ('content', 'filename', 'offset', 'size')
+
+    def __init__(self, content: Optional[Union[bytes, bytearray]] = None, filename: Optional[str] = None,
+                 offset: int = 0, size: Optional[int] = None):
+        if (content is None) == (filename is None):
+            raise ValueError("MediaPayload: either content or filename must be provided")
+        self.content: Optional[Union[bytes, bytearray]] = content
+        self.filename: Optional[str] = filename
+        self.offset: int = offset
+        self.size: int = len(content) if content is not None else size
+
+    def __str__(self):
+        where = "memory" if self.inMemory() else f"'{self.filename}'@{self.offset}"
+        result = f"MediaPayload: {self.size}b in {where}"
+        return result
+
+    __repr__ = __str__
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def fromFile(cls, filename: str, size: int, offset: int = 0):
+        return cls(filename=filename, offset=offset, size=size)
+
+    def inMemory(self) -> bool:
+        return self.content is not None
+
+    def read(self) -> bytes:
+        """
+        Content as bytes. It is a copy unless content is in memory as bytes: use view() when possible
+        """
+        if self.inMemory():
+            return self.content if isinstance(self.content, bytes) else bytes(self.content)
+
+        with open(self.filename, "rb") as handin:
+            handin.seek(self.offset)
+            result = handin.read(self.size)
+        if len(result) != self.size:
+            raise ValueError(f"{self}: file is truncated ({len(result)}/{self.size}b)")
+
+        return result
+
+    @contextmanager
+    def view(self) -> Iterator[memoryview]:
+        """
+        Content without copying it (read only): bytes in memory or the file region mapped. Mapping is closed on exit,
+        so the view must not be used (or kept) beyond the with block
+        """
+        if self.inMemory() or not self.size:
+            view = memoryview(self.content if self.inMemory() else b'').toreadonly()
+            try:
+                yield view
+            finally:
+                view.release()
+            return
+
+        start = self.offset - self.offset % mmap.ALLOCATIONGRANULARITY
+        with open(self.filename, "rb") as handin:
+            mapped = mmap.mmap(handin.fileno(), self.offset + self.size - start, access=mmap.ACCESS_READ,
+                               offset=start)
+        base = memoryview(mapped)
+        view = base[self.offset - start:]
+        try:
+            yield view
+        finally:
+            view.release()
+            base.release()
+            mapped.close()
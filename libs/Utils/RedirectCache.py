@@ -0,0 +1,134 @@
+"""
+Permanent redirects (301, 308) and canonical URLs seen in previous executions. URLs are replaced by their final
+destination before being requested, saving the extra hops.
+"""
+import json
+import logging
+from os import makedirs, path
+from threading import Lock
+from time import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+
+REDIRECTCACHEFILENAME = "redirect.cache"
+REDIRECTMAXAGE = 30 * 86400  # Seconds an entry is trusted since it was last seen
+REDIRECTMAXHOPS = 5
+PERMANENTREDIRECTS = {301, 308}
+
+
+class RedirectCache:
+
+    def __init__(self, filename: Optional[str] = None, enabled: bool = True):
+        self.filename: Optional[str] = filename
+        self.enabled: bool = enabled
+        self.data: Dict[str, dict] = dict()
+        self.applied: int = 0
+        self.lock: Lock = Lock()
+
+    def __str__(self):
+        result = f"RedirectCache: {len(self.data)} URLs ({self.applied} requests redirected) file: '{self.filename}'"
+        return result
+
+    __repr__ = __str__
+
+    def __len__(self):
+        return len(self.data)
+
+    def load(self):
+        if self.filename and path.exists(self.filename):
+            try:
+                with open(self.filename, "r") as handin:
+                    self.data = json.load(handin)
+            except ValueError as exc:
+                logging.warning(f"{self}: unable to read file. Starting from scratch. {exc}")
+                self.data = dict()
+        self.expire()
+        return self
+
+    def store(self):
+        if not self.filename:
+            return
+        makedirs(path.dirname(self.filename) or '.', mode=0o755, exist_ok=True)
+        with self.lock:
+            with open(self.filename, "w") as handout:
+                json.dump(self.data, handout, indent=1, sort_keys=True)
+
+    def expire(self):
+        limit = time() - REDIRECTMAXAGE
+        with self.lock:
+            self.data = {url: entry for url, entry in self.data.items() if entry['lastSeen'] >= limit}
+
+    def resolve(self, url: str) -> str:
+        """
+        Final destination of url according to known redirects (url itself if there is none)
+        """
+        if not self.enabled:
+            return url
+        result = url
+        seen = {url}
+        with self.lock:
+            for _ in range(REDIRECTMAXHOPS):
+                entry = self.data.get(result)
+                if entry is None or entry['target'] in seen:
+                    break
+                result = entry['target']
+                seen.add(result)
+            if result != url:
+                self.applied += 1
+        return result
+
+    def touch(self, url: str):
+        """
+        Marks as seen now the redirects that lead from url to its final destination (they have just worked)
+        """
+        now = time()
+        seen = {url}
+        with self.lock:
+            for _ in range(REDIRECTMAXHOPS):
+                entry = self.data.get(url)
+                if entry is None or entry['target'] in seen:
+                    break
+                entry['lastSeen'] = now
+                url = entry['target']
+                seen.add(url)
+
+    def record(self, url: str, target: str, kind: str):
+        if url == target:
+            return
+        with self.lock:
+            self.data[url] = {'target': target, 'kind': kind, 'lastSeen': time()}
+
+    def recordRedirects(self, response: requests.Response):
+        """
+        Keeps the permanent redirects followed to get response
+        """
+        hops = list(response.history) + [response]
+        for hop, nextHop in zip(hops, hops[1:]):
+            if hop.status_code in PERMANENTREDIRECTS:
+                self.record(hop.url, nextHop.url, 'redirect')
+
+    def recordCanonical(self, url: str, canonical: Optional[str]):
+        """
+        Keeps the canonical URL of a page if it is the same resource (it only changes scheme, www. or trailing slash).
+        Others (i.e. a 'latest comic' page whose canonical URL is the one of the day) are not permanent. Canonical URLs
+        that go from https to http are ignored
+        """
+        if not canonical or (urlparse(url).scheme == 'https' and urlparse(canonical).scheme != 'https'):
+            return
+        if sameResource(url, canonical):
+            self.record(url, canonical, 'canonical')
+
+    def forget(self, url: str):
+        with self.lock:
+            self.data.pop(url, None)
+
+
+def sameResource(url1: str, url2: str) -> bool:
+    def normalize(url: str):
+        parts = urlparse(url)
+        host = parts.netloc.lower()
+        return host[4:] if host.startswith('www.') else host, parts.path.rstrip('/'), parts.query
+
+    return normalize(url1) == normalize(url2)
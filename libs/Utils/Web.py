@@ -1,26 +1,483 @@
+import json
 import logging
 import re
 from argparse import Namespace
-from collections import namedtuple
+from bisect import bisect_left
+from collections import namedtuple, OrderedDict
 from collections.abc import Callable
-from time import time
-from typing import Optional
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from os import makedirs, path
+from random import uniform
+from threading import BoundedSemaphore, Event, Lock
+from time import monotonic, sleep, time
+from typing import Dict, List, Optional, Tuple
 from urllib.parse import (parse_qs, unquote, urlencode, urljoin, urlparse, urlunparse)
 
 import requests
 from mechanicalsoup import StatefulBrowser
 
 from .Misc import getUTC
+from .NegativeCache import KnownFailingURL, NegativeCache
+from .RedirectCache import RedirectCache
 
 logger = logging.getLogger()
 
+DEFAULTHOSTCONCURRENCY = 4
+DEFAULTHOSTINTERVAL: float = 0.0  # Seconds. No minimum time between requests to a host
+DEFAULTCONNECTTIMEOUT = 10  # Seconds
+DEFAULTREADTIMEOUT = 60  # Seconds
+DEFAULTRETRIES = 2
+DEFAULTBACKOFF = 1  # Seconds. Maximum wait before first retry (it doubles with every retry)
+RETRYSTATUSES = {429, 500, 502, 503, 504}
+
+LATENCYSTATSFILENAME = "latency.stats"
+LATENCYBUCKETS = tuple(round(0.025 * 1.5 ** i, 3) for i in range(24))  # Upper limits (seconds). Last one is ~4.6 min
+LATENCYMAXSAMPLES = 2000  # Counts of a host are halved when they reach this, so old samples fade away
+HEDGEMINSAMPLES = 20  # Samples of a host needed to hedge its requests
+HEDGEPERCENTILE = 0.95
+HEDGEWORKERS = 8
+MEMOMAXSIZE = 32 * 1024 * 1024  # Bytes of answers kept in memo. Least recently used ones are dropped beyond that
+
+CANONICALSEARCHSIZE = 64 * 1024  # Canonical URL is expected in the head of page
+CANONICALLINKRE = re.compile(rb'<link\s[^>]*rel=["\']canonical["\'][^>]*href=["\'](?P<url>[^"\']+)', re.IGNORECASE)
+OGURLRE = re.compile(rb'<meta\s[^>]*property=["\']og:url["\'][^>]*content=["\'](?P<url>[^"\']+)', re.IGNORECASE)
+
+MEDIACHUNKSIZE = 16 * 1024  # Interrupted transfers resume from the last complete chunk
+PROBEFALLBACKSTATUSES = {403, 405, 501}  # Answers of sites that don't like HEAD requests
+
 DownloadedPage = namedtuple('DownloadedPage',
                             field_names=['source', 'data', 'timestamp', 'home', 'browser', 'config', 'extra'],
                             defaults={'home': None, 'browser': None, 'config': None, 'extra': None})
+MediaProbe = namedtuple('MediaProbe', field_names=['source', 'size', 'etag'])
+FetchedMedia = namedtuple('FetchedMedia', field_names=['url', 'content', 'headers', 'history'])
+
+
+class HostThrottle:
+    """
+    Limits the requests to each host: no more than maxConcurrent at the same time and (optionally) a minimum time
+    between the start of two of them. Shared by all the threads of the process.
+    """
+
+    def __init__(self, maxConcurrent: int = DEFAULTHOSTCONCURRENCY, minInterval: float = DEFAULTHOSTINTERVAL):
+        self.maxConcurrent: int = max(1, maxConcurrent)
+        self.minInterval: float = minInterval
+        self.lock: Lock = Lock()
+        self.semaphores: Dict[str, BoundedSemaphore] = dict()
+        self.nextStart: Dict[str, float] = dict()
+
+    def configure(self, maxConcurrent: int, minInterval: float):
+        with self.lock:
+            self.maxConcurrent = max(1, maxConcurrent)
+            self.minInterval = minInterval
+            self.semaphores = dict()
+
+    @contextmanager
+    def slot(self, url: str):
+        host = urlparse(url).netloc
+        with self.lock:
+            semaphore = self.semaphores.setdefault(host, BoundedSemaphore(self.maxConcurrent))
+
+        with semaphore:
+            with self.lock:
+                now = monotonic()
+                start = max(now, self.nextStart.get(host, now))
+                self.nextStart[host] = start + self.minInterval
+            if start > now:
+                sleep(start - now)
+            yield
+
+
+class RunDeadlineExceeded(Exception):
+    """Execution has run out of time. No more requests are done"""
+    pass
+
+
+class RequestPolicy:
+    """
+    Timeouts and retries for requests plus the deadline for the whole execution (if any)
+    """
+
+    def __init__(self, connectTimeout: float = DEFAULTCONNECTTIMEOUT, readTimeout: float = DEFAULTREADTIMEOUT,
+                 retries: int = DEFAULTRETRIES, backoff: float = DEFAULTBACKOFF, hedge: bool = False
+                 ):
+        self.connectTimeout: float = connectTimeout
+        self.readTimeout: float = readTimeout
+        self.retries: int = retries
+        self.backoff: float = backoff
+        self.hedge: bool = hedge
+        self.deadline: Optional[float] = None
+
+    def configure(self, connectTimeout: float, readTimeout: float, retries: int, hedge: bool = False):
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.retries = max(0, retries)
+        self.hedge = hedge
+
+    def setDeadline(self, seconds: Optional[float]):
+        self.deadline = (monotonic() + seconds) if seconds else None
+
+    def remaining(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return self.deadline - monotonic()
+
+    def deadlineExceeded(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def checkDeadline(self):
+        if self.deadlineExceeded():
+            raise RunDeadlineExceeded("Run deadline exceeded")
+
+    def timeout(self) -> Tuple[float, float]:
+        remaining = self.remaining()
+        if remaining is None:
+            return self.connectTimeout, self.readTimeout
+        return min(self.connectTimeout, remaining), min(self.readTimeout, remaining)
+
+    def retrying(self, url: str, request: Callable[[Tuple[float, float]], requests.Response]) -> requests.Response:
+        """
+        Does a (idempotent) request retrying on timeouts, connection problems and temporary errors of server. Waits
+        between attempts are random and grow exponentially (but never go beyond deadline)
+        :param url: URL requested (for logs)
+        :param request: function that does the request with the timeout it gets and returns the response (it must
+        raise HTTPError if status is not OK)
+        :return: response
+        """
+        attempt = 0
+        while True:
+            self.checkDeadline()
+            delay = 0.0
+            try:
+                return request(self.timeout())
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                error = exc
+            except requests.HTTPError as exc:
+                if exc.response is None or exc.response.status_code not in RETRYSTATUSES:
+                    raise
+                error = exc
+                retryAfter = exc.response.headers.get('Retry-After', '')
+                if retryAfter.isdigit():
+                    delay = float(retryAfter)
+
+            if attempt >= self.retries:
+                raise error
+            delay = max(delay, uniform(0, self.backoff * 2 ** attempt))
+            remaining = self.remaining()
+            if remaining is not None and delay >= remaining:
+                raise RunDeadlineExceeded(f"Run deadline exceeded retrying {url}") from error
+            attempt += 1
+            logger.debug("Request: %s failed (%s). Retry %d/%d in %.2fs", url, error, attempt, self.retries, delay)
+            sleep(delay)
+
+
+class LatencyStats:
+    """
+    Histogram (per host) of the time it takes to get the headers of an answer. Kept between executions
+    """
+
+    def __init__(self, filename: Optional[str] = None):
+        self.filename: Optional[str] = filename
+        self.data: Dict[str, List[int]] = dict()
+        self.lock: Lock = Lock()
+
+    def load(self):
+        if self.filename and path.exists(self.filename):
+            try:
+                with open(self.filename, "r") as handin:
+                    self.data = {host: counts for host, counts in json.load(handin).items() if
+                                 len(counts) == len(LATENCYBUCKETS)}
+            except ValueError as exc:
+                logger.warning("LatencyStats: unable to read %s. Starting from scratch. %s", self.filename, exc)
+        return self
+
+    def store(self):
+        if not self.filename:
+            return
+        makedirs(path.dirname(self.filename) or '.', mode=0o755, exist_ok=True)
+        with self.lock:
+            with open(self.filename, "w") as handout:
+                json.dump(self.data, handout)
+
+    def record(self, host: str, seconds: float):
+        bucket = min(bisect_left(LATENCYBUCKETS, seconds), len(LATENCYBUCKETS) - 1)
+        with self.lock:
+            counts = self.data.setdefault(host, [0] * len(LATENCYBUCKETS))
+            counts[bucket] += 1
+            if sum(counts) >= LATENCYMAXSAMPLES:
+                self.data[host] = [c // 2 for c in counts]
+
+    def percentile(self, host: str, q: float) -> Optional[float]:
+        """
+        Upper limit of the bucket where percentile q falls (None if there are not enough samples of host)
+        """
+        with self.lock:
+            counts = list(self.data.get(host, []))
+        total = sum(counts)
+        if total < HEDGEMINSAMPLES:
+            return None
+        accumulated = 0
+        for limit, count in zip(LATENCYBUCKETS, counts):
+            accumulated += count
+            if accumulated >= q * total:
+                return limit
+        return LATENCYBUCKETS[-1]
+
+
+class RequestMemo:
+    """
+    Answers to the GET requests of pages of the execution, so every URL is requested (at most) once per run while it
+    is in memo (those least recently used are dropped once answers go beyond maxSize bytes). Media is never kept.
+    Counts the requests actually sent and those answered from memory
+    """
+
+    def __init__(self, enabled: bool = True, maxSize: int = MEMOMAXSIZE):
+        self.enabled: bool = enabled
+        self.maxSize: int = maxSize
+        self.responses: OrderedDict[str, requests.Response] = OrderedDict()
+        self.sizes: Dict[str, int] = dict()
+        self.size: int = 0
+        self.inFlight: Dict[str, Event] = dict()
+        self.sent: int = 0
+        self.hits: int = 0
+        self.lock: Lock = Lock()
+
+    def __str__(self):
+        result = (f"RequestMemo: {len(self.responses)} URLs ({self.size}b). Requests sent: {self.sent} answered from "
+                  f"memo: {self.hits}")
+        return result
+
+    __repr__ = __str__
+
+    def counters(self) -> Tuple[int, int]:
+        """
+        :return: (requests sent, requests answered from memo) so far
+        """
+        with self.lock:
+            return self.sent, self.hits
+
+    def countRequest(self):
+        with self.lock:
+            self.sent += 1
+
+    def keep(self, url: str, response: requests.Response):
+        """
+        Adds an answer (lock must be held). Least recently used ones are dropped if memo goes beyond its size
+        """
+        if url in self.responses:
+            return
+        self.responses[url] = response
+        self.sizes[url] = len(response.content or b'')
+        self.size += self.sizes[url]
+        while self.size > self.maxSize and len(self.responses) > 1:
+            oldURL, _ = self.responses.popitem(last=False)
+            self.size -= self.sizes.pop(oldURL)
+
+    def get(self, url: str, request: Callable[[], requests.Response]) -> requests.Response:
+        """
+        Returns the answer for url, doing the request only if it has not been done before. Simultaneous requests for
+        the same URL wait for the first one. Failures are not kept
+        :param url: URL requested
+        :param request: function that does the request
+        :return: response
+        """
+        if not self.enabled:
+            return request()
+
+        while True:
+            with self.lock:
+                if url in self.responses:
+                    self.hits += 1
+                    self.responses.move_to_end(url)
+                    return self.responses[url]
+                pending = self.inFlight.get(url)
+                if pending is None:
+                    pending = self.inFlight[url] = Event()
+                    break
+            pending.wait()
+
+        try:
+            response = request()
+            with self.lock:
+                self.keep(url, response)
+                self.keep(response.url, response)
+            return response
+        finally:
+            with self.lock:
+                self.inFlight.pop(url, None)
+            pending.set()
+
+
+hostThrottle = HostThrottle()
+requestPolicy = RequestPolicy()
+latencyStats = LatencyStats()
+requestMemo = RequestMemo()
+negativeCache = NegativeCache()
+redirectCache = RedirectCache()
+hedgeExecutor: Optional[ThreadPoolExecutor] = None
+
+
+def timedGet(host: str, get: Callable[[], requests.Response]) -> requests.Response:
+    timeIn = monotonic()
+    response = get()
+    latencyStats.record(host, monotonic() - timeIn)
+    return response
+
+
+def discardResponse(future: Future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def hedgedGet(url: str, get: Callable[[], requests.Response]) -> requests.Response:
+    """
+    Does a GET (get must use stream=True so it returns as soon as headers are there). If hedging is enabled and there
+    is no answer by the time 95% of the requests to the host had it, a second request is done. First one to answer
+    wins (the other one is discarded)
+    :param url: URL requested
+    :param get: function that does the request
+    :return: response
+    """
+    global hedgeExecutor
+
+    host = urlparse(url).netloc
+    delay = latencyStats.percentile(host, HEDGEPERCENTILE) if requestPolicy.hedge else None
+    if delay is None:
+        return timedGet(host, get)
+
+    if hedgeExecutor is None:
+        hedgeExecutor = ThreadPoolExecutor(max_workers=HEDGEWORKERS, thread_name_prefix="hedge")
+    first = hedgeExecutor.submit(timedGet, host, get)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+
+    logger.debug("hedgedGet: no answer from %s in %.3fs. Hedging", url, delay)
+    pending = {first, hedgeExecutor.submit(timedGet, host, get)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        winners = [f for f in done if f.exception() is None]
+        if winners:
+            for future in pending.union(done).difference(winners[:1]):
+                future.add_done_callback(discardResponse)
+            return winners[0].result()
+        error = next(iter(done)).exception()
+
+    raise error
+
+
+def configureHostThrottle(maxConcurrent: int, minInterval: float):
+    """
+    Sets the limits for requests to the same host
+    :param maxConcurrent: maximum number of simultaneous requests to a host
+    :param minInterval: minimum time (in seconds) between the start of two requests to a host
+    """
+    hostThrottle.configure(maxConcurrent, minInterval)
+
+
+def configureRequests(connectTimeout: float, readTimeout: float, retries: int, hedge: bool = False,
+                      latencyFile: Optional[str] = None
+                      ):
+    """
+    Sets timeouts (in seconds), number of retries and hedging for requests
+    :param latencyFile: file to keep the latencies of hosts between executions (used for hedging)
+    """
+    requestPolicy.configure(connectTimeout, readTimeout, retries, hedge)
+    latencyStats.filename = latencyFile
+    latencyStats.load()
+
+
+def setRunDeadline(seconds: Optional[float]):
+    """
+    Sets the maximum time (from now) for requests. Once it is over requests raise RunDeadlineExceeded
+    :param seconds: time available (0 or None for no deadline)
+    """
+    requestPolicy.setDeadline(seconds)
+
+
+def deadlineExceeded() -> bool:
+    return requestPolicy.deadlineExceeded()
+
+
+def configureNegativeCache(filename: Optional[str], enabled: bool = True):
+    """
+    Sets the file where failing URLs are kept between executions (and loads it)
+    :param filename: location of file (None to keep it only in memory)
+    :param enabled: if False, failures are recorded but URLs are requested anyway
+    """
+    negativeCache.filename = filename
+    negativeCache.enabled = enabled
+    negativeCache.load()
+
+
+def configureRedirectCache(filename: Optional[str], enabled: bool = True):
+    """
+    Sets the file where permanent redirects and canonical URLs are kept between executions (and loads it)
+    :param filename: location of file (None to keep it only in memory)
+    :param enabled: if False, redirects are recorded but not applied
+    """
+    redirectCache.filename = filename
+    redirectCache.enabled = enabled
+    redirectCache.load()
+
+
+def resolvedRequest(url: str, request: Callable[[str], requests.Response]) -> requests.Response:
+    """
+    Requests the final destination of url if it is known (permanent redirect or canonical URL seen before). If that
+    one fails, the redirect is forgotten and url is requested. Redirects that work are kept as seen now
+    :param url: URL wanted
+    :param request: function that does the request of a URL
+    :return: response
+    """
+    target = redirectCache.resolve(url)
+    if target == url:
+        response = request(url)
+    else:
+        logger.debug("resolvedRequest: %s -> %s (known redirect)", url, target)
+        try:
+            response = request(target)
+            redirectCache.touch(url)
+        except requests.RequestException as exc:
+            logger.debug("resolvedRequest: %s failed (%s). Requesting %s", target, exc, url)
+            redirectCache.forget(url)
+            response = request(url)
+    redirectCache.recordRedirects(response)
+
+    return response
+
+
+def configureRequestMemo(enabled: bool = True):
+    """
+    Sets whether answers are kept for the whole execution (so every URL is requested once)
+    """
+    requestMemo.enabled = enabled
+
+
+@contextmanager
+def trackFailures(url: str):
+    """
+    Refuses to request URLs that failed recently (raising KnownFailingURL, a HTTPError) and records the result of
+    the request otherwise
+    """
+    entry = negativeCache.check(url)
+    if entry is not None:
+        raise KnownFailingURL(f"{url}: known failing URL (status: {entry['status']}, attempts: {entry['attempts']}). "
+                              f"Skipped")
+    try:
+        yield
+    except requests.HTTPError as exc:
+        negativeCache.recordFailure(url, exc.response.status_code if exc.response is not None else None)
+        raise
+    except requests.RequestException:
+        negativeCache.recordFailure(url, None)
+        raise
+    negativeCache.recordSuccess(url)
 
 
 def DownloadPage(dest, home=None, browser: Optional[StatefulBrowser] = None, config=Namespace(),
-                 sanitizer: Optional[Callable[[bytes], bytes]] = None
+                 sanitizer: Optional[Callable[[bytes], bytes]] = None, parse: bool = True
                  ) -> DownloadedPage:
     """
     Descarga el contenido de una pagina y lo devuelve con metadatos
@@ -29,30 +486,43 @@ def DownloadPage(dest, home=None, browser: Optional[StatefulBrowser] = None, con
     :param browser: Stateful Browser Object
     :param config: Namespace de configuración (de argparse) para manipular ciertas características del browser
     :param sanitizer: Function that processes the incoming data (useful for HTML legacy whose format is like it is)
+    :param parse: if False, data is the (sanitized) content as is, to be parsed elsewhere (i.e. ParsePool)
     :return: Diccionario con página bajada y metadatos varios
     """
     timeIn = time()
     if browser is None:
         browser = creaBrowser(config)
 
-    if home:
-        browser.open(home)
-        target = MergeURL(home, dest)
-        logger.debug("DownloadPage: home %s link  %s", home, target)
-        response = browser.open(target)
-    else:
-        target = dest
-        logger.debug("DownloadPage: no home %s", target)
-        response = browser.open(target)
+    # home is only needed to resolve relative links. It is not requested
+    target = MergeURL(home, dest) if home else dest
+    logger.debug("DownloadPage: home %s link  %s", home, target)
+
+    def getTarget(url: str, timeout: Tuple[float, float]) -> requests.Response:
+        with hostThrottle.slot(url):
+            requestMemo.countRequest()
+            return browser.session.get(url, timeout=timeout, stream=True)
+
+    def doRequest(url: str, timeout: Tuple[float, float]) -> requests.Response:
+        response = hedgedGet(url, lambda: getTarget(url, timeout))
+        response.raise_for_status()
+        _ = response.content  # Body is read here so problems with it are retried too
+        return response
 
-    response.raise_for_status()
+    def request(url: str) -> requests.Response:
+        with trackFailures(url):
+            return requestPolicy.retrying(url, lambda timeout: doRequest(url, timeout))
 
-    if sanitizer:
-        ammended = sanitizer(response.text)
-        browser.open_fake_page(ammended, target)
+    response = resolvedRequest(target, lambda url: requestMemo.get(url, lambda: request(url)))
 
-    source = browser.get_url()
-    content = browser.get_current_page()
+    if parse:
+        browser.open_fake_page(sanitizer(response.text) if sanitizer else response.content, url=response.url)
+        source = browser.get_url()
+        content = browser.get_current_page()
+        redirectCache.recordCanonical(source, findCanonicalURL(content, source))
+    else:
+        source = response.url
+        content = sanitizer(response.content) if sanitizer else response.content
+        redirectCache.recordCanonical(source, findCanonicalURLRaw(content, source))
     timeOut = time()
     timeDL = timeOut - timeIn
 
@@ -75,8 +545,28 @@ def DownloadRawPage(dest, here=None, sanitizer: Optional[Callable[[bytes], bytes
 
     destURL = MergeURL(here, dest)
 
-    response = requests.get(destURL, *args, **kwargs)
-    response.raise_for_status()
+    callerTimeout = kwargs.pop('timeout', None)
+
+    def getTarget(url: str, timeout: Tuple[float, float]) -> requests.Response:
+        with hostThrottle.slot(url):
+            requestMemo.countRequest()
+            return requests.get(url, *args, timeout=callerTimeout or timeout, stream=True, **kwargs)
+
+    def doRequest(url: str, timeout: Tuple[float, float]) -> requests.Response:
+        response = hedgedGet(url, lambda: getTarget(url, timeout))
+        response.raise_for_status()
+        _ = response.content  # Body is read here so problems with it are retried too
+        return response
+
+    def request(url: str) -> requests.Response:
+        with trackFailures(url):
+            return requestPolicy.retrying(url, lambda timeout: doRequest(url, timeout))
+
+    # Conditional requests (headers) depend on what the caller has. They can't be answered from memo
+    if 'headers' in kwargs:
+        response = resolvedRequest(destURL, request)
+    else:
+        response = resolvedRequest(destURL, lambda url: requestMemo.get(url, lambda: request(url)))
 
     timeOut = time()
     timeDL = timeOut - timeIn
@@ -89,6 +579,147 @@ def DownloadRawPage(dest, here=None, sanitizer: Optional[Callable[[bytes], bytes
     return result
 
 
+def DownloadMedia(dest, here=None) -> DownloadedPage:
+    """
+    Downloads media (images...). If the transfer is interrupted, the retry asks only for what is missing (Range) when
+    the site supports it and the file is the same (If-Range). Partial answers that don't continue what was received
+    are discarded
+    :param dest: URL of media, absolute or relative.
+    :param here: Base URL for relative dest
+    :return: DownloadedPage with the bytes of media (a bytearray, to be used read-only) as data (headers of answer in
+    extra)
+    """
+    timeIn = time()
+
+    destURL = MergeURL(here, dest)
+    fileValidators: Dict[str, Optional[str]] = dict()  # ETag (or Last-Modified) of what has been received so far
+
+    def doRequest(url: str, received: bytearray, timeout: Tuple[float, float]) -> FetchedMedia:
+        headers = dict()
+        validator = received and fileValidators.get(url)
+        if validator:
+            headers = {'Range': f"bytes={len(received)}-", 'If-Range': validator}
+            logger.debug("DownloadMedia: resuming %s from byte %d", url, len(received))
+        with hostThrottle.slot(url):
+            requestMemo.countRequest()
+            response = requests.get(url, timeout=timeout, headers=headers, stream=True, allow_redirects=True)
+        with response:
+            response.raise_for_status()
+            start = None
+            if response.status_code == 206:
+                match = re.match(r'bytes (\d+)-\d+/', response.headers.get('Content-Range', ''))
+                start = int(match.group(1)) if match else None
+            if start != len(received):
+                received.clear()
+                if response.status_code == 206 and start != 0:  # Not what was asked for. Next try gets everything
+                    raise requests.ConnectionError(f"Unexpected range from {url}: "
+                                                   f"{response.headers.get('Content-Range')}")
+            etag = response.headers.get('ETag', '')
+            fileValidators[url] = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified')
+            try:
+                for chunk in response.iter_content(MEDIACHUNKSIZE):
+                    received.extend(chunk)
+            except requests.exceptions.ChunkedEncodingError as exc:
+                raise requests.ConnectionError(f"Transfer of {url} interrupted after {len(received)} bytes") from exc
+
+        # Buffer is handed as it is (no copy). Nothing writes to it once the transfer is over
+        return FetchedMedia(url=response.url, content=received, headers=response.headers, history=response.history)
+
+    def request(url: str) -> FetchedMedia:
+        received = bytearray()
+        with trackFailures(url):
+            return requestPolicy.retrying(url, lambda timeout: doRequest(url, received, timeout))
+
+    # Media is not kept in memo: it would keep every image in memory for the whole execution
+    media = resolvedRequest(destURL, request)
+
+    timeDL = time() - timeIn
+    logger.debug("DownloadMedia: downloaded %s (%d bytes, %f)", destURL, len(media.content), timeDL)
+
+    return DownloadedPage(source=media.url, data=media.content, timestamp=getUTC(), home=here, extra=media.headers)
+
+
+def ProbeMedia(dest, here=None) -> Optional[MediaProbe]:
+    """
+    Gets size and ETag of media without downloading it: HEAD request or, for sites that don't accept them, a request
+    for its first byte (Range)
+    :param dest: URL of media, absolute or relative.
+    :param here: Base URL for relative dest
+    :return: MediaProbe (size and etag may be None) or None if site tells none of them
+    """
+    destURL = redirectCache.resolve(MergeURL(here, dest))
+
+    def doRequest(timeout: Tuple[float, float]) -> requests.Response:
+        with hostThrottle.slot(destURL):
+            requestMemo.countRequest()
+            response = requests.head(destURL, timeout=timeout, allow_redirects=True)
+            if response.status_code in PROBEFALLBACKSTATUSES:
+                requestMemo.countRequest()
+                response = requests.get(destURL, timeout=timeout, headers={'Range': 'bytes=0-0'}, stream=True,
+                                        allow_redirects=True)
+                response.close()
+        response.raise_for_status()
+        return response
+
+    with trackFailures(destURL):
+        response = requestPolicy.retrying(destURL, doRequest)
+    redirectCache.recordRedirects(response)
+
+    size = None
+    if response.status_code == 206:
+        match = re.match(r'bytes \d+-\d+/(\d+)', response.headers.get('Content-Range', ''))
+        size = int(match.group(1)) if match else None
+    elif response.headers.get('Content-Length', '').isdigit() and 'Content-Encoding' not in response.headers:
+        size = int(response.headers['Content-Length'])
+    etag = response.headers.get('ETag')
+
+    if size is None and etag is None:
+        return None
+
+    return MediaProbe(source=response.url, size=size, etag=etag)
+
+
+def DownloadJSON(dest, here=None, *args, **kwargs) -> DownloadedPage:
+    """
+    Downloads a JSON document (APIs) and returns it decoded
+    :param dest: URL, absolute or relative.
+    :param here: Base URL for relative dest
+    :return: DownloadedPage with decoded document as data
+    """
+    rawPage = DownloadRawPage(dest, here, None, *args, **kwargs)
+    result = rawPage._replace(data=json.loads(rawPage.data))
+
+    return result
+
+
+def DownloadConditional(dest, validators: dict, here=None, *args, **kwargs) -> Optional[DownloadedPage]:
+    """
+    Downloads a resource only if it has changed since last time (according to ETag/Last-Modified of previous download)
+    :param dest: URL, absolute or relative.
+    :param validators: dict with data from previous download (it is updated with data of the new one)
+    :param here: Base URL for relative dest
+    :return: DownloadedPage or None if resource hasn't changed
+    """
+    headers = dict(kwargs.pop('headers', None) or {})
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('lastModified'):
+        headers['If-Modified-Since'] = validators['lastModified']
+
+    result = DownloadRawPage(dest, here, None, *args, headers=headers, **kwargs)
+    if result.extra.status_code == 304:
+        logger.debug("DownloadConditional: %s not modified", dest)
+        return None
+
+    for header, label in [('ETag', 'etag'), ('Last-Modified', 'lastModified')]:
+        if header in result.extra.headers:
+            validators[label] = result.extra.headers[header]
+        else:
+            validators.pop(label, None)
+
+    return result
+
+
 def ExtraeGetParams(url):
     """
        Devuelve un diccionario con los parámetros pasados en la URL
@@ -163,6 +794,31 @@ def getObjID(objURL, clave='id', defaultresult=sentinel):
     return defaultresult
 
 
+def findCanonicalURL(webContent, here: str) -> Optional[str]:
+    """
+    Canonical URL of a page (from <link rel="canonical"> or og:url meta)
+    """
+    if webContent is None:
+        return None
+    linkTag = webContent.find('link', attrs={'rel': 'canonical'}, href=True)
+    if linkTag is not None:
+        return urljoin(here, linkTag['href'])
+    metaTag = webContent.find('meta', attrs={'property': 'og:url'}, content=True)
+    if metaTag is not None:
+        return urljoin(here, metaTag['content'])
+    return None
+
+
+def findCanonicalURLRaw(content: bytes, here: str) -> Optional[str]:
+    """
+    Canonical URL of a page without parsing it (it must be in the head of page)
+    """
+    match = CANONICALLINKRE.search(content, 0, CANONICALSEARCHSIZE) or OGURLRE.search(content, 0, CANONICALSEARCHSIZE)
+    if match is None:
+        return None
+    return urljoin(here, match.group('url').decode('utf-8', errors='replace'))
+
+
 def findObjectsWithAttributes(webContent, targetTag, targetInfo):
     result = dict()
     for k, fname, fvalue in targetInfo:
@@ -0,0 +1,195 @@
+import logging
+import os
+import resource
+import struct
+import sys
+import tracemalloc
+from email.mime.image import MIMEImage
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+from threading import Thread
+from typing import Dict, List, Optional
+
+from configargparse import ArgParser
+
+logger = logging.getLogger()
+
+DEFAULTITEMS = 20
+DEFAULTMEDIASIZE = 1024 * 1024
+PNGHEADER = b'\x89PNG\r\n\x1a\n' + struct.pack('>I4sIIBBBBBI', 13, b'IHDR', 640, 480, 8, 2, 0, 0, 0, 0)
+MODES = ['legacy', 'current']
+
+
+def parse_arguments():
+    from libs.Utils.Logging import prepareLogger
+
+    descriptionTXT = ("Measures memory used to handle media (download, hash, type, save and attach to a mail) with "
+                      "the way it used to be done (copies of whole media at every step) and the current one (single "
+                      "buffer, memoryviews, stored file mapped for mail). Each mode runs in a process of its own")
+
+    parser = ArgParser(description=descriptionTXT)
+
+    parser.add_argument('-v', dest='verbose', action="count", env_var='CS_VERBOSE', required=False,
+                        help='Verbose mode (info)', default=0)
+    parser.add_argument('-d', dest='debug', action="store_true", env_var='CS_DEBUG', required=False,
+                        help='Debug mode (debug)', default=False)
+    parser.add_argument('-n', '--items', dest='items', type=int, required=False,
+                        help=f"Number of media files to process (default: {DEFAULTITEMS})", default=DEFAULTITEMS)
+    parser.add_argument('-s', '--size', dest='size', type=int, required=False,
+                        help=f"Size (bytes) of media served locally (default: {DEFAULTMEDIASIZE})",
+                        default=DEFAULTMEDIASIZE)
+    parser.add_argument('--url', dest='url', type=str, required=False,
+                        help="Use this media URL instead of the local server", default=None)
+
+    args = parser.parse_args()
+
+    logLevel = logging.WARNING
+    if args.verbose:
+        logLevel = logging.INFO
+    elif args.debug:
+        logLevel = logging.DEBUG
+
+    prepareLogger(logger=logger, level=logLevel)
+
+    return args
+
+
+def startMediaServer(size: int) -> ThreadingHTTPServer:
+    """
+    Local HTTP server that answers any path with the same (PNG looking) content
+    """
+    content = PNGHEADER + os.urandom(max(0, size - len(PNGHEADER)))
+    etag = f'"{sha256(content).hexdigest()[:16]}"'
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(content)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def processLegacy(url: str, folder: str, seq: int):
+    """
+    Steps as they were done: media copied to bytes at every stage, whole media given to libmagic, mail built from a
+    copy read from disk and serialized to str before being encoded
+    """
+    import magic
+
+    from libs.Utils.Files import shaData
+    from libs.Utils.Web import DownloadMedia
+
+    img = DownloadMedia(url)
+    data = bytes(img.data)
+    shaData(data)
+    magic.detect_from_content(data)
+    filename = os.path.join(folder, f"legacy{seq}.png")
+    with open(filename, "wb") as handout:
+        handout.write(data)
+    del data, img
+    with open(filename, "rb") as handin:
+        stored = handin.read()
+    part = MIMEImage(stored, _subtype='png')
+    part.as_string().encode('ascii')
+
+
+def processCurrent(url: str, folder: str, seq: int):
+    """
+    Steps as ComicPage does them now
+    """
+    from libs.Cosecha.ComicPage import encodeViewBase64
+    from libs.Utils.Files import mimeTypeFromData, shaData
+    from libs.Utils.Payload import MediaPayload
+    from libs.Utils.Web import DownloadMedia
+
+    img = DownloadMedia(url)
+    payload = MediaPayload(content=img.data)
+    with payload.view() as media:
+        shaData(media)
+        mimeTypeFromData(media)
+    filename = os.path.join(folder, f"current{seq}.png")
+    with open(filename, "wb") as handout, payload.view() as media:
+        handout.write(media)
+    payload = MediaPayload.fromFile(filename, size=payload.size)
+    del img
+    with payload.view() as media:
+        part = MIMEImage(media, _subtype='png', _encoder=encodeViewBase64)
+    part.as_bytes()
+
+
+def runMode(mode: str, url: str, items: int, results: Dict[str, dict]):
+    from libs.Utils.Web import configureRequestMemo
+
+    configureRequestMemo(enabled=False)
+    processor = processLegacy if mode == 'legacy' else processCurrent
+    peaks: List[int] = []
+    with TemporaryDirectory() as folder:
+        tracemalloc.start()
+        for seq in range(items):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            processor(url if '?' in url else f"{url}?item={seq}", folder, seq)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+    results[mode] = {'peak': max(peaks), 'avgPeak': sum(peaks) / len(peaks),
+                     'maxRSS': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+
+def main(args):
+    server: Optional[ThreadingHTTPServer] = None
+    url = args.url
+    size = args.size
+    if url is None:
+        server = startMediaServer(args.size)
+        url = f"http://127.0.0.1:{server.server_address[1]}/media.png"
+    else:
+        from libs.Utils.Web import DownloadMedia
+        size = len(DownloadMedia(url).data)
+
+    items = max(1, args.items)
+    context = get_context('spawn')
+    with context.Manager() as manager:
+        results = manager.dict()
+        for mode in MODES:
+            child = context.Process(target=runMode, args=(mode, url, items, results))
+            child.start()
+            child.join()
+        results = dict(results)
+
+    if server is not None:
+        server.shutdown()
+
+    print(f"BENCHMARK: {items} media of {size}b ({url})")
+    for mode in MODES:
+        if mode not in results:
+            print(f"  {mode:8}: failed")
+            continue
+        data = results[mode]
+        print(f"  {mode:8}: heap peak per item: {data['avgPeak'] / 1024:10.1f}KB avg {data['peak'] / 1024:10.1f}KB max "
+              f"({data['avgPeak'] / size:4.1f}x media) process max RSS: {data['maxRSS'] / 1024 / 1024:7.1f}MB")
+
+
+if __name__ == '__main__':
+
+    auxLocation = os.path.abspath(__file__)
+    base = os.path.dirname(auxLocation)
+
+    src = os.path.dirname(base)
+
+    if src not in sys.path:
+        sys.path.insert(0, src)
+
+    args = parse_arguments()
+    main(args)
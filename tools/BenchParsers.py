@@ -0,0 +1,112 @@
+import inspect
+import logging
+import os
+import sys
+from time import perf_counter
+from typing import Callable
+
+from configargparse import ArgParser
+
+logger = logging.getLogger()
+
+DEFAULTREPETITIONS = 20
+
+
+def parse_arguments():
+    from libs.Utils.Logging import prepareLogger
+
+    descriptionTXT = ("Measures the time plugins take to extract data from pages (saved previously) and the time spent "
+                      "on every extraction rule")
+
+    parser = ArgParser(description=descriptionTXT)
+
+    parser.add_argument('-v', dest='verbose', action="count", env_var='CS_VERBOSE', required=False,
+                        help='Verbose mode (info)', default=0)
+    parser.add_argument('-d', dest='debug', action="store_true", env_var='CS_DEBUG', required=False,
+                        help='Debug mode (debug)', default=False)
+    parser.add_argument('-p', '--plugin', dest='plugin', type=str, required=True,
+                        help="Plugin (module of libs/Cosecha/Sites) that parses pages")
+    parser.add_argument('-n', '--repetitions', dest='repetitions', type=int, required=False,
+                        help=f"Times every page is parsed (default: {DEFAULTREPETITIONS})", default=DEFAULTREPETITIONS)
+    parser.add_argument('--url', dest='url', type=str, required=False,
+                        help="URL of pages (for plugins that need it to resolve links)", default=None)
+    parser.add_argument('--baseline', dest='baseline', action="store_true", required=False,
+                        help="Measure also the time BeautifulSoup takes to build the tree of page", default=False)
+    parser.add_argument('files', nargs='+', help="Pages to parse")
+
+    args = parser.parse_args()
+
+    logLevel = logging.WARNING
+    if args.verbose:
+        logLevel = logging.INFO
+    elif args.debug:
+        logLevel = logging.DEBUG
+
+    prepareLogger(logger=logger, level=logLevel)
+
+    return args
+
+
+def timeIt(function: Callable, repetitions: int) -> float:
+    """
+    Average time (in seconds) of function
+    """
+    timeIn = perf_counter()
+    for _ in range(repetitions):
+        function()
+    return (perf_counter() - timeIn) / repetitions
+
+
+def main(args):
+    import bs4
+
+    from libs.Utils.Extract import RuleSet
+    from libs.Utils.Python import LoadModule
+
+    _, module = LoadModule(moduleName=args.plugin, classLocation="libs.Cosecha.Sites")
+    if not hasattr(module, 'parsePage'):
+        print(f"Plugin '{args.plugin}' has no parsePage function")
+        return
+    extraArgs = {'url': args.url or module.URLBASE} if 'url' in inspect.signature(module.parsePage).parameters else {}
+    sanitizer = getattr(module, 'sanitizer', None)
+    ruleSets = {name: obj for name, obj in vars(module).items() if isinstance(obj, RuleSet)}
+    for ruleSet in ruleSets.values():
+        ruleSet.resetTimings()
+    repetitions = max(1, args.repetitions)
+
+    print(f"BENCHMARK: plugin '{args.plugin}' {len(args.files)} pages x {repetitions} repetitions")
+    for filename in args.files:
+        with open(filename, "rb") as handin:
+            raw = handin.read()
+        lines = [f"  {filename} ({len(raw)}b)"]
+        if sanitizer:
+            lines.append(f"     sanitizer: {timeIt(lambda: sanitizer(raw), repetitions) * 1e3:9.3f}ms")
+            raw = sanitizer(raw)
+        try:
+            elapsed = timeIt(lambda: module.parsePage(raw, **extraArgs), repetitions)
+            lines.append(f"     parsePage: {elapsed * 1e3:9.3f}ms")
+        except Exception as exc:
+            lines.append(f"     parsePage: failed {type(exc)} {exc}")
+        if args.baseline:
+            baseline = timeIt(lambda: bs4.BeautifulSoup(raw, 'html.parser'), repetitions)
+            lines.append(f"     bs4 tree:  {baseline * 1e3:9.3f}ms")
+        print("\n".join(lines))
+
+    for name, ruleSet in ruleSets.items():
+        print(f"RULES {name}:")
+        for line in ruleSet.timingReport():
+            print(f"     {line}")
+
+
+if __name__ == '__main__':
+
+    auxLocation = os.path.abspath(__file__)
+    base = os.path.dirname(auxLocation)
+
+    src = os.path.dirname(base)
+
+    if src not in sys.path:
+        sys.path.insert(0, src)
+
+    args = parse_arguments()
+    main(args)
@@ -0,0 +1,166 @@
+import logging
+import os
+import sys
+from collections import defaultdict
+from os import path
+from time import perf_counter
+from typing import Callable, Dict, List
+
+from configargparse import ArgParser
+
+logger = logging.getLogger()
+
+FAILEDDATA = list()
+
+
+def parse_arguments():
+    from libs.Utils.Logging import prepareLogger
+    from libs.Cosecha.Config import globalConfig
+
+    descriptionTXT = "Converts metadata files to another format (or measures how long it takes to process them)"
+
+    parser = ArgParser(description=descriptionTXT)
+
+    parser.add_argument('-v', dest='verbose', action="count", env_var='CS_VERBOSE', required=False,
+                        help='Verbose mode (info)', default=0)
+    parser.add_argument('-d', dest='debug', action="store_true", env_var='CS_DEBUG', required=False,
+                        help='Debug mode (debug)', default=False)
+    parser.add_argument('--keep-original', dest='keepOriginal', action="store_true", required=False,
+                        help="Don't remove original file once converted", default=False)
+    parser.add_argument('--benchmark', dest='benchmark', action="store_true", required=False,
+                        help="Don't convert. Measure load & dump time of metadata with every available format",
+                        default=False)
+    parser.add_argument('--sample', dest='sample', type=int, required=False,
+                        help="Benchmark: maximum number of files to use (0 for all)", default=0)
+
+    globalConfig.addSpecificParams(parser)
+
+    args = parser.parse_args()
+
+    logLevel = logging.WARNING
+    if args.verbose:
+        logLevel = logging.INFO
+    elif args.debug:
+        logLevel = logging.DEBUG
+
+    prepareLogger(logger=logger, level=logLevel)
+
+    configGlobal = globalConfig.createFromArgs(args)
+
+    return configGlobal, args
+
+
+def metadataFiles(metadataBase: str):
+    for key in sorted(os.listdir(metadataBase)):
+        fullPath = path.join(metadataBase, key)
+        if not (path.exists(fullPath) and path.isdir(fullPath)):
+            continue
+        for root, dirs, files in os.walk(fullPath):
+            for file in sorted(files):
+                yield path.join(root, file)
+
+
+def convertFile(filename: str, fmt: str, config, keepOriginal: bool = False):
+    from libs.Utils.Files import loadMetadata, metadataFilenameForFormat, metadataFormatFromFilename, saveMetadata
+
+    if metadataFormatFromFilename(filename) == fmt:
+        return False
+
+    data = loadMetadata(filename)
+    if config.dryRun:
+        logging.info(f"{filename} -> {metadataFilenameForFormat(filename, fmt)}")
+        return True
+
+    newFilename = saveMetadata(data, filename, fmt=fmt, removeOthers=False)  # Original is removed once checked
+    if loadMetadata(newFilename) != data:
+        raise ValueError(f"Converted file {newFilename} does not match original {filename}")
+    if not keepOriginal:
+        os.remove(filename)
+
+    return True
+
+
+def benchmarkFormats(files: List[str]):
+    import yaml
+    from libs.Utils.Files import (deserializeMetadata, metadataFormatFromFilename, METADATAFORMATS, msgpack,
+                                  serializeMetadata)
+
+    yamlLabel = 'yaml (libyaml)' if yaml.__with_libyaml__ else 'yaml (python, no libyaml)'
+    loaders: Dict[str, Callable] = {'yaml (python)': lambda raw: yaml.load(raw, Loader=yaml.SafeLoader),
+                                    yamlLabel: lambda raw: deserializeMetadata(raw, 'yaml')}
+    dumpers: Dict[str, Callable] = {
+        'yaml (python)': lambda d: yaml.dump(d, Dumper=yaml.SafeDumper, indent=2, sort_keys=True).encode('utf-8'),
+        yamlLabel: lambda d: serializeMetadata(d, 'yaml')}
+    for fmt in METADATAFORMATS:
+        if fmt == 'yaml' or (fmt == 'msgpack' and msgpack is None):
+            continue
+        loaders[fmt] = (lambda f: (lambda raw: deserializeMetadata(raw, f)))(fmt)
+        dumpers[fmt] = (lambda f: (lambda d: serializeMetadata(d, f)))(fmt)
+
+    contents = []
+    for filename in files:
+        with open(filename, "rb") as handin:
+            raw = handin.read()
+        contents.append(deserializeMetadata(raw, metadataFormatFromFilename(filename)))
+
+    timeLoad = defaultdict(float)
+    timeDump = defaultdict(float)
+    sizes = defaultdict(int)
+    for data in contents:
+        for label, dumper in dumpers.items():
+            timeIn = perf_counter()
+            raw = dumper(data)
+            timeDump[label] += perf_counter() - timeIn
+            sizes[label] += len(raw)
+
+            timeIn = perf_counter()
+            loaders[label](raw)
+            timeLoad[label] += perf_counter() - timeIn
+
+    print(f"Benchmark: {len(contents)} metadata files")
+    print(f"{'format':25} {'load (s)':>10} {'dump (s)':>10} {'load/file (us)':>15} {'size (b)':>12}")
+    for label in dumpers:
+        perFile = (timeLoad[label] / len(contents) * 1e6) if contents else 0
+        print(f"{label:25} {timeLoad[label]:10.3f} {timeDump[label]:10.3f} {perFile:15.1f} {sizes[label]:12}")
+
+
+def main(config, args):
+    metadataBase = config.metadataD()
+
+    if args.benchmark:
+        files = []
+        for filename in metadataFiles(metadataBase):
+            files.append(filename)
+            if args.sample and len(files) >= args.sample:
+                break
+        benchmarkFormats(files)
+        return
+
+    converted = 0
+    for filename in metadataFiles(metadataBase):
+        try:
+            if convertFile(filename, config.metadataFormat, config, keepOriginal=args.keepOriginal):
+                converted += 1
+        except Exception as exc:
+            logging.error(f"{filename}: problems converting file {type(exc)} {exc}")
+            FAILEDDATA.append(filename)
+
+    print(f"Converted to '{config.metadataFormat}': {converted} Failed: {len(FAILEDDATA)}")
+    if FAILEDDATA:
+        print("Failed files:")
+        print("\n".join(FAILEDDATA))
+        print("\n")
+
+
+if __name__ == '__main__':
+
+    auxLocation = os.path.abspath(__file__)
+    base = os.path.dirname(auxLocation)
+
+    src = os.path.dirname(base)
+
+    if src not in sys.path:
+        sys.path.insert(0, src)
+
+    config, args = parse_arguments()
+    main(config, args)
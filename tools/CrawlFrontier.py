@@ -0,0 +1,108 @@
+import logging
+import os
+import re
+import sys
+
+from configargparse import ArgParser
+
+logger = logging.getLogger()
+
+SEEDIDSRE = re.compile(r'^(\d+)-(\d+)$')
+
+
+def parse_arguments():
+    from libs.Utils.Logging import prepareLogger
+    from libs.Cosecha.Config import globalConfig
+
+    descriptionTXT = ("Shows progress of the frontiers of 'crawler' runners (N of M archived, ETA). Frontiers can be "
+                      "seeded with a range of ids so backfills have a plan and workers can share it")
+
+    parser = ArgParser(description=descriptionTXT)
+
+    parser.add_argument('-v', dest='verbose', action="count", env_var='CS_VERBOSE', required=False,
+                        help='Verbose mode (info)', default=0)
+    parser.add_argument('-d', dest='debug', action="store_true", env_var='CS_DEBUG', required=False,
+                        help='Debug mode (debug)', default=False)
+    parser.add_argument('--seed-ids', dest='seedIds', type=str, required=False,
+                        help="Add the comics with ids in range FIRST-LAST to the frontier of runners (plugin must "
+                             "support it). Those already in archive are marked as done", default=None)
+
+    globalConfig.addSpecificParams(parser)
+
+    args = parser.parse_args()
+
+    logLevel = logging.WARNING
+    if args.verbose:
+        logLevel = logging.INFO
+    elif args.debug:
+        logLevel = logging.DEBUG
+
+    prepareLogger(logger=logger, level=logLevel)
+
+    configGlobal = globalConfig.createFromArgs(args)
+
+    return configGlobal, args
+
+
+def seedFrontier(config, runnerCFG, frontier, firstId: int, lastId: int):
+    from libs.Cosecha.Archive import createArchive
+    from libs.Utils.Python import LoadModule
+
+    _, module = LoadModule(moduleName=runnerCFG.module, classLocation="libs.Cosecha.Sites")
+    key = dict(runnerCFG.data['RUNNER']).get('key') or module.KEY
+    if module.Page.idURL(key, str(firstId)) is None:
+        print(f"  '{runnerCFG.name}': module '{runnerCFG.module}' can't get comics by id")
+        return
+
+    archive = createArchive(config)
+    archivedIds = archive.itemIds(key) if archive is not None else set()
+    urls = {comicId: module.Page.idURL(key, str(comicId)) for comicId in range(firstId, lastId + 1)}
+    if config.dryRun:
+        print(f"  '{runnerCFG.name}': would add {len(urls)} URLs ({len(archivedIds.intersection(map(str, urls)))} "
+              f"already archived)")
+        return
+    added = frontier.add(urls.values(), seed=True)
+    frontier.markDone(url for comicId, url in urls.items() if str(comicId) in archivedIds)
+    print(f"  '{runnerCFG.name}': added {added} URLs")
+
+
+def main(config, args):
+    from libs.Cosecha.Frontier import CrawlFrontier
+
+    seedRange = None
+    if args.seedIds:
+        match = SEEDIDSRE.match(args.seedIds)
+        if match is None:
+            print(f"Range of ids '{args.seedIds}' not valid. Expected FIRST-LAST")
+            return
+        seedRange = int(match.group(1)), int(match.group(2))
+
+    dictRunners = config.allRunners()
+    print("FRONTIER REPORT:")
+    for runner in sorted(config.requiredRunners, key=lambda k: k.lower()):
+        runnerCFG = dictRunners.get(runner)
+        if runnerCFG is None:
+            logging.error(f"Requested runner '{runner}' not in list of known runners.")
+            continue
+        frontier = CrawlFrontier(runnerName=runnerCFG.name, storePath=config.stateD()).load()
+        if seedRange is not None:
+            if not runnerCFG.frontier:
+                logging.warning(f"Runner '{runner}' doesn't use frontier ('frontier' in runner conf). Seeding anyway")
+            seedFrontier(config, runnerCFG, frontier, *seedRange)
+        elif not frontier.exists():
+            continue
+        print(f"  {frontier}")
+
+
+if __name__ == '__main__':
+
+    auxLocation = os.path.abspath(__file__)
+    base = os.path.dirname(auxLocation)
+
+    src = os.path.dirname(base)
+
+    if src not in sys.path:
+        sys.path.insert(0, src)
+
+    config, args = parse_arguments()
+    main(config, args)
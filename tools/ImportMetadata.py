@@ -2,8 +2,10 @@ import logging
 import os
 import sys
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import Callable, Optional
+from functools import partial
+from typing import Callable, List, Optional, Set, Tuple
 
 import dateutil.parser as dateparse
 from configargparse import ArgParser
@@ -33,6 +35,14 @@ def parse_arguments():
     parser.add_argument('-l', '--list-runners', dest='listRunners', action="store_true", required=False,
                         help='List all runners', default=False)
 
+    parser.add_argument('-w', '--workers', dest='importWorkers', type=int, required=False,
+                        help='Number of processes parsing metadata files', default=os.cpu_count())
+    parser.add_argument('--import-batch', dest='importBatch', type=int, required=False,
+                        help='Number of records stored in DB on each commit', default=DEFAULTIMPORTBATCH)
+    parser.add_argument('--restart', dest='restartImport', action="store_true", required=False,
+                        help="Ignores checkpoint of previous (interrupted) import and starts from scratch",
+                        default=False)
+
     globalConfig.addSpecificParams(parser)
 
     args = parser.parse_args()
@@ -53,12 +63,16 @@ def parse_arguments():
                   f"batch:{runner.batchSize})")
         sys.exit(0)
 
-    return configGlobal
+    return configGlobal, args
+
 
+from os import makedirs, path
 
-from os import path
+DEFAULTIMPORTBATCH = 500
+CHECKPOINTFILENAME = "ImportMetadata.checkpoint"
 
 KEYS2IGNORE = {'fullFilename', 'saveMetadataPath', 'image'}
+MEDIAKEYS = {'mediaSize', 'fname', 'mediaHash'}  # Fields that need the media (local file or network)
 KEYTRANSLATOR = {'id': 'comicId', 'url': 'URL', 'filename': 'fname', 'urlImg': 'mediaURL', 'datePublished': 'comicDate',
                  }
 
@@ -74,7 +88,7 @@ def parseDates(d: str) -> datetime:
     return res
 
 
-def createDBmetadataRecord(data, dbStore):
+def createDBmetadataRecord(data, dbStore, doCommit: bool = True):
     from libs.Utils.Misc import prepareBuilderPayloadDict
 
     newData = prepareBuilderPayloadDict(source=data, dest=dbStore.obj.ImageMetadata)
@@ -82,12 +96,13 @@ def createDBmetadataRecord(data, dbStore):
     for k in newData:
         newData['info'].pop(k, None)
     dbData = dbStore.obj.ImageMetadata(**newData)
-    commit()
+    if doCommit:
+        commit()
 
     return dbData
 
 
-def updateDBmetadataRecord(data, dbStore):
+def updateDBmetadataRecord(data, dbStore, doCommit: bool = True):
     from libs.Utils.Misc import prepareBuilderPayloadDict
 
     try:
@@ -100,23 +115,106 @@ def updateDBmetadataRecord(data, dbStore):
             newElems['info'].pop(k, None)
 
         currRecord.set(**newElems)
-        commit()
+        if doCommit:
+            commit()
 
         result = dbStore.obj.ImageMetadata[data['key'], data['comicId']]
         return result
 
     except dbStore.obj.RowNotFound as exc:
-        newRecord = createDBmetadataRecord(data, dbStore=dbStore)
+        newRecord = createDBmetadataRecord(data, dbStore=dbStore, doCommit=doCommit)
         return newRecord
 
 
 KEYTRANSLATORFUNC = {'timestamp': parseDates}
 
 
-def main(config):
+def findLocalMedia(metadata: dict, imagesDir: str) -> Optional[str]:
+    if 'fullFilename' in metadata and path.exists(metadata['fullFilename']):
+        return metadata['fullFilename']
+
+    fName = metadata.get('fname', metadata.get('filename', None))
+    if fName is None:
+        return None
+    result = path.join(imagesDir, fName)
+
+    return result if path.exists(result) else None
+
+
+def parseMetadataFile(fileData: Tuple[str, str, str], imagesBase: str, fieldNames: Set[str]):
+    """
+    Reads a metadata file and builds the dict for the DB record. Runs on worker processes so anything that can be
+    done without the network (sizes and names of media from local files) is done here.
+    :param fileData: tuple (key, path relative to metadata directory, full filename)
+    :param imagesBase: directory of images
+    :param fieldNames: fields of DB record
+    :return: tuple (full filename, record dict, missing keys). Record is None if file couldn't be read
+    """
+    from libs.Utils.Files import loadMetadata, shaFile
+
+    key, relDir, fullFile = fileData
+    try:
+        metadata: dict = loadMetadata(fullFile)
+    except Exception as exc:
+        logging.error(f"{fullFile}: unable to read metadata {type(exc)} {exc}")
+        return fullFile, None, set()
+
+    newHash = {'key': key, 'info': dict()}
+
+    for k, v in metadata.items():
+        if k in KEYTRANSLATORFUNC:
+            v = KEYTRANSLATORFUNC[k](v)
+
+        if k in KEYS2IGNORE:
+            continue
+        elif k in fieldNames:
+            newHash[k] = v
+        elif k in KEYTRANSLATOR:
+            newHash[KEYTRANSLATOR[k]] = v
+        else:
+            newHash['info'][k] = v
+
+    missingKeys = fieldNames.difference(newHash.keys())
+    if missingKeys.intersection(MEDIAKEYS):
+        mediaFile = findLocalMedia(metadata, path.join(imagesBase, relDir))
+        if mediaFile is not None:
+            newHash.setdefault('mediaSize', path.getsize(mediaFile))
+            newHash.setdefault('fname', path.basename(mediaFile))
+            newHash.setdefault('mediaHash', shaFile(mediaFile))
+            missingKeys = fieldNames.difference(newHash.keys())
+
+    return fullFile, newHash, missingKeys
+
+
+def loadCheckpoint(checkpointFile: str) -> Set[str]:
+    if not path.exists(checkpointFile):
+        return set()
+
+    with open(checkpointFile, "r") as handin:
+        result = {line.rstrip("\n") for line in handin if line.strip()}
+
+    return result
+
+
+def storeBatch(batch: List[Tuple[str, dict]], dbStore, checkpointFile: str):
+    """
+    Stores a batch of records with a single commit and then records the files as done in checkpoint
+    """
+    if not batch:
+        return
+
+    for fullFile, newHash in batch:
+        updateDBmetadataRecord(newHash, dbStore, doCommit=False)
+    commit()
+
+    with open(checkpointFile, "a") as handout:
+        handout.write("".join(f"{fullFile}\n" for fullFile, _ in batch))
+
+
+def main(config, args):
     from libs.Cosecha.ComicPage import ComicPage
     from libs.Cosecha.Harvest import Harvest
-    from libs.Utils.Files import loadYAML
+    from libs.Utils.Web import negativeCache
 
     global commit
 
@@ -127,6 +225,14 @@ def main(config):
     session_manager = cosecha.dataStore.module.session_manager
     commit = cosecha.dataStore.module.commit
 
+    makedirs(cosecha.globalCFG.stateD(), mode=0o755, exist_ok=True)
+    checkpointFile = path.join(cosecha.globalCFG.stateD(), CHECKPOINTFILENAME)
+    if args.restartImport and path.exists(checkpointFile):
+        os.remove(checkpointFile)
+    alreadyDone = loadCheckpoint(checkpointFile)
+    if alreadyDone:
+        print(f"Resuming import. Files already processed: {len(alreadyDone)}")
+
     with session_manager(immediate=True, optimistic=False, serializable=True, sql_debug=cosecha.globalCFG.verbose,
                          show_values=cosecha.globalCFG.verbose):
         cosecha.prepare()
@@ -137,61 +243,66 @@ def main(config):
         metadataClass = cosecha.dataStore.obj.ImageMetadata
         fieldNames = {att.name for att in metadataClass._attrs_}
 
-        for key in os.listdir(metadataBase):
-            print(f"Key: {key}")
+        pendingFiles = []
+        for key in sorted(os.listdir(metadataBase)):
             fullPath = path.join(metadataBase, key)
             if not (path.exists(fullPath) and path.isdir(fullPath)):
                 continue
 
             for root, dirs, files in os.walk(fullPath):
-                if not files:
-                    continue
-                for file in files:
-
+                relDir = path.relpath(root, metadataBase)
+                for file in sorted(files):
                     fullFile = path.join(root, file)
-                    metadata: dict = loadYAML(fullFile)
-
-                    newHash = {'key': key, 'info': dict()}
-
-                    for k, v in metadata.items():
-                        if k in KEYTRANSLATORFUNC:
-                            v = KEYTRANSLATORFUNC[k](v)
-
-                        if k in KEYS2IGNORE:
-                            continue
-                        elif k in fieldNames:
-                            newHash[k] = v
-                        elif k in KEYTRANSLATOR:
-                            newHash[KEYTRANSLATOR[k]] = v
-                        else:
-                            newHash['info'][k] = v
-                            if k == 'image':
-                                print(file, key, k, v)
-
-                    missingKeys = fieldNames.difference(newHash.keys())
-                    if missingKeys:
-                        imgDownloader: ComicPage = key2crawler[key].module.Page(**newHash)
-                        try:
-                            imgDownloader.downloadMedia()
-                        except HTTPError:
-                            logging.error(
-                                f"{fullFile}: Problems downloading media {imgDownloader.URL}: {imgDownloader.mediaURL}")
-                            FAILEDDATA.append(fullFile)
-                            continue
-
-                        if 'mediaSize' in missingKeys:
-                            newHash['mediaSize'] = imgDownloader.size()
-                        if 'fname' in missingKeys:
-                            newHash['fname'] = imgDownloader.dataFilename()
-
-                        updateDBmetadataRecord(newHash, cosecha.dataStore)
-
-                    print(f"Processed: {fullPath} -> {newHash['key']},{newHash['comicId']}")
+                    if fullFile not in alreadyDone:
+                        pendingFiles.append((key, relDir, fullFile))
+        print(f"Files to import: {len(pendingFiles)}")
+
+        parser = partial(parseMetadataFile, imagesBase=cosecha.globalCFG.imagesD(), fieldNames=fieldNames)
+        batch: List[Tuple[str, dict]] = []
+        with ProcessPoolExecutor(max_workers=max(1, args.importWorkers)) as executor:
+            for fullFile, newHash, missingKeys in executor.map(parser, pendingFiles, chunksize=64):
+                if newHash is None:
+                    FAILEDDATA.append(fullFile)
+                    continue
+                missingMediaKeys = missingKeys.intersection(MEDIAKEYS)
+                if missingMediaKeys:
+                    # No local copy of media. Last resort: the network (other missing fields are left empty)
+                    imgDownloader: ComicPage = key2crawler[newHash['key']].module.Page(**newHash)
+                    try:
+                        imgDownloader.downloadMedia()
+                    except HTTPError as exc:
+                        logging.error(
+                            f"{fullFile}: Problems downloading media {imgDownloader.URL}: {imgDownloader.mediaURL} "
+                            f"{exc}")
+                        FAILEDDATA.append(fullFile)
+                        continue
+
+                    if 'mediaSize' in missingMediaKeys:
+                        newHash['mediaSize'] = imgDownloader.size()
+                    if 'fname' in missingMediaKeys:
+                        newHash['fname'] = imgDownloader.dataFilename()
+                    if 'mediaHash' in missingMediaKeys:
+                        newHash['mediaHash'] = imgDownloader.mediaHash
+
+                batch.append((fullFile, newHash))
+                logging.info(f"Processed: {fullFile} -> {newHash['key']},{newHash['comicId']}")
+
+                if len(batch) >= args.importBatch:
+                    storeBatch(batch, cosecha.dataStore, checkpointFile)
+                    print(f"Stored {len(batch)} records. Last one: {fullFile}")
+                    batch = []
+        storeBatch(batch, cosecha.dataStore, checkpointFile)
+
+    if not config.dryRun:
+        negativeCache.store()
 
     if FAILEDDATA:
         print("Failed files:")
         print("\n".join(FAILEDDATA))
         print("\n")
+    elif path.exists(checkpointFile):
+        # Everything is in. Next import will start from scratch
+        os.remove(checkpointFile)
 
 
 if __name__ == '__main__':
@@ -204,5 +315,5 @@ if __name__ == '__main__':
     if src not in sys.path:
         sys.path.insert(0, src)
 
-    config = parse_arguments()
-    main(config)
+    config, args = parse_arguments()
+    main(config, args)
@@ -0,0 +1,178 @@
+import logging
+import os
+import sys
+from collections import defaultdict
+from os import path
+
+from configargparse import ArgParser
+
+logger = logging.getLogger()
+
+PACKSTATS = defaultdict(int)
+FAILEDDATA = list()
+
+
+def parse_arguments():
+    from libs.Utils.Logging import prepareLogger
+    from libs.Cosecha.Config import globalConfig
+
+    descriptionTXT = "Moves images & metadata files stored as a tree of files into pack files"
+
+    parser = ArgParser(description=descriptionTXT)
+
+    parser.add_argument('-v', dest='verbose', action="count", env_var='CS_VERBOSE', required=False,
+                        help='Verbose mode (info)', default=0)
+    parser.add_argument('-d', dest='debug', action="store_true", env_var='CS_DEBUG', required=False,
+                        help='Debug mode (debug)', default=False)
+    parser.add_argument('--remove-migrated', dest='removeMigrated', action="store_true", required=False,
+                        help='Removes original files once they are stored (and verified) in pack', default=False)
+
+    globalConfig.addSpecificParams(parser)
+
+    args = parser.parse_args()
+
+    logLevel = logging.WARNING
+    if args.verbose:
+        logLevel = logging.INFO
+    elif args.debug:
+        logLevel = logging.DEBUG
+
+    prepareLogger(logger=logger, level=logLevel)
+
+    configGlobal = globalConfig.createFromArgs(args)
+
+    return configGlobal, args
+
+
+def findMediaFile(metadata: dict, imagesDir: str):
+    if 'fullFilename' in metadata and path.exists(metadata['fullFilename']):
+        return metadata['fullFilename']
+
+    fName = metadata.get('fname', metadata.get('filename', None))
+    if fName is None:
+        return None
+    result = path.join(imagesDir, fName)
+
+    return result if path.exists(result) else None
+
+
+def pageFromMetadata(pageClass, key: str, comicId: str, metadata: dict):
+    """
+    ComicPage of a stored comic, enough to know where its files go (dataPath)
+    """
+    result = pageClass(key=key, URL=metadata.get('url'), comicId=comicId)
+    result.comicDate = metadata.get('datePublished')
+
+    return result
+
+
+def migrateFile(metadataFile: str, key: str, pageClass, config, packs: dict, removeMigrated: bool = False):
+    """
+    :param packs: dataDir -> PackFile already loaded (index of a pack is read only once per directory)
+    """
+    from libs.Utils.Files import loadMetadata, metadataFormatFromFilename, shaData
+    from libs.Utils.PackFile import PackFile
+
+    metadata: dict = loadMetadata(metadataFile)
+    comicId = metadata.get('comicId', metadata.get('id', None))
+    if comicId is None:
+        logging.error(f"{metadataFile}: unable to find comic id")
+        FAILEDDATA.append(metadataFile)
+        return
+    comicId = str(comicId)
+
+    # Images (and packs) go where ComicPage.dataPath says, which may not be the directory of the metadata file
+    dataDir = path.join(config.imagesD(), *(pageFromMetadata(pageClass, key, comicId, metadata).dataPath()))
+    mediaFile = findMediaFile(metadata, dataDir)
+    if mediaFile is None:
+        logging.error(f"{metadataFile}: unable to find media file")
+        FAILEDDATA.append(metadataFile)
+        return
+
+    with open(mediaFile, "rb") as handin:
+        mediaData = handin.read()
+    mediaHash = shaData(mediaData)
+    if metadata.get('mediaHash', mediaHash) != mediaHash:
+        logging.error(f"{metadataFile}: hash for {mediaFile} does not match the one in metadata. Skipping")
+        FAILEDDATA.append(metadataFile)
+        return
+
+    with open(metadataFile, "rb") as handin:
+        rawMetadata = handin.read()
+
+    if dataDir not in packs:
+        packs[dataDir] = PackFile(dataDir).load()
+    pack = packs[dataDir]
+    entry = pack.entry(comicId)
+    if entry is None or entry.get('mediaHash') != mediaHash:
+        if config.dryRun:
+            logging.info(f"{metadataFile}: would be stored in {pack.packFilename}")
+            PACKSTATS['migrated'] += 1
+            return
+        extra = {'fname': path.basename(mediaFile), 'mediaHash': mediaHash, 'mimeType': metadata.get('mimeType'),
+                 'metadataFormat': metadataFormatFromFilename(metadataFile)}
+        pack.append(comicId, blobs={'media': mediaData, 'metadata': rawMetadata}, extra=extra)
+        PACKSTATS['migrated'] += 1
+    else:
+        PACKSTATS['alreadyThere'] += 1
+
+    if removeMigrated and not config.dryRun:
+        if shaData(pack.read(comicId, 'media')) != mediaHash:
+            logging.error(f"{metadataFile}: data in pack {pack.packFilename} does not match file. Keeping it")
+            FAILEDDATA.append(metadataFile)
+            return
+        os.remove(mediaFile)
+        os.remove(metadataFile)
+        PACKSTATS['removed'] += 1
+
+
+def main(config, args):
+    from libs.Cosecha.Harvest import Harvest
+
+    config.ignorePollInterval = True
+    cosecha = Harvest(config=config, ignoreEnabled=True)
+    cosecha.prepare()
+    key2crawler = {crwl.key: crwl for crwl in cosecha.crawlers}
+
+    metadataBase = config.metadataD()
+
+    for key in sorted(os.listdir(metadataBase)):
+        fullPath = path.join(metadataBase, key)
+        if not (path.exists(fullPath) and path.isdir(fullPath)):
+            continue
+        if key not in key2crawler:
+            logging.error(f"Key '{key}': no runner for it. Unable to know where its files go. Skipped")
+            continue
+        print(f"Key: {key}")
+        packs = dict()
+
+        for root, dirs, files in os.walk(fullPath):
+            for file in sorted(files):
+                fullFile = path.join(root, file)
+                try:
+                    migrateFile(fullFile, key, key2crawler[key].module.Page, config, packs,
+                                removeMigrated=args.removeMigrated)
+                except Exception as exc:
+                    logging.error(f"{fullFile}: problems migrating file {type(exc)} {exc}")
+                    FAILEDDATA.append(fullFile)
+
+    print(f"Migrated: {PACKSTATS['migrated']} Already in pack: {PACKSTATS['alreadyThere']} "
+          f"Removed: {PACKSTATS['removed']} Failed: {len(FAILEDDATA)}")
+    if FAILEDDATA:
+        print("Failed files:")
+        print("\n".join(FAILEDDATA))
+        print("\n")
+
+
+if __name__ == '__main__':
+
+    auxLocation = os.path.abspath(__file__)
+    base = os.path.dirname(auxLocation)
+
+    src = os.path.dirname(base)
+
+    if src not in sys.path:
+        sys.path.insert(0, src)
+
+    config, args = parse_arguments()
+    main(config, args)
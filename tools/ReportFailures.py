@@ -0,0 +1,78 @@
+import logging
+import os
+import sys
+from os import path
+
+from configargparse import ArgParser
+
+logger = logging.getLogger()
+
+
+def parse_arguments():
+    from libs.Utils.Logging import prepareLogger
+    from libs.Cosecha.Config import globalConfig
+    from libs.Utils.NegativeCache import CHRONICATTEMPTS
+
+    descriptionTXT = "Shows URLs that keep failing (and are not requested until their retry window is over)"
+
+    parser = ArgParser(description=descriptionTXT)
+
+    parser.add_argument('-v', dest='verbose', action="count", env_var='CS_VERBOSE', required=False,
+                        help='Verbose mode (info)', default=0)
+    parser.add_argument('-d', dest='debug', action="store_true", env_var='CS_DEBUG', required=False,
+                        help='Debug mode (debug)', default=False)
+    parser.add_argument('--min-attempts', dest='minAttempts', type=int, required=False,
+                        help=f"Minimum number of failures to show an URL (default: {CHRONICATTEMPTS})",
+                        default=CHRONICATTEMPTS)
+    parser.add_argument('--forget', dest='forget', action="store_true", required=False,
+                        help="Remove shown URLs from cache so they are requested again next time", default=False)
+
+    globalConfig.addSpecificParams(parser)
+
+    args = parser.parse_args()
+
+    logLevel = logging.WARNING
+    if args.verbose:
+        logLevel = logging.INFO
+    elif args.debug:
+        logLevel = logging.DEBUG
+
+    prepareLogger(logger=logger, level=logLevel)
+
+    configGlobal = globalConfig.createFromArgs(args)
+
+    return configGlobal, args
+
+
+def main(config, args):
+    from libs.Utils.NegativeCache import NEGATIVECACHEFILENAME, NegativeCache
+
+    cache = NegativeCache(path.join(config.stateD(), NEGATIVECACHEFILENAME)).load()
+    failures = cache.chronic(minAttempts=max(1, args.minAttempts))
+
+    print(f"FAILURES REPORT: {len(failures)}/{len(cache)} URLs failed at least {args.minAttempts} times")
+    for url, _ in failures:
+        print(f"  {cache.describe(url)}")
+
+    if args.forget and failures:
+        if config.dryRun:
+            print(f"Would forget: {len(failures)} URLs")
+            return
+        for url, _ in failures:
+            cache.forget(url)
+        cache.store()
+        print(f"Forgotten: {len(failures)} URLs")
+
+
+if __name__ == '__main__':
+
+    auxLocation = os.path.abspath(__file__)
+    base = os.path.dirname(auxLocation)
+
+    src = os.path.dirname(base)
+
+    if src not in sys.path:
+        sys.path.insert(0, src)
+
+    config, args = parse_arguments()
+    main(config, args)
@@ -0,0 +1,391 @@
+import json
+import logging
+import os
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from os import makedirs, path
+from typing import Dict, List, Optional, Tuple
+
+from configargparse import ArgParser
+from requests import HTTPError
+
+logger = logging.getLogger()
+
+VERIFYCACHEFILENAME = "VerifyArchive.cache"
+DEFAULTVERIFYWORKERS = 8
+ARCHIVEEXTENSIONS = {'.pack', '.idx'}
+
+
+def parse_arguments():
+    from libs.Utils.Logging import prepareLogger
+    from libs.Cosecha.Config import globalConfig
+
+    descriptionTXT = "Checks images of archive against the hashes stored in metadata (DB or files)"
+
+    parser = ArgParser(description=descriptionTXT)
+
+    parser.add_argument('-v', dest='verbose', action="count", env_var='CS_VERBOSE', required=False,
+                        help='Verbose mode (info)', default=0)
+    parser.add_argument('-d', dest='debug', action="store_true", env_var='CS_DEBUG', required=False,
+                        help='Debug mode (debug)', default=False)
+    parser.add_argument('-w', '--workers', dest='verifyWorkers', type=int, required=False,
+                        help='Number of threads hashing files', default=DEFAULTVERIFYWORKERS)
+    parser.add_argument('--no-cache', dest='noCache', action="store_true", required=False,
+                        help="Hash every file even if it hasn't changed since last verification", default=False)
+    parser.add_argument('--repair', dest='repair', action="store_true", required=False,
+                        help="Download again missing or corrupt images", default=False)
+    parser.add_argument('--check-remote', dest='checkRemote', action="store_true", required=False,
+                        help="Check (without downloading them) if images have changed in their sites. Repair skips "
+                             "those that changed", default=False)
+
+    globalConfig.addSpecificParams(parser)
+
+    args = parser.parse_args()
+
+    logLevel = logging.WARNING
+    if args.verbose:
+        logLevel = logging.INFO
+    elif args.debug:
+        logLevel = logging.DEBUG
+
+    prepareLogger(logger=logger, level=logLevel)
+
+    configGlobal = globalConfig.createFromArgs(args)
+
+    return configGlobal, args
+
+
+class HashCache:
+    """
+    Hashes of files already verified. An entry is valid while size and mtime of file are the same.
+    """
+
+    def __init__(self, filename: Optional[str]):
+        self.filename: Optional[str] = filename
+        self.data: Dict[str, list] = dict()
+
+    def load(self):
+        if self.filename and path.exists(self.filename):
+            with open(self.filename, "r") as handin:
+                self.data = json.load(handin)
+        return self
+
+    def store(self):
+        if not self.filename:
+            return
+        with open(self.filename, "w") as handout:
+            json.dump(self.data, handout)
+
+    def get(self, filename: str, fileStat: os.stat_result) -> Optional[str]:
+        entry = self.data.get(filename)
+        if entry and entry[0] == fileStat.st_size and entry[1] == fileStat.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def set(self, filename: str, fileStat: os.stat_result, hashValue: str):
+        self.data[filename] = [fileStat.st_size, fileStat.st_mtime_ns, hashValue]
+
+
+def expectedFromMetadataFiles(metadataBase: str, imagesBase: str) -> List[dict]:
+    from libs.Utils.Files import loadMetadata
+
+    result = []
+    for key in sorted(os.listdir(metadataBase)):
+        fullPath = path.join(metadataBase, key)
+        if not (path.exists(fullPath) and path.isdir(fullPath)):
+            continue
+        for root, dirs, files in os.walk(fullPath):
+            relDir = path.relpath(root, metadataBase)
+            for file in sorted(files):
+                metadataFile = path.join(root, file)
+                try:
+                    metadata = loadMetadata(metadataFile)
+                except Exception as exc:
+                    logging.error(f"{metadataFile}: unable to read metadata {type(exc)} {exc}")
+                    continue
+                comicId = metadata.get('comicId', metadata.get('id'))
+                if comicId is None:
+                    logging.warning(f"{metadataFile}: no comic id in metadata. Skipped")
+                    continue
+                fName = metadata.get('fname', metadata.get('filename', None))
+                fullFilename = metadata.get('fullFilename') or (path.join(imagesBase, relDir, fName) if fName else None)
+                result.append({'key': key, 'comicId': str(comicId),
+                               'URL': metadata.get('URL', metadata.get('url')),
+                               'mediaURL': metadata.get('mediaURL', metadata.get('urlImg')),
+                               'mediaHash': metadata.get('mediaHash'), 'mediaSize': metadata.get('mediaSize'),
+                               'mediaETag': metadata.get('mediaETag'), 'fname': fName, 'filename': fullFilename,
+                               'source': metadataFile})
+    return result
+
+
+def expectedFromDB(dbStore, imageFiles: Dict[str, List[str]]) -> List[dict]:
+    result = []
+    for record in dbStore.obj.ImageMetadata.select():
+        if record.comicId is None:
+            logging.warning(f"'{record.key}': DB record without comic id. Skipped")
+            continue
+        candidates = imageFiles.get(record.fname, [])
+        if len(candidates) > 1:
+            logging.warning(f"'{record.key}' {record.comicId}: several files named '{record.fname}': {candidates}")
+        result.append({'key': record.key, 'comicId': record.comicId, 'URL': record.URL, 'mediaURL': record.mediaURL,
+                       'mediaHash': record.mediaHash, 'mediaSize': record.mediaSize,
+                       'mediaETag': (record.info or {}).get('mediaETag'), 'fname': record.fname,
+                       'filename': candidates[0] if candidates else None, 'source': 'DB'})
+    return result
+
+
+def findImageFiles(imagesBase: str) -> Dict[str, List[str]]:
+    result = defaultdict(list)
+    for root, dirs, files in os.walk(imagesBase):
+        for file in files:
+            if path.splitext(file)[1] in ARCHIVEEXTENSIONS:
+                continue
+            result[file].append(path.join(root, file))
+    return result
+
+
+def hashFile(filename: str, cache: HashCache) -> Tuple[str, Optional[str], bool]:
+    """
+    Hash of a file (shaFile streams it with large reads and hashlib releases the GIL meanwhile)
+    :return: tuple (filename, hash, True if hash came from cache)
+    """
+    from libs.Utils.Files import shaFile
+
+    try:
+        fileStat = os.stat(filename)
+    except FileNotFoundError:
+        return filename, None, False
+    cachedHash = cache.get(filename, fileStat)
+    if cachedHash is not None:
+        return filename, cachedHash, True
+
+    result = shaFile(filename)
+    cache.set(filename, fileStat, result)
+
+    return filename, result, False
+
+
+def expectedFromPackEntry(pack, entry: dict, imagesBase: str) -> dict:
+    """
+    Data of an item stored in a pack (as the ones from metadata files or DB) so it can be repaired. Page URL is only
+    known if the item has metadata
+    """
+    from libs.Utils.Files import deserializeMetadata
+
+    metadata = dict()
+    if 'metadata' in entry['blobs']:
+        try:
+            metadata = deserializeMetadata(pack.read(entry['id'], 'metadata'), entry.get('metadataFormat', 'yaml'))
+        except Exception as exc:
+            logging.error(f"{pack} '{entry['id']}': unable to read metadata {type(exc)} {exc}")
+    key = metadata.get('key') or path.relpath(pack.basename, imagesBase).split(os.sep)[0]
+    result = {'key': key, 'comicId': entry['id'], 'URL': metadata.get('url'), 'mediaURL': entry.get('mediaURL'),
+              'mediaHash': entry.get('mediaHash'), 'mediaSize': entry.get('mediaSize'),
+              'mediaETag': entry.get('mediaETag'), 'fname': entry.get('fname'), 'filename': None, 'pack': pack,
+              'source': f"{pack.basename}#{entry['id']}"}
+    return result
+
+
+def verifyPacks(imagesBase: str, cache: HashCache, workers: int) -> Tuple[int, int, List[dict]]:
+    """
+    Checks the items stored in pack files against the hashes in their indexes. Blobs are never rewritten so they are
+    cached by position in pack
+    :return: tuple (number of items checked, number of items hashed, list of corrupt items, see expectedFromPackEntry)
+    """
+    from libs.Utils.Files import shaData
+    from libs.Utils.PackFile import INDEXEXTENSION, PackFile
+
+    items = []
+    for root, dirs, files in os.walk(imagesBase):
+        for file in files:
+            if file.endswith(f".{INDEXEXTENSION}"):
+                pack = PackFile(path.join(root, file.removesuffix(f".{INDEXEXTENSION}"))).load()
+                items.extend((pack, entry) for entry in pack.entries() if 'media' in entry['blobs'] and entry['id'])
+
+    def checkItem(pack: PackFile, entry: dict):
+        offset, size = entry['blobs']['media']
+        cacheKey = f"{pack.packFilename}@{offset}"
+        cached = cache.data.get(cacheKey)
+        if cached and cached[0] == size:
+            return (pack, entry), cached[2] == entry.get('mediaHash'), False
+        try:
+            hashValue = shaData(pack.read(entry['id'], 'media'))
+            cache.data[cacheKey] = [size, 0, hashValue]
+        except (KeyError, ValueError) as exc:
+            logging.error(f"{pack}: {exc}")
+            hashValue = None
+        return (pack, entry), hashValue == entry.get('mediaHash'), True
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda i: checkItem(*i), items))
+
+    corrupt = [expectedFromPackEntry(pack, entry, imagesBase) for (pack, entry), ok, _ in results if not ok]
+    return len(results), sum(hashed for _, _, hashed in results), corrupt
+
+
+def checkRemote(items: List[dict], cosecha, workers: int) -> Dict[Tuple[str, str], Optional[bool]]:
+    """
+    Compares size and ETag of images in their sites with the ones recorded (HEAD requests, nothing is downloaded)
+    :return: dict (key, comicId) -> True if changed, False if same, None if it can't be told
+    """
+    key2crawler = {crwl.key: crwl for crwl in cosecha.crawlers}
+
+    def checkItem(item: dict) -> Optional[bool]:
+        pageData = {k: item[k] for k in ['key', 'comicId', 'URL', 'mediaURL'] if item[k]}
+        try:
+            return key2crawler[item['key']].module.Page(**pageData).remoteMediaChanged(item)
+        except (HTTPError, KeyError) as exc:
+            logging.error(f"'{item['key']}' {item['comicId']}: unable to check {item['mediaURL']}: {exc}")
+            return None
+
+    candidates = [item for item in items if item['key'] in key2crawler and item['URL'] and item['mediaURL'] and (
+            item.get('mediaSize') or item.get('mediaETag'))]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(checkItem, candidates))
+
+    return {(item['key'], item['comicId']): changed for item, changed in zip(candidates, results)}
+
+
+def repairItems(items: List[dict], cosecha, config, remoteStatus: Optional[Dict[Tuple[str, str], bool]] = None):
+    key2crawler = {crwl.key: crwl for crwl in cosecha.crawlers}
+    repaired = []
+    for item in items:
+        if item['key'] not in key2crawler or not item['URL']:
+            logging.error(f"'{item['key']}' {item['comicId']}: no runner (or URL) to download it again")
+            continue
+        if not (item['filename'] or item.get('pack')):
+            logging.error(f"'{item['key']}' {item['comicId']}: unable to find where file should be")
+            continue
+        if remoteStatus and remoteStatus.get((item['key'], item['comicId'])):
+            logging.warning(f"'{item['key']}' {item['comicId']}: media changed in site. Not downloaded")
+            continue
+        pageData = {k: item[k] for k in ['key', 'comicId', 'URL', 'mediaURL'] if item[k]}
+        page = key2crawler[item['key']].module.Page(**pageData)
+        try:
+            page.downloadMedia()
+        except HTTPError as exc:
+            logging.error(f"'{item['key']}' {item['comicId']}: problems downloading {page.mediaURL}: {exc}")
+            continue
+        if page.mediaHash != item['mediaHash']:
+            logging.warning(f"'{item['key']}' {item['comicId']}: downloaded media differs from stored hash. Site "
+                            f"may have changed it")
+        if config.dryRun:
+            print(f"Would repair: {item['filename'] or item['source']}")
+            continue
+        if item.get('pack'):
+            repairPackItem(item['pack'], item['comicId'], page)
+            repaired.append(item['source'])
+            continue
+        makedirs(path.dirname(item['filename']), mode=0o755, exist_ok=True)
+        with open(item['filename'], "wb") as handout:
+            handout.write(page.data)
+        repaired.append(item['filename'])
+
+    return repaired
+
+
+def repairPackItem(pack, comicId: str, page):
+    """
+    Appends a new version of the item to its pack with the media downloaded again (metadata and index fields are kept)
+    """
+    entry = pack.entry(comicId)
+    extra = {k: v for k, v in entry.items() if k not in {'id', 'blobs'}}
+    blobs = {'media': page.data}
+    if 'metadata' in entry['blobs']:
+        blobs['metadata'] = pack.read(comicId, 'metadata')
+    pack.append(comicId, blobs=blobs, extra=extra)
+
+
+def verify(cosecha, config, args):
+    imagesBase = config.imagesD()
+    cacheFile = None if args.noCache else path.join(config.stateD(), VERIFYCACHEFILENAME)
+    cache = HashCache(cacheFile).load()
+
+    imageFiles = findImageFiles(imagesBase)
+    if cosecha.dataStore is not None:
+        expected = expectedFromDB(cosecha.dataStore, imageFiles)
+    else:
+        expected = expectedFromMetadataFiles(config.metadataD(), imagesBase)
+
+    missing = []
+    corrupt = []
+    toHash = sorted({item['filename'] for item in expected if item['filename'] and path.exists(item['filename'])})
+    with ThreadPoolExecutor(max_workers=max(1, args.verifyWorkers)) as executor:
+        hashResults = list(executor.map(lambda f: hashFile(f, cache), toHash))
+    hashes = {filename: hashValue for filename, hashValue, _ in hashResults}
+    numHashed = sum(1 for _, _, fromCache in hashResults if not fromCache)
+
+    referenced = set()
+    for item in expected:
+        if not item['filename'] or item['filename'] not in hashes:
+            missing.append(item)
+            continue
+        referenced.add(item['filename'])
+        if hashes[item['filename']] != item['mediaHash']:
+            corrupt.append(item)
+
+    orphans = sorted(f for files in imageFiles.values() for f in files if f not in referenced)
+
+    numPacked, numPackHashed, corruptPacked = verifyPacks(imagesBase, cache, max(1, args.verifyWorkers))
+
+    makedirs(config.stateD(), mode=0o755, exist_ok=True)
+    cache.store()
+
+    print(f"VERIFY REPORT: {len(expected)} images ({numHashed} hashed, {len(toHash) - numHashed} from cache) "
+          f"Missing: {len(missing)} Corrupt: {len(corrupt)} Orphaned: {len(orphans)} Packed: {numPacked} "
+          f"({numPackHashed} hashed, corrupt: {len(corruptPacked)})")
+    for label, items in [('Missing', missing), ('Corrupt', corrupt)]:
+        for item in items:
+            print(f"  {label}: '{item['key']}' {item['comicId']} {item['filename'] or item['fname']} "
+                  f"({item['source']})")
+    for orphan in orphans:
+        print(f"  Orphaned: {orphan}")
+    for item in corruptPacked:
+        print(f"  Corrupt (pack): '{item['key']}' {item['comicId']} {item['source']}")
+
+    remoteStatus = None
+    if args.checkRemote:
+        remoteStatus = checkRemote(expected + corruptPacked, cosecha, max(1, config.hostConcurrency))
+        changed = sorted(k for k, v in remoteStatus.items() if v)
+        unknown = sum(1 for v in remoteStatus.values() if v is None)
+        print(f"REMOTE REPORT: {len(remoteStatus)} images checked. Changed: {len(changed)} Unknown: {unknown}")
+        for key, comicId in changed:
+            print(f"  Changed remotely: '{key}' {comicId}")
+
+    toRepair = missing + corrupt + corruptPacked
+    if args.repair and toRepair:
+        repaired = repairItems(toRepair, cosecha, config, remoteStatus)
+        print(f"Repaired: {len(repaired)}/{len(toRepair)}")
+
+
+def main(config, args):
+    from libs.Cosecha.Harvest import Harvest
+
+    config.ignorePollInterval = True
+    cosecha = Harvest(config=config, ignoreEnabled=True)
+
+    if config.storeCFG:
+        cosecha.prepareStorage()
+        session_manager = cosecha.dataStore.module.session_manager
+        with session_manager(immediate=True, optimistic=False, serializable=True, sql_debug=config.verbose,
+                             show_values=config.verbose):
+            cosecha.prepare()
+            verify(cosecha, config, args)
+    else:
+        cosecha.prepare()
+        verify(cosecha, config, args)
+
+
+if __name__ == '__main__':
+
+    auxLocation = os.path.abspath(__file__)
+    base = os.path.dirname(auxLocation)
+
+    src = os.path.dirname(base)
+
+    if src not in sys.path:
+        sys.path.insert(0, src)
+
+    config, args = parse_arguments()
+    main(config, args)